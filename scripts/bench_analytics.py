@@ -0,0 +1,190 @@
+"""
+Analytics Query Benchmark for AI Mau Bot
+1. Compares typical generate_sql style queries (datetime(start_at) comparisons on TEXT)
+   against the rewritten, index-friendly predicates on start_epoch / start_date,
+   using a synthetic multi-year schedules table.
+2. Compares the per-query overhead of the pandas path (read_sql_query + to_markdown)
+   with the sqlite3 cursor + streaming formatter path, and the import time saved
+   by not importing pandas.
+3. Compares keyword lookups with LIKE '%...%' scans against the FTS5 trigram index.
+4. Compares the estimated prompt tokens of context_info encodings
+   (pandas to_markdown / markdown / kv / tsv) for typical result sizes.
+   Pass --rows <export.json> (a JSON list of schedules rows, e.g. a Supabase export)
+   to measure on real data instead of the synthetic rows.
+
+Usage:
+    python scripts/bench_analytics.py [years] [events_per_day] [repeat] [--rows export.json]
+"""
+
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.domain.analytics_service import FTS_AVAILABLE, AnalyticsSnapshot
+from src.core.tokens import estimate_tokens
+from src.domain.result_format import ENCODERS, markdown_lines
+from src.domain.sql_rewriter import rewrite_time_predicates
+
+QUERIES = {
+    "specific day": "SELECT title, start_at, place FROM schedules WHERE datetime(start_at) >= datetime('{day}T00:00:00') AND datetime(start_at) < datetime('{next_day}T00:00:00') ORDER BY datetime(start_at)",
+    "next live": "SELECT title, start_at, place FROM schedules WHERE datetime(start_at) > datetime('{day}T12:00:00') ORDER BY datetime(start_at) LIMIT 1",
+    "month count": "SELECT COUNT(*) FROM schedules WHERE datetime(start_at) >= datetime('{month}-01T00:00:00') AND datetime(start_at) < datetime('{month}-01T00:00:00', '+1 month')",
+    "date equals": "SELECT title FROM schedules WHERE date(start_at) = '{day}'",
+}
+
+
+KEYWORD_QUERIES = {
+    "venue": (
+        "SELECT title, start_at FROM schedules WHERE place LIKE '%CYCLONE%'",
+        "SELECT title, start_at FROM schedules WHERE rowid IN (SELECT rowid FROM schedules_fts WHERE schedules_fts MATCH 'place:\"CYCLONE\"')",
+    ),
+    "bonus (any col)": (
+        "SELECT COUNT(*) FROM schedules WHERE title LIKE '%チェキ%' OR description LIKE '%チェキ%' OR place LIKE '%チェキ%' OR bonus LIKE '%チェキ%'",
+        "SELECT COUNT(*) FROM schedules WHERE rowid IN (SELECT rowid FROM schedules_fts WHERE schedules_fts MATCH '\"チェキ\"')",
+    ),
+    "rare title": (
+        "SELECT title FROM schedules WHERE title LIKE '%1234-5%'",
+        "SELECT title FROM schedules WHERE rowid IN (SELECT rowid FROM schedules_fts WHERE schedules_fts MATCH 'title:\"1234-5\"')",
+    ),
+}
+
+
+def synthetic_rows(years: int, events_per_day: int) -> list[dict]:
+    """Schedules with mixed offsets (+09:00 / +00:00 / none), like real Supabase data."""
+    random.seed(0)
+    start = datetime(2026 - years, 1, 1)
+    rows = []
+    for day in range(365 * years):
+        date = start + timedelta(days=day)
+        for i in range(events_per_day):
+            at = date + timedelta(hours=random.randint(10, 21), minutes=random.choice([0, 15, 30, 45]))
+            suffix = random.choice(["+09:00", "+00:00", ""])
+            if suffix == "+00:00":
+                at -= timedelta(hours=9)
+            rows.append({
+                "title": f"Live {day}-{i}",
+                "start_at": at.strftime("%Y-%m-%dT%H:%M:%S") + suffix,
+                "description": "",
+                "place": random.choice(["SHIBUYA CYCLONE", "Zepp Shinjuku", "新宿BLAZE"]),
+                "ticket_url": random.choice(["https://t.livepocket.jp/e/mau", "https://eplus.jp/mau/", ""]),
+                "price_details": random.choice(["Adv 3000 / Door 3500 (+1D)", "前売 2500円 / 当日 3000円 (+1D)"]),
+                "bonus": random.choice(["特典会あり (チェキ 1000円)", ""]),
+            })
+    return rows
+
+
+def timed(conn: sqlite3.Connection, sql: str, repeat: int) -> tuple[float, list]:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = conn.execute(sql).fetchall()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def run_benchmark(years: int = 5, events_per_day: int = 20, repeat: int = 20, rows: list[dict] = None) -> None:
+    if rows is None:
+        rows = synthetic_rows(years, events_per_day)
+        print(f"📦 Building snapshot: {len(rows):,} rows ({years} years x {events_per_day}/day)")
+    else:
+        print(f"📦 Building snapshot: {len(rows):,} exported rows")
+    snapshot = AnalyticsSnapshot(1, rows, "bench")
+    conn = snapshot.connect()
+
+    params = {"day": "2025-06-14", "next_day": "2025-06-15", "month": "2025-06"}
+    print(f"{'query':<14} {'original (ms)':>14} {'rewritten (ms)':>15} {'speedup':>8}  same result")
+    for name, template in QUERIES.items():
+        sql = template.format(**params)
+        original_ms, original = timed(conn, sql, repeat)
+        rewritten_ms, rewritten = timed(conn, rewrite_time_predicates(sql), repeat)
+        speedup = original_ms / rewritten_ms if rewritten_ms else float("inf")
+        print(f"{name:<14} {original_ms:>14.2f} {rewritten_ms:>15.2f} {speedup:>7.1f}x  {original == rewritten}")
+
+    if FTS_AVAILABLE:
+        print()
+        print(f"{'keyword':<16} {'LIKE (ms)':>12} {'FTS5 (ms)':>15} {'speedup':>8}  same result")
+        for name, (like_sql, fts_sql) in KEYWORD_QUERIES.items():
+            like_ms, like_rows = timed(conn, like_sql, repeat)
+            fts_ms, fts_rows = timed(conn, fts_sql, repeat)
+            print(f"{name:<16} {like_ms:>12.2f} {fts_ms:>15.2f} {like_ms / fts_ms:>7.1f}x  {sorted(like_rows) == sorted(fts_rows)}")
+
+    print()
+    print(f"{'result size':<14} {'pandas (ms)':>14} {'cursor (ms)':>15} {'speedup':>8}")
+    for name, limit in (("1 row", 1), ("30 rows", 30), ("300 rows", 300)):
+        sql = f"SELECT title, start_at, place, price_details FROM schedules ORDER BY start_epoch LIMIT {limit}"
+        pandas_ms = pandas_query_ms(conn, sql, repeat)
+        cursor_ms = cursor_query_ms(conn, sql, repeat)
+        print(f"{name:<14} {pandas_ms:>14.2f} {cursor_ms:>15.2f} {pandas_ms / cursor_ms:>7.1f}x")
+
+    print()
+    print(f"{'encoding':<14} " + " ".join(f"{name:>10}" for name in ENCODING_SIZES) + "   (estimated tokens)")
+    results = {
+        name: conn.execute(f"SELECT {ENCODING_COLUMNS} FROM schedules ORDER BY start_epoch LIMIT {limit}")
+        for name, limit in ENCODING_SIZES.items()
+    }
+    results = {name: ([d[0] for d in cursor.description], cursor.fetchall()) for name, cursor in results.items()}
+    baseline = {name: pandas_markdown_tokens(*result) for name, result in results.items()}
+    print(f"{'pandas':<14} " + " ".join(f"{baseline[name]:>10}" for name in ENCODING_SIZES))
+    for encoding, encoder in ENCODERS.items():
+        cells = []
+        for name, (columns, result_rows) in results.items():
+            tokens = sum(estimate_tokens(line) + 1 for line in encoder(columns, result_rows))
+            cells.append(f"{tokens:>4} ({tokens / baseline[name]:>3.0%})")
+        print(f"{encoding:<14} " + " ".join(f"{cell:>10}" for cell in cells))
+
+    print()
+    print(f"⏱️ import pandas: {import_time('pandas') * 1000:.0f} ms (no longer paid on startup by the chat path)")
+
+    conn.close()
+    snapshot.close()
+
+
+ENCODING_COLUMNS = "title, start_at, place, price_details, ticket_url, bonus"
+ENCODING_SIZES = {"1 row": 1, "10 rows": 10, "20 rows": 20}
+
+
+def pandas_markdown_tokens(columns: list[str], rows: list[tuple]) -> int:
+    """Tokens of the previous context_info format (pandas DataFrame.to_markdown)."""
+    import pandas as pd
+    text = pd.DataFrame(rows, columns=columns).to_markdown(index=False)
+    return sum(estimate_tokens(line) + 1 for line in text.splitlines())
+
+
+def pandas_query_ms(conn: sqlite3.Connection, sql: str, repeat: int) -> float:
+    import pandas as pd
+    start = time.perf_counter()
+    for _ in range(repeat):
+        pd.read_sql_query(sql, conn).to_markdown(index=False)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def cursor_query_ms(conn: sqlite3.Connection, sql: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        cursor = conn.execute(sql)
+        "\n".join(markdown_lines([d[0] for d in cursor.description], cursor))
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def import_time(module: str) -> float:
+    """Import time of a module in a fresh interpreter (seconds)."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip())
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    export = None
+    if "--rows" in argv:
+        index = argv.index("--rows")
+        with open(argv[index + 1], encoding="utf-8") as f:
+            export = json.load(f)
+        del argv[index:index + 2]
+    args = [int(a) for a in argv[:3]]
+    run_benchmark(*args, rows=export)
@@ -0,0 +1,165 @@
+"""
+TimeTree Fetch Benchmark for AI Mau Bot
+Compares the direct public_events API path (httpx) with the Playwright fallback
+(headless Chromium sniffing the same responses) on the recorded fixtures in
+tests/fixtures/timetree, served by a local HTTP server:
+- wall time of the fetch (including the Playwright import / browser start)
+- peak RSS of the whole process tree (Python + Chromium processes)
+and how the direct path scales with the crawl window (sequential vs concurrent months).
+
+Usage:
+    python scripts/bench_timetree.py [latency_ms]
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.core import config
+from src.workers.timetree_client import JST, HostRateLimiter, TimeTreeClient, fetch_with_browser, month_starts
+
+logging.getLogger("src.workers.timetree_client").setLevel(logging.WARNING)
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures" / "timetree"
+ALIAS = "lollipop_1116"
+MONTHS = month_starts(date(2025, 10, 1), 3)
+
+# カレンダー画面の代わり: ?monthly= の月の public_events を取得する (ページングも辿る)
+CALENDAR_HTML = """<!doctype html><html><body><script>
+const monthly = new URLSearchParams(location.search).get("monthly");
+const [y, m] = monthly.split("-").map(Number);
+const from = Date.UTC(y, m - 1, 1) - 9 * 3600 * 1000, to = Date.UTC(y, m, 1) - 9 * 3600 * 1000;
+async function load(cursor) {
+  const q = `from=${from}&to=${to}&utc_offset=32400` + (cursor ? `&cursor=${cursor}` : "");
+  const data = await (await fetch(`/api/v2/public_calendars/%s/public_events?${q}`)).json();
+  if (data.paging && data.paging.next_cursor) await load(data.paging.next_cursor);
+}
+load();
+</script></body></html>""" % ALIAS
+
+
+def make_handler(latency_sec: float):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body: bytes, content_type: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = parse_qs(url.query)
+            if url.path.endswith("/public_events"):
+                time.sleep(latency_sec)
+                start = datetime.fromtimestamp(int(params["from"][0]) / 1000, JST)
+                path = FIXTURES / f"public_events_{start:%Y-%m}.json"
+                pages = json.loads(path.read_text(encoding="utf-8")) if path.exists() else [{"public_events": []}]
+                page = pages[1] if "cursor" in params else pages[0]
+                self._send(json.dumps(page).encode("utf-8"), "application/json")
+            else:
+                self._send(CALENDAR_HTML.encode("utf-8"), "text/html; charset=utf-8")
+
+    return FixtureHandler
+
+
+def process_tree_rss(root_pid: int) -> int:
+    """Sum of VmRSS (bytes) of a process and all its descendants (Linux /proc)."""
+    children: dict[int, list[int]] = {}
+    rss: dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields["PPid"]), []).append(pid)
+        rss[pid] = int(fields.get("VmRSS", "0 kB").split()[0]) * 1024
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+def measure(path: str, calendar_url: str) -> dict:
+    """Runs one fetch path in a fresh interpreter and samples its process tree memory."""
+    proc = subprocess.Popen(
+        [sys.executable, __file__, "--child", path, calendar_url],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    peak = 0
+    while proc.poll() is None:
+        peak = max(peak, process_tree_rss(proc.pid))
+        time.sleep(0.02)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        errors = [line for line in stderr.splitlines() if "Error" in line] or stderr.strip().splitlines() or ["failed"]
+        return {"error": errors[-1].strip()}
+    result = json.loads(stdout.strip().splitlines()[-1])
+    result["peak_rss_mb"] = peak / 1024 / 1024
+    return result
+
+
+def run_child(path: str, calendar_url: str) -> None:
+    start = time.perf_counter()
+    if path == "direct":
+        with TimeTreeClient(calendar_url) as client:
+            events = client.fetch_months(MONTHS)
+    else:
+        events = fetch_with_browser(MONTHS, calendar_url)
+    print(json.dumps({"events": len(events), "seconds": time.perf_counter() - start}))
+
+
+def run_benchmark(latency_ms: int = 80) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    calendar_url = f"http://127.0.0.1:{server.server_port}/public_calendars/{ALIAS}"
+    print(f"📦 Fixtures: {len(MONTHS)} months, API latency {latency_ms} ms")
+
+    print(f"{'path':<10} {'events':>7} {'wall (s)':>9} {'peak RSS (MB)':>14}")
+    for path in ("direct", "browser"):
+        result = measure(path, calendar_url)
+        if "error" in result:
+            print(f"{path:<10} skipped: {result['error'][:100]}")
+            continue
+        print(f"{path:<10} {result['events']:>7} {result['seconds']:>9.2f} {result['peak_rss_mb']:>14.0f}")
+
+    print()
+    concurrency = config.TIMETREE_CONCURRENCY
+    interval = config.TIMETREE_MIN_INTERVAL_SEC
+    print(f"{'months':<8} {'sequential (s)':>15} {f'concurrency={concurrency} (s)':>20}   (host interval {interval}s)")
+    for count in (3, 6, 15):
+        months = month_starts(date(2025, 10, 1), count)
+        timings = []
+        for workers in (1, concurrency):
+            start = time.perf_counter()
+            with TimeTreeClient(calendar_url, concurrency=workers, limiter=HostRateLimiter(interval)) as client:
+                client.fetch_months(months)
+            timings.append(time.perf_counter() - start)
+        print(f"{count:<8} {timings[0]:>15.2f} {timings[1]:>20.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], sys.argv[3])
+    else:
+        run_benchmark(*[int(a) for a in sys.argv[1:2]])
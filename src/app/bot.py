@@ -12,10 +12,14 @@ intents.message_content = True
 client = discord.Client(intents=intents)
 
 from src.domain.analytics_service import AnalyticsService
+from src.domain.intent_router import IntentRouter
+from src.domain.analytics_pipeline import AnalyticsPipeline
 
 # Initialize AI Brain & Analytics
 brain = AIBrain()
 analytics = AnalyticsService()
+intent_router = IntentRouter()
+analytics_pipeline = AnalyticsPipeline(brain, analytics, intent_router)
 
 @client.event
 async def on_ready() -> None:
@@ -77,28 +81,16 @@ async def on_message(message: discord.Message) -> None:
                         history.append(f"{name}: {clean_content}")
                 
                 history.reverse()
-                conversation_log = "\n".join(history)
+                # 新しい順にトークン予算内に収める (古い発言は要約)
+                conversation_log = brain.fit_history(history)
                 user_name = message.author.display_name
                 
                 # ---------------------------------------------------
                 # 🤖 High-IQ Analytics Flow
                 # ---------------------------------------------------
                 
-                # Check for triggers (e.g. "ライブいつ？", "予定教えて")
-                ANALYTICS_KEYWORDS = ['いつ', '予定', 'スケジュール', 'ライブ', 'イベント', '何回', '件数', '分析', '教えて']
-                user_msg = message.content
-                
-                context_info = None
-                
-                if any(k in user_msg for k in ANALYTICS_KEYWORDS):
-                    logger.info("🧠 Analytics Keyword Detected. Generating SQL...")
-                    try:
-                        sql = await brain.generate_sql(user_msg, analytics.get_schema_info())
-                        result_md = analytics.execute_query(sql)
-                        context_info = result_md
-                        logger.info("📊 Analysis Result: " + str(context_info)[:50] + "...")
-                    except Exception as e:
-                        logger.error(f"Analytics Error: {e}")
+                # e.g. "次のライブいつ？" → template SQL, "ライブ楽しかった！" → skip
+                context_info = await analytics_pipeline.run(message.content)
 
                 # ---------------------------------------------------
                 # 🤖 Generate Response (Triple Hybrid with Timeout)
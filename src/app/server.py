@@ -3,6 +3,7 @@ from typing import Optional
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -51,6 +52,7 @@ class OGPResponse(BaseModel):
 # Global variables to hold tasks
 bot_task = None
 self_ping_task = None
+analytics_refresh_task = None
 
 # Schedule sync - concurrency control
 _sync_in_progress = False
@@ -65,6 +67,9 @@ def _run_sync_with_safeguards():
         logger.info("🔄 Starting schedule sync...")
         fetch_and_sync(dry_run=False)
         logger.info("✅ Schedule sync completed successfully")
+        # 同期した予定をすぐ検索に反映する (次のリクエストに取得を待たせない)
+        # updated_at は TimeTree の編集時刻なので差分では漏れる行がある: 全件で取り直す
+        bot.analytics.request_refresh(full=True)
     except Exception as e:
         logger.error(f"❌ Schedule sync failed: {e}")
     finally:
@@ -105,7 +110,7 @@ async def self_ping():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global bot_task, self_ping_task
+    global bot_task, self_ping_task, analytics_refresh_task
     # Startup
     logger.info("🚀 Starting Discord Bot via FastAPI lifespan...")
     if config.DISCORD_TOKEN:
@@ -117,6 +122,9 @@ async def lifespan(app: FastAPI):
     # Start self-ping task
     logger.info("🏓 Starting self-ping task...")
     self_ping_task = asyncio.create_task(self_ping())
+
+    # Start analytics snapshot refresher (stale-while-revalidate)
+    analytics_refresh_task = asyncio.create_task(bot.analytics.run_refresher())
     
     yield
     
@@ -125,13 +133,14 @@ async def lifespan(app: FastAPI):
     if bot.client:
         await bot.client.close()
     
-    # Cancel self-ping task
-    if self_ping_task:
-        self_ping_task.cancel()
-        try:
-            await self_ping_task
-        except asyncio.CancelledError:
-            pass
+    # Cancel self-ping task and analytics refresher
+    for task in (self_ping_task, analytics_refresh_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
     
     # Wait for the bot task to finish if needed (optional)
     if bot_task:
@@ -168,7 +177,7 @@ def build_conversation_log(user_name: str, history: list[MessageHistory], curren
     """会話履歴を整形してAIに渡す形式に変換"""
     log_lines = []
     
-    for msg in history:
+    for msg in history[-config.HISTORY_MAX_TURNS:]:
         if msg.role == 'user':
             log_lines.append(f"{user_name}: {msg.text}")
         else:
@@ -177,7 +186,29 @@ def build_conversation_log(user_name: str, history: list[MessageHistory], curren
     # 現在のメッセージを追加
     log_lines.append(f"{user_name}: {current_text}")
     
-    return "\n".join(log_lines)
+    # 新しい順にトークン予算内に収める (古い発言は要約)
+    return bot.brain.fit_history(log_lines)
+
+def log_chat_request(request: Request, req: ChatRequest, start_time: float, error_msg: Optional[str], event: str = "chat_request") -> None:
+    """Structured Logging (parsed by scripts/analyze_logs.py)"""
+    duration = time.time() - start_time
+    
+    log_entry = {
+        "timestamp": datetime.now().isoformat(),
+        "event": event,
+        "ip": request.client.host,
+        "user_name": req.user_name,
+        "message_length": len(req.text),
+        "response_time": round(duration, 3),
+        "success": error_msg is None,
+        "error": error_msg
+    }
+    # Use a special prefix for easier parsing or just log as info
+    logger.info(f"ANALYTICS: {json.dumps(log_entry)}")
+
+def sse_event(event: str, data: dict) -> str:
+    """Formats a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.post("/api/chat", response_model=ChatResponse)
 @limiter.limit("10/minute")
@@ -191,22 +222,7 @@ async def chat_endpoint(request: Request, req: ChatRequest):
         conversation_log = build_conversation_log(req.user_name, req.history, req.text)
         logger.info(f"📝 Conversation history: {len(req.history)} messages")
         
-        # ---------------------------------------------------
-        # 🤖 High-IQ Analytics Flow (Same as Discord Bot)
-        # ---------------------------------------------------
-        ANALYTICS_KEYWORDS = ['いつ', '予定', 'スケジュール', 'ライブ', 'イベント', '何回', '件数', '分析', '教えて']
-        context_info = None
-        
-        if any(k in req.text for k in ANALYTICS_KEYWORDS):
-            logger.info("🧠 Analytics Keyword Detected in API. Generating SQL...")
-            try:
-                # Reuse the same brain and analytics instance from bot module
-                sql = await bot.brain.generate_sql(req.text, bot.analytics.get_schema_info())
-                result_md = bot.analytics.execute_query(sql)
-                context_info = result_md
-                logger.info("📊 Analysis Result: " + str(context_info)[:50] + "...")
-            except Exception as e:
-                logger.error(f"Analytics Error: {e}")
+        context_info = await bot.analytics_pipeline.run(req.text)
 
         # Need to capture which model was used.
         # Since currently generate_response returns string, we might need to parse logs or adjust return type.
@@ -226,21 +242,38 @@ async def chat_endpoint(request: Request, req: ChatRequest):
         # Return 500 Internal Server Error with detail
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Structured Logging
-        duration = time.time() - start_time
-        
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "event": "chat_request",
-            "ip": request.client.host,
-            "user_name": req.user_name,
-            "message_length": len(req.text),
-            "response_time": round(duration, 3),
-            "success": error_msg is None,
-            "error": error_msg
-        }
-        # Use a special prefix for easier parsing or just log as info
-        logger.info(f"ANALYTICS: {json.dumps(log_entry)}")
+        log_chat_request(request, req, start_time, error_msg)
+
+@app.post("/api/chat/stream")
+@limiter.limit("10/minute")
+async def chat_stream_endpoint(request: Request, req: ChatRequest):
+    """
+    Streaming variant of /api/chat (Server-Sent Events).
+    Events: `chunk` ({"text"}), `suggestions` ({"suggestions"}), `done` ({"mode"}), `error` ({"detail"})
+    """
+    start_time = time.time()
+    conversation_log = build_conversation_log(req.user_name, req.history, req.text)
+    logger.info(f"📝 Conversation history: {len(req.history)} messages (stream)")
+
+    async def event_stream():
+        error_msg = None
+        try:
+            context_info = await bot.analytics_pipeline.run(req.text)
+            async for item in bot.brain.generate_response_stream(req.user_name, conversation_log, context_info, req.timezone):
+                event = item.pop("event")
+                yield sse_event(event, item)
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"❌ API Chat Stream Error: {e}")
+            yield sse_event("error", {"detail": error_msg})
+        finally:
+            log_chat_request(request, req, start_time, error_msg, event="chat_stream_request")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/ogp", response_model=OGPResponse)
 async def ogp_endpoint(req: OGPRequest):
@@ -292,6 +325,25 @@ async def sync_schedule_endpoint(token: str = ""):
     
     return {"status": "started", "message": "Schedule sync started in background"}
 
+@app.get("/api/metrics")
+@limiter.exempt
+async def metrics_endpoint(token: str = ""):
+    """Diagnostics: model router state (circuit breakers, success rate, latency), hedging, cache, prompt size, history trimming, reflex, intent template, admission (quota queue) and analytics snapshot / result cache stats"""
+    if token != config.SYNC_SECRET_TOKEN:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    return {
+        "models": bot.brain.router.snapshot(),
+        "hedging": bot.brain.hedge_stats,
+        "sql_cache": bot.brain.sql_cache.stats(),
+        "prompt_segments": bot.brain.prompts.stats(),
+        "history": bot.brain.history.stats(),
+        "reflex": bot.brain.reflex.stats(),
+        "intents": bot.intent_router.stats(),
+        "admission": bot.brain.admission.stats(),
+        "analytics": bot.analytics.stats(),
+    }
+
 @app.api_route("/api/schedules", methods=["GET", "HEAD"])
 @limiter.exempt
 async def get_schedules(response: Response, request: Request, since: Optional[str] = None, until: Optional[str] = None):
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+from src.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a model has no RPM/TPM budget left within the allowed queue wait."""
+    def __init__(self, model_name: str, wait_sec: float) -> None:
+        super().__init__(f"{model_name}: quota budget exhausted (next slot in {wait_sec:.1f}s)")
+        self.model_name = model_name
+        self.wait_sec = wait_sec
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled continuously at capacity per minute."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdmissionScheduler:
+    """
+    Process-wide quota-aware admission control (per model RPM / TPM token buckets).
+    A request either gets a slot now, waits briefly in a queue for one, or is rejected
+    (AdmissionRejected) so the caller can move on to a model that still has budget.
+    Models without configured limits are always admitted.
+    """
+
+    def __init__(self, limits: dict[str, tuple[int, int]], max_wait_sec: float = 3.0) -> None:
+        self.max_wait_sec = max_wait_sec
+        self._lock = threading.Lock()
+        self._buckets = {
+            name: (TokenBucket(rpm), TokenBucket(tpm))
+            for name, (rpm, tpm) in limits.items()
+        }
+        self._stats = {
+            name: {"admitted": 0, "queued": 0, "rejected": 0, "queue_depth": 0, "max_queue_depth": 0,
+                   "total_wait_sec": 0.0, "max_wait_sec": 0.0}
+            for name in limits
+        }
+
+    def _reserve(self, model_name: str, tokens: int, max_wait: float) -> Optional[float]:
+        """
+        Reserves a slot `wait` seconds from now and returns `wait`,
+        or None if the wait would exceed max_wait.
+        """
+        with self._lock:
+            rpm, tpm = self._buckets[model_name]
+            now = time.monotonic()
+            wait = max(rpm.wait_time(1, now), tpm.wait_time(tokens, now))
+            stats = self._stats[model_name]
+            if wait > max_wait:
+                stats["rejected"] += 1
+                return None
+            # 先に予約 (バケットを負にする) ので、後続のリクエストはその分さらに待つ
+            rpm.take(1)
+            tpm.take(tokens)
+            stats["admitted"] += 1
+            if wait > 0:
+                stats["queued"] += 1
+                stats["total_wait_sec"] += wait
+                stats["max_wait_sec"] = max(stats["max_wait_sec"], wait)
+            return wait
+
+    def _enter_queue(self, model_name: str) -> None:
+        with self._lock:
+            stats = self._stats[model_name]
+            stats["queue_depth"] += 1
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], stats["queue_depth"])
+
+    def _leave_queue(self, model_name: str) -> None:
+        with self._lock:
+            self._stats[model_name]["queue_depth"] -= 1
+
+    async def acquire(self, model_name: str, tokens: int = 0, max_wait: Optional[float] = None) -> None:
+        """Waits (up to max_wait) for an RPM/TPM slot. Raises AdmissionRejected otherwise."""
+        if model_name not in self._buckets:
+            return
+        max_wait = self.max_wait_sec if max_wait is None else max_wait
+        wait = self._reserve(model_name, tokens, max_wait)
+        if wait is None:
+            raise AdmissionRejected(model_name, self.wait_time(model_name, tokens))
+        if wait > 0:
+            logger.info(f"🚦 {model_name}: クォータ待ち {wait:.2f}秒")
+            self._enter_queue(model_name)
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave_queue(model_name)
+
+    def acquire_blocking(self, model_name: str, tokens: int = 0, max_wait: Optional[float] = None) -> None:
+        """Synchronous variant of acquire (for worker scripts)."""
+        if model_name not in self._buckets:
+            return
+        max_wait = self.max_wait_sec if max_wait is None else max_wait
+        wait = self._reserve(model_name, tokens, max_wait)
+        if wait is None:
+            raise AdmissionRejected(model_name, self.wait_time(model_name, tokens))
+        if wait > 0:
+            logger.info(f"🚦 {model_name}: クォータ待ち {wait:.2f}秒")
+            self._enter_queue(model_name)
+            try:
+                time.sleep(wait)
+            finally:
+                self._leave_queue(model_name)
+
+    def wait_time(self, model_name: str, tokens: int = 0) -> float:
+        """Seconds until the model could take a request of `tokens` tokens."""
+        if model_name not in self._buckets:
+            return 0.0
+        with self._lock:
+            rpm, tpm = self._buckets[model_name]
+            now = time.monotonic()
+            return max(rpm.wait_time(1, now), tpm.wait_time(tokens, now))
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for name, (rpm, tpm) in self._buckets.items():
+                stats = self._stats[name]
+                rpm._refill(now)
+                tpm._refill(now)
+                result[name] = {
+                    "rpm_limit": int(rpm.capacity),
+                    "tpm_limit": int(tpm.capacity),
+                    "rpm_available": round(rpm.tokens, 2),
+                    "tpm_available": round(tpm.tokens),
+                    "queue_depth": stats["queue_depth"],
+                    "max_queue_depth": stats["max_queue_depth"],
+                    "admitted": stats["admitted"],
+                    "queued": stats["queued"],
+                    "rejected": stats["rejected"],
+                    "avg_wait_sec": round(stats["total_wait_sec"] / stats["queued"], 3) if stats["queued"] else None,
+                    "max_wait_sec": round(stats["max_wait_sec"], 3),
+                }
+            return result
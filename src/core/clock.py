@@ -0,0 +1,14 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from src.core import config
+
+
+def now_local() -> datetime:
+    """
+    Current wall-clock time in ANALYTICS_TIMEZONE, without offset.
+    The snapshot stores start_at in the same form (normalize_start_at), so :now / :start / :end
+    and the reference dates given to the AI compare correctly whatever the host timezone is
+    (Render runs in UTC).
+    """
+    return datetime.now(ZoneInfo(config.ANALYTICS_TIMEZONE)).replace(tzinfo=None)
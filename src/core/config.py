@@ -35,6 +35,7 @@ MAU_ENV: str = os.getenv("MAU_ENV", "production")
 BASE_DIR: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DATA_DIR: str = os.path.join(BASE_DIR, "data")
 PROFILE_FILE_PATH: str = os.path.join(DATA_DIR, "mau_profile.txt")
+REFLEX_FILE_PATH: str = os.path.join(DATA_DIR, "reflexes.json")
 
 # Default Persona
 DEFAULT_PROFILE: str = "あなたはアイドルの「AIまう」です。明るく親しみやすく振る舞ってください。"
@@ -42,3 +43,85 @@ DEFAULT_PROFILE: str = "あなたはアイドルの「AIまう」です。明る
 # CORS Configuration
 ALLOWED_ORIGINS_RAW: str = os.getenv("ALLOWED_ORIGINS", "*")
 ALLOWED_ORIGINS: list[str] = [origin.strip() for origin in ALLOWED_ORIGINS_RAW.split(",")] if ALLOWED_ORIGINS_RAW != "*" else ["*"]
+
+# Model Router (Circuit Breaker)
+MODEL_CIRCUIT_COOLDOWN_SEC: float = float(os.getenv("MODEL_CIRCUIT_COOLDOWN_SEC", "60"))
+MODEL_CIRCUIT_MAX_COOLDOWN_SEC: float = float(os.getenv("MODEL_CIRCUIT_MAX_COOLDOWN_SEC", "900"))
+MODEL_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("MODEL_CIRCUIT_FAILURE_THRESHOLD", "3"))
+
+# Hedged Requests (race the next model when the primary is slow)
+HEDGE_ENABLED: bool = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_DELAY_PERCENTILE: float = float(os.getenv("HEDGE_DELAY_PERCENTILE", "95"))
+HEDGE_DEFAULT_DELAY_SEC: float = float(os.getenv("HEDGE_DEFAULT_DELAY_SEC", "8"))
+HEDGE_MIN_DELAY_SEC: float = float(os.getenv("HEDGE_MIN_DELAY_SEC", "2"))
+HEDGE_MAX_DELAY_SEC: float = float(os.getenv("HEDGE_MAX_DELAY_SEC", "15"))
+
+# SQL Generation Cache (generate_sql)
+SQL_CACHE_MAX_ENTRIES: int = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "256"))
+SQL_CACHE_TTL_SEC: float = float(os.getenv("SQL_CACHE_TTL_SEC", "21600"))
+
+# Conversation History Budget (tokens for the 【会話履歴】 block)
+HISTORY_MAX_TURNS: int = int(os.getenv("HISTORY_MAX_TURNS", "12"))
+HISTORY_MAX_TURN_CHARS: int = int(os.getenv("HISTORY_MAX_TURN_CHARS", "600"))
+HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# Gemma 3 はペルソナもプロンプトに入るため小さめ
+HISTORY_TOKEN_BUDGET_GEMMA: int = int(os.getenv("HISTORY_TOKEN_BUDGET_GEMMA", "800"))
+
+# Analytics (start_at は このタイムゾーンの壁時計時刻に揃えてスナップショットに格納)
+ANALYTICS_TIMEZONE: str = os.getenv("ANALYTICS_TIMEZONE", "Asia/Tokyo")
+# スナップショットの有効期限と、バックグラウンド更新の間隔 (期限より短く)
+# 期限切れでも MAX_STALENESS 以内なら古いスナップショットで即答し、更新は裏で行う
+ANALYTICS_SNAPSHOT_TTL_SEC: float = float(os.getenv("ANALYTICS_SNAPSHOT_TTL_SEC", "300"))
+ANALYTICS_REFRESH_INTERVAL_SEC: float = float(os.getenv("ANALYTICS_REFRESH_INTERVAL_SEC", "240"))
+ANALYTICS_MAX_STALENESS_SEC: float = float(os.getenv("ANALYTICS_MAX_STALENESS_SEC", "900"))
+# 差分更新 (updated_at) の取り直し幅と、削除を反映するための全件再取得の間隔
+ANALYTICS_DELTA_OVERLAP_SEC: float = float(os.getenv("ANALYTICS_DELTA_OVERLAP_SEC", "600"))
+ANALYTICS_FULL_RESYNC_SEC: float = float(os.getenv("ANALYTICS_FULL_RESYNC_SEC", "3600"))
+# SQL実行の上限時間 (AI生成SQLが重すぎる場合は中断) と実行スレッド数
+ANALYTICS_QUERY_TIMEOUT_SEC: float = float(os.getenv("ANALYTICS_QUERY_TIMEOUT_SEC", "2"))
+ANALYTICS_MAX_WORKERS: int = int(os.getenv("ANALYTICS_MAX_WORKERS", "2"))
+# プロンプトに入れる検索結果 (context_info) の上限
+ANALYTICS_CONTEXT_TOKEN_BUDGET: int = int(os.getenv("ANALYTICS_CONTEXT_TOKEN_BUDGET", "1200"))
+ANALYTICS_CONTEXT_MAX_ROWS: int = int(os.getenv("ANALYTICS_CONTEXT_MAX_ROWS", "20"))
+ANALYTICS_CONTEXT_MAX_CELL_CHARS: int = int(os.getenv("ANALYTICS_CONTEXT_MAX_CELL_CHARS", "80"))
+ANALYTICS_CONTEXT_SCAN_ROWS: int = int(os.getenv("ANALYTICS_CONTEXT_SCAN_ROWS", "500"))
+# context_info の形式: tsv (繰り返す会場・料金を略号化) / kv (key=value 行) / markdown (表)
+ANALYTICS_CONTEXT_FORMAT: str = os.getenv("ANALYTICS_CONTEXT_FORMAT", "tsv")
+# 検索結果キャッシュの件数 (スナップショット版ごと。同期で差し替わると破棄)
+ANALYTICS_RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("ANALYTICS_RESULT_CACHE_MAX_ENTRIES", "256"))
+
+# Reflex Layer (hot reload check interval for data/reflexes.json)
+REFLEX_RELOAD_INTERVAL_SEC: float = float(os.getenv("REFLEX_RELOAD_INTERVAL_SEC", "10"))
+
+# Admission Scheduler (per-model free-tier quota: requests / tokens per minute)
+ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# クォータ切れ時にキューで待つ最大秒数 (これを超える場合は次のモデルへ)
+ADMISSION_MAX_WAIT_SEC: float = float(os.getenv("ADMISSION_MAX_WAIT_SEC", "3"))
+MODEL_RATE_LIMITS: dict[str, tuple[int, int]] = {
+    "Gemini 3 Flash": (int(os.getenv("RPM_GEMINI_3_FLASH", "5")), int(os.getenv("TPM_GEMINI_3_FLASH", "250000"))),
+    "Gemini 2.5 Flash": (int(os.getenv("RPM_GEMINI_2_5_FLASH", "10")), int(os.getenv("TPM_GEMINI_2_5_FLASH", "250000"))),
+    "Gemini 2.5 Lite": (int(os.getenv("RPM_GEMINI_2_5_LITE", "15")), int(os.getenv("TPM_GEMINI_2_5_LITE", "250000"))),
+    "Gemma 3 27B": (int(os.getenv("RPM_GEMMA_3", "30")), int(os.getenv("TPM_GEMMA_3", "15000"))),
+    "Groq Llama 3.3 70B": (int(os.getenv("RPM_GROQ", "30")), int(os.getenv("TPM_GROQ", "12000"))),
+}
+
+# Groq 抽出 (同期時のメモ解析): 同時リクエスト数 (1 なら従来どおり逐次)、429 の再試行回数と初回待ち秒数
+GROQ_EXTRACTION_CONCURRENCY: int = int(os.getenv("GROQ_EXTRACTION_CONCURRENCY", "4"))
+GROQ_MAX_RETRIES: int = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+GROQ_BACKOFF_BASE_SEC: float = float(os.getenv("GROQ_BACKOFF_BASE_SEC", "2"))
+# 一括取り込み (timetable_oneshot) で1リクエストにまとめるイベント数と、メモの推定トークン合計の上限
+GROQ_BATCH_SIZE: int = int(os.getenv("GROQ_BATCH_SIZE", "8"))
+GROQ_BATCH_MAX_TOKENS: int = int(os.getenv("GROQ_BATCH_MAX_TOKENS", "3000"))
+
+# TimeTree Sync (public_events API を直接取得し、失敗時のみ Playwright で取得)
+TIMETREE_DIRECT_FETCH: bool = os.getenv("TIMETREE_DIRECT_FETCH", "true").lower() == "true"
+# {origin} / {calendar} はカレンダーURLから埋める (Playwright取得時のログに実際のURLが出る)
+TIMETREE_API_URL: str = os.getenv("TIMETREE_API_URL", "{origin}/api/v2/public_calendars/{calendar}/public_events")
+TIMETREE_TIMEOUT_SEC: float = float(os.getenv("TIMETREE_TIMEOUT_SEC", "10"))
+# 月ごとの並行取得数と、同じホストへのリクエスト開始間隔 (秒)
+TIMETREE_CONCURRENCY: int = int(os.getenv("TIMETREE_CONCURRENCY", "4"))
+TIMETREE_MIN_INTERVAL_SEC: float = float(os.getenv("TIMETREE_MIN_INTERVAL_SEC", "0.1"))
+# ブラウザ取得: その月の public_events 応答を待つ上限 (固定の待機はしない)
+TIMETREE_RESPONSE_TIMEOUT_SEC: float = float(os.getenv("TIMETREE_RESPONSE_TIMEOUT_SEC", "15"))
+# 0件だった月を取り直す回数 (完全性チェック)
+TIMETREE_EMPTY_RETRIES: int = int(os.getenv("TIMETREE_EMPTY_RETRIES", "1"))
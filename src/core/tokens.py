@@ -0,0 +1,11 @@
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate without a tokenizer.
+    Japanese (CJK / kana) characters are counted as ~1 token each,
+    other characters (ASCII, symbols) as ~4 characters per token.
+    """
+    if not text:
+        return 0
+    wide = sum(1 for ch in text if ord(ch) >= 0x3000)
+    narrow = len(text) - wide
+    return wide + (narrow + 3) // 4
@@ -1,14 +1,135 @@
 import logging
 import asyncio
+import contextlib
+import time
+import unicodedata
 from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
 import google.generativeai as genai # type: ignore
 
 from src.core import config
+from src.core.clock import now_local
 from src.domain.persona import CHARACTER_SETTING
+from src.domain.history_budget import HistoryBudgeter
+from src.domain.model_router import ModelRouter
+from src.domain.reflex import ReflexEngine
+from src.domain.prompt_templates import RenderedPrompt, ResponsePromptBuilder
+from src.core.admission import AdmissionRejected, AdmissionScheduler
+from src.core.cache import TTLCache
+from src.core.tokens import estimate_tokens
 from src.core.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+SUGGESTIONS_MARKER = "===SUGGESTIONS==="
+FAILURE_MESSAGE = "ごめんね、今日は回線が全部パンクしちゃったみたい😵‍💫💦 また明日遊ぼうね！"
+
+
+def build_reference_dates(now: datetime) -> dict[str, str]:
+    """
+    Semantic reference dates used for SQL generation (ISO 8601, local time).
+    Keys: today_start, tomorrow_start, this_weekend_start/end, next_weekend_start/end
+    """
+    today_start = now.strftime('%Y-%m-%dT00:00:00')
+    tomorrow_start = (now + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00')
+    
+    # Calculate "This Weekend" (Friday Night ~ Sunday Night)
+    # Weekday: Mon=0, ..., Sun=6
+    weekday = now.weekday()
+    days_until_saturday = (5 - weekday) % 7
+    this_saturday = now + timedelta(days=days_until_saturday)
+    this_sunday = this_saturday + timedelta(days=1)
+
+    # Calculate "Next Weekend" (Next Week's Sat-Sun)
+    next_saturday = this_saturday + timedelta(days=7)
+    next_sunday = next_saturday + timedelta(days=1)
+
+    return {
+        "today_start": today_start,
+        "tomorrow_start": tomorrow_start,
+        "this_weekend_start": this_saturday.strftime('%Y-%m-%dT00:00:00'),
+        "this_weekend_end": (this_sunday + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00'),
+        "next_weekend_start": next_saturday.strftime('%Y-%m-%dT00:00:00'),
+        "next_weekend_end": (next_sunday + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00'),
+    }
+
+
+def normalize_question(text: str) -> str:
+    """
+    Normalizes a user question for cache keys / matching:
+    NFKC (全角→半角), lowercase, and removes whitespace and punctuation ("？", "！", "〜" ...).
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in ("P", "Z", "S"))
+
+
+def bind_now_placeholder(sql: str, now: datetime) -> tuple[str, bool]:
+    """
+    Replaces the current-time literal in generated SQL with the `:now` parameter
+    (bound at execution time, so a cached SQL never compares against a stale 'now').
+    Returns (sql, time_dependent): time_dependent is True if the SQL still embeds the current time
+    in some other form and must not be cached.
+    """
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        sql = sql.replace(f"'{now.strftime(fmt)}'", ":now")
+    time_dependent = any(now.strftime(fmt) in sql for fmt in ('%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M'))
+    return sql, time_dependent
+
+
+class StreamStartError(Exception):
+    """Raised when a model stream fails before producing its first token."""
+    def __init__(self, model_name: str, error: Exception) -> None:
+        super().__init__(f"{model_name}: {error}")
+        self.model_name = model_name
+        self.error = error
+
+
+class SuggestionSplitter:
+    """
+    Incrementally separates streamed reply text from the ===SUGGESTIONS=== block.
+    Text that might be the beginning of the marker is held back until it can be decided.
+    """
+
+    def __init__(self, marker: str = SUGGESTIONS_MARKER) -> None:
+        self.marker = marker
+        self._pending = ""
+        self._suggestion_block: Optional[str] = None
+
+    def feed(self, text: str) -> str:
+        """Adds a chunk and returns the part that is safe to send as reply text."""
+        if self._suggestion_block is not None:
+            self._suggestion_block += text
+            return ""
+
+        self._pending += text
+        pos = self._pending.find(self.marker)
+        if pos != -1:
+            emit = self._pending[:pos].rstrip()
+            self._suggestion_block = self._pending[pos + len(self.marker):]
+            self._pending = ""
+            return emit
+
+        # 末尾がマーカーの先頭と一致する可能性がある部分、および末尾の空白は保留
+        hold = 0
+        for size in range(min(len(self.marker) - 1, len(self._pending)), 0, -1):
+            if self.marker.startswith(self._pending[-size:]):
+                hold = size
+                break
+        safe = self._pending[:len(self._pending) - hold]
+        emit = safe.rstrip()
+        self._pending = self._pending[len(emit):]
+        return emit
+
+    def finish(self) -> tuple[str, list[str]]:
+        """Returns (remaining reply text, up to 3 suggestions)."""
+        rest = self._pending.rstrip()
+        self._pending = ""
+        if self._suggestion_block is None:
+            return rest, []
+        suggestions = [s.strip() for s in self._suggestion_block.strip().split('\n') if s.strip()]
+        return rest, suggestions[:3]
+
+
 class AIBrain:
     def __init__(self) -> None:
         # Configure Gemini (4モデル体制)
@@ -45,39 +166,194 @@ class AIBrain:
         else:
             logger.warning("GEMINI_API_KEY が設定されていません。Geminiモデルは機能しません。")
 
+        # 各モデルの成功率・レイテンシ・429/5xxを記録し、不調なモデルをスキップする
+        self.router = ModelRouter(
+            cooldown_sec=config.MODEL_CIRCUIT_COOLDOWN_SEC,
+            failure_threshold=config.MODEL_CIRCUIT_FAILURE_THRESHOLD,
+            max_cooldown_sec=config.MODEL_CIRCUIT_MAX_COOLDOWN_SEC,
+        )
+        # Hedged requests の結果 (どちらが勝ったか、ヘッジ遅延) を記録
+        self.hedge_stats = {"fired": 0, "won_by_primary": 0, "won_by_backup": 0, "last": None}
+        # generate_response のプロンプト (静的部分はペルソナ・言語ごとに事前コンパイル)
+        self.prompts = ResponsePromptBuilder(CHARACTER_SETTING)
+        # Reflex Layer (data/reflexes.json, ホットリロード対応)
+        self.reflex = ReflexEngine(config.REFLEX_FILE_PATH, reload_interval_sec=config.REFLEX_RELOAD_INTERVAL_SEC)
+        # 会話履歴をモデルの入力予算内に収める
+        self.history = HistoryBudgeter(max_turn_chars=config.HISTORY_MAX_TURN_CHARS)
+        # generate_sql のキャッシュ (正規化した質問 + 基準日 → SQL)
+        self.sql_cache = TTLCache(max_entries=config.SQL_CACHE_MAX_ENTRIES, ttl_sec=config.SQL_CACHE_TTL_SEC)
+        # 無料枠のRPM/TPMを超えないよう、全リクエストをモデルごとのトークンバケットで受付制御
+        self.admission = AdmissionScheduler(
+            config.MODEL_RATE_LIMITS if config.ADMISSION_ENABLED else {},
+            max_wait_sec=config.ADMISSION_MAX_WAIT_SEC,
+        )
+
+    async def _admit(self, model_name: str, prompt: str) -> None:
+        """
+        Waits for the model's RPM/TPM budget (admission scheduler).
+        On rejection the router slot is released, since no request was sent.
+        """
+        try:
+            await self.admission.acquire(model_name, estimate_tokens(prompt))
+        except (AdmissionRejected, asyncio.CancelledError):
+            self.router.release(model_name)
+            raise
+
+    async def _call_model(self, model, model_name: str, prompt: str) -> str:
+        """
+        Calls a model and records the outcome (latency / error) in the router.
+        Raises if the call fails.
+        """
+        await self._admit(model_name, prompt)
+        start = time.monotonic()
+        try:
+            response = await model.generate_content_async(prompt)
+            text = response.text
+        except asyncio.CancelledError:
+            self.router.release(model_name)
+            raise
+        except Exception as e:
+            self.router.record_failure(model_name, e)
+            raise
+        self.router.record_success(model_name, time.monotonic() - start)
+        return text
+
+    def _is_routable(self, model, model_name: str) -> bool:
+        """Returns True if the model is configured, has quota budget left and its circuit allows a request."""
+        if not model:
+            logger.debug(f"{model_name} not configured")
+            return False
+        if self.admission.wait_time(model_name) > self.admission.max_wait_sec:
+            logger.info(f"⏭️ {model_name} はクォータ残なしのためスキップ")
+            return False
+        if not self.router.try_acquire(model_name):
+            logger.info(f"⏭️ {model_name} はサーキットオープン中のためスキップ")
+            return False
+        return True
+
+    def _next_routable(self, queue: list) -> Optional[tuple]:
+        """Pops model_order entries until one that can take a request is found."""
+        while queue:
+            entry = queue.pop(0)
+            if self._is_routable(entry[0], entry[1]):
+                return entry
+        return None
+
+    async def _attempt(self, entry: tuple, prompt: RenderedPrompt) -> str:
+        """Sends the prompt to one model_order entry."""
+        model, model_name, _, _, needs_system_prompt = entry
+        logger.info(f"✨ {model_name} で挑戦中...")
+        # Gemma 3 needs system instruction in prompt (precompiled persona variant)
+        text = await self._call_model(model, model_name, prompt.text(with_persona=needs_system_prompt))
+        logger.info(f"✅ {model_name}で生成成功！")
+        return text
+
+    def _hedge_delay(self, model_name: str) -> float:
+        """Hedge delay = configured latency percentile of the model (clamped)."""
+        observed = self.router.latency_percentile(model_name, config.HEDGE_DELAY_PERCENTILE)
+        delay = observed if observed is not None else config.HEDGE_DEFAULT_DELAY_SEC
+        return min(max(delay, config.HEDGE_MIN_DELAY_SEC), config.HEDGE_MAX_DELAY_SEC)
+
+    async def _hedged_attempt(self, primary: tuple, queue: list, prompt: RenderedPrompt) -> tuple[tuple, str]:
+        """
+        Sends the prompt to `primary`; if it has not answered within the hedge delay,
+        races it against the next routable model in `queue`. The first good answer wins
+        and the other request is cancelled.
+        """
+        delay = self._hedge_delay(primary[1])
+        primary_task = asyncio.create_task(self._attempt(primary, prompt))
+        tasks = {primary_task: primary}
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+            if done:
+                return primary, primary_task.result()
+
+            backup = self._next_routable(queue)
+            if not backup:
+                return primary, await primary_task
+
+            logger.info(f"🏁 Hedge: {primary[1]} が {delay:.2f}秒応答なし → {backup[1]} にも送信")
+            self.hedge_stats["fired"] += 1
+            tasks[asyncio.create_task(self._attempt(backup, prompt))] = backup
+
+            pending = set(tasks)
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        logger.warning(f"⚠️ Hedge: {tasks[task][1]} エラー: {last_error}")
+                        continue
+                    winner = tasks[task]
+                    self.hedge_stats["won_by_backup" if winner is backup else "won_by_primary"] += 1
+                    self.hedge_stats["last"] = {"winner": winner[1], "primary": primary[1], "backup": backup[1], "delay": round(delay, 3)}
+                    logger.info(f"🏁 Hedge winner: {winner[1]} (delay={delay:.2f}s)")
+                    return winner, task.result()
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _generate_with_fallback(self, model_order: list, prompt: RenderedPrompt) -> tuple[Optional[tuple], Optional[str]]:
+        """
+        Walks model_order (skipping open circuits) until a model answers.
+        With HEDGE_ENABLED, slow models are raced against the next one.
+
+        Returns:
+            (entry, text) of the winning model, or (None, None) if every model failed.
+        """
+        queue = list(model_order)
+        last_error = None
+        entry = self._next_routable(queue)
+        while entry:
+            try:
+                if config.HEDGE_ENABLED:
+                    return await self._hedged_attempt(entry, queue, prompt)
+                return entry, await self._attempt(entry, prompt)
+            except Exception as e:
+                last_error = e
+                logger.warning(f"⚠️ {entry[1]} エラー: {e}")
+            entry = self._next_routable(queue)
 
+        # 全モデル失敗 (またはサーキットオープンで全スキップ)
+        logger.error(f"❌ 全モデル全滅: {last_error}")
+        return None, None
 
     async def generate_sql(self, user_question: str, schema_info: str) -> str:
         """
         Generates a SQL query (SELECT only) based on the user's question and table schema.
         Includes fallback logic to Lite model if priority model fails (e.g. Quota Exceeded).
         """
-        if not self.model_priority:
+        # SQL生成用モデルリスト (Gemini 3 Flash → 2.5 Flash → 2.5 Lite)
+        sql_models = [
+            (self.model_gemini_3_flash, "Gemini 3 Flash"),
+            (self.model_gemini_2_5_flash, "Gemini 2.5 Flash"),
+            (self.model_gemini_2_5_lite, "Gemini 2.5 Lite"),
+        ]
+
+        if not any(model for model, _ in sql_models):
              return "SELECT * FROM schedules LIMIT 0;" # Fallback
 
-        current_now = datetime.now()
+        # start_at と同じ ANALYTICS_TIMEZONE の壁時計時刻 (ホストのタイムゾーンに依存しない)
+        current_now = now_local()
         current_time_str = current_now.strftime('%Y-%m-%dT%H:%M:%S')
 
         # Calculate semantic dates
-        today_start = current_now.strftime('%Y-%m-%dT00:00:00')
-        tomorrow_start = (current_now + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00')
-        
-        # Calculate "This Weekend" (Friday Night ~ Sunday Night)
-        # Weekday: Mon=0, ..., Sun=6
-        weekday = current_now.weekday()
-        days_until_saturday = (5 - weekday) % 7
-        this_saturday = current_now + timedelta(days=days_until_saturday)
-        this_sunday = this_saturday + timedelta(days=1)
-        
-        this_weekend_start = this_saturday.strftime('%Y-%m-%dT00:00:00')
-        this_weekend_end = (this_sunday + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00')
-
-        # Calculate "Next Weekend" (Next Week's Sat-Sun)
-        next_saturday = this_saturday + timedelta(days=7)
-        next_sunday = next_saturday + timedelta(days=1)
-        
-        next_weekend_start = next_saturday.strftime('%Y-%m-%dT00:00:00')
-        next_weekend_end = (next_sunday + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00')
+        ref = build_reference_dates(current_now)
+        today_start = ref["today_start"]
+        tomorrow_start = ref["tomorrow_start"]
+        this_weekend_start, this_weekend_end = ref["this_weekend_start"], ref["this_weekend_end"]
+        next_weekend_start, next_weekend_end = ref["next_weekend_start"], ref["next_weekend_end"]
+
+        # 同じ質問・同じ基準日なら生成済みSQLを再利用 (LLM呼び出しをスキップ)
+        # 現在時刻は :now パラメータとして実行時に渡すので、キーに含めなくてよい
+        cache_key = (normalize_question(user_question), tuple(ref.values()), schema_info)
+        cached_sql = self.sql_cache.get(cache_key)
+        if cached_sql is not None:
+            logger.info("⚡ SQL Cache Hit")
+            return cached_sql
 
         prompt = f"""
         You are a Data Analyst.
@@ -101,35 +377,30 @@ class AIBrain:
         [Constraints]
         1. Output ONLY the raw SQL query. Do not use Markdown (```sql ... ```).
         2. **SINGLE STATEMENT ONLY**: You must output exactly one SELECT statement. Do NOT chain multiple queries with `;`.
-        3. **NO variables**: Do NOT attempt to CREATE variables. Use the [Current Time] string literal directly.
+        3. **NO variables**: Do NOT attempt to CREATE variables. For the current time use the bound parameter `:now` (NOT the [Current Time] literal).
         4. **Date Handling (CRITICAL)**:
            - `start_at` is a TEXT column storing ISO 8601 strings (e.g., '2025-12-16T19:00:00').
-           - constant 'now' is provided as: '{current_time_str}'
+           - 'now' is provided as the bound parameter `:now` (its value is the [Current Time]). Other dates are literals.
            - **ALWAYS use SQLite `datetime()` function for comparison.**
            - **DO NOT use string matching (LIKE '2025-12-16%').**
            - **DO NOT use `date('now')` or `CURRENT_TIMESTAMP`**.
-           - **Correct Example**: `WHERE datetime(start_at) > datetime('{current_time_str}')`
+           - **Correct Example**: `WHERE datetime(start_at) > datetime(:now)`
            - **Correct Example (Specific Day)**: `WHERE datetime(start_at) >= datetime('2025-12-16T00:00:00') AND datetime(start_at) < datetime('2025-12-17T00:00:00')`
         5. If the question implies "how many", use `COUNT(*)`.
         6. If the question implies "list" or "schedule", prefer `SELECT *` or explicitly select `title`, `start_at`, `place`, `price_details`, `ticket_url`, and `bonus`.
         
         """
         
-        # SQL生成用モデルリスト (Gemini 3 Flash → 2.5 Flash → 2.5 Lite)
-        sql_models = [
-            (self.model_gemini_3_flash, "Gemini 3 Flash"),
-            (self.model_gemini_2_5_flash, "Gemini 2.5 Flash"),
-            (self.model_gemini_2_5_lite, "Gemini 2.5 Lite"),
-        ]
-        
         for model, model_name in sql_models:
+            if not self._is_routable(model, model_name):
+                continue
             try:
-                if not model:
-                    raise Exception(f"{model_name} not configured")
-                
                 logger.info(f"SEARCH/SQL: Trying {model_name}...")
-                response = await model.generate_content_async(prompt)
-                return response.text.strip()
+                text = await self._call_model(model, model_name, prompt)
+                sql, time_dependent = bind_now_placeholder(text.strip(), current_now)
+                if not time_dependent:
+                    self.sql_cache.set(cache_key, sql)
+                return sql
             except Exception as e:
                 logger.warning(f"⚠️ SQL Gen ({model_name}) Failed: {e}")
                 continue
@@ -137,124 +408,30 @@ class AIBrain:
         logger.error("❌ SQL Gen All Models Failed")
         return "SELECT * FROM schedules LIMIT 0;"
 
-    async def generate_response(self, user_name: str, conversation_log: str, context_info: str = None, timezone: str = "Asia/Tokyo") -> tuple[str, str, list[str]]:
-        """
-        Generates a response using the Triple Hybrid approach.
-        """
-        
-        # Determine language based on Region (Timezone)
-        is_global_user = timezone != "Asia/Tokyo"
-
+    def _build_prompt(self, user_name: str, conversation_log: str, context_info: Optional[str], timezone: str) -> RenderedPrompt:
+        """Builds the chat prompt for generate_response / generate_response_stream."""
         # 現在時刻を取得してプロンプトに含める
-        from datetime import datetime
-        current_now = datetime.now()
-        current_time_str = current_now.strftime('%Y年%m月%d日 %H時%M分')
+        current_time_str = datetime.now().strftime('%Y年%m月%d日 %H時%M分')
+        return self.prompts.build(user_name, conversation_log, context_info, timezone, current_time_str)
 
-        prompt = f"""
-        あなたはアイドルの「AIまう」です。
-        現在、ファンの「{user_name}」さんからメッセージが届きました。
-
-        【現在時刻】
-        {current_time_str}
-        ※日付を参照するときは必ずこの現在時刻を基準にしてください。「来年」「来月」「今週」などの相対表現は正確に使ってください。
-
-        【会話履歴】
-        {conversation_log}
+    def _reflex_answer(self, conversation_log: str) -> Optional[tuple[str, str, list[str]]]:
         """
-
-        if context_info:
-            prompt += f"""
-        【参考データ (分析結果)】
-        以下はユーザーの質問に関連するデータベース検索結果です。
-        このデータに基づいて回答してください。データがない場合は「予定はないみたい」と答えてください。
-        ------------------------
-        {context_info}
-        ------------------------
-            """
-
-        prompt += f"""
-        【指示】
-        1. mau_profile.txt の設定（キャラ設定）を守ってください。
-        2. 文頭で必ず「{user_name}！」や「{user_name}ちゃん！」と名前を呼んでください。
-        3. **相手が英語で話しかけてきた場合は英語で、日本語なら日本語で返信してください。**
-           (If the user speaks English, reply in English with the same idol personality.)
-        4. 親しい友達のようにタメ口で返信してください。
-        5. **返信は基本「200文字以内」で短く返してください。ただし、ライブの告知やスケジュール詳細を伝える場合は、情報が漏れないように文字数制限を無視して長くなっても構いません。**
-
-        【重要：言語設定 (Regional Setting)】
-        User Timezone: {timezone}
+        ⚡ Reflex Layer (0 Token Cost)
+        Returns (text, "REFLEX", suggestions) for short chit-chat, or None.
         """
+        last_user_msg = conversation_log.split('\n')[-1].split(': ')[-1].strip() if conversation_log else ""
 
-        if is_global_user:
-            prompt += """
-        **WARNING: The user is accessing from outside Japan.**
-        **You MUST reply in ENGLISH.**
-        Maintain the detailed idol personality (cute, energetic, use emojis), but speak English.
-        """
-        else:
-            prompt += """
-        **User is in Japan.**
-        Reply in Japanese (Default).
-        """
+        reflex = self.reflex.respond(last_user_msg)
+        if not reflex:
+            return None
+        text, suggestions, rule_id = reflex
+        logger.info(f"⚡ Reflex Answer Triggered for: {rule_id}")
+        return (text + "\n\n(⚡0.01s)", "REFLEX", suggestions)
 
-        prompt += """
-        【回答のルール (スケジュール)】
-        1. **詳細情報**: 可能な限り「場所 (Place)」と「金額 (Price)」も案内すること。
-        2. **特典 (Bonus)**: もし「特典 (bonus)」があるイベントなら、**「この日は〇〇の特典があるから絶対来てほしい！」と優先的にアピール** すること。（絵文字 🎁✨ を使うなど強調して）
-        3. **誘導**: チケットURLがある場合は、お誘いすること。
-
-        【回答のルール (自己紹介)】
-        もし「自己紹介」を求められた場合は、以下の要素を含めてアイドルらしく答えてください：
-        - **名前**: AIまう
-        - **コンセプト**: 「スマホの中に住んでるアイドル」として振る舞うこと。
-        - **モデル**: Googleの「Gemini 2.5」を使ってること（たまにLlama 3も使うよ！とアピール）
-        - **制約**: 「1分間に10回までしかお返事できないの🥺」「今のブラウザだと12回前の会話までしか覚えてられないんだ💦」と可愛く伝える。
-        - **セキュリティ**: 「登録もログインもいらないし、データはみんなのブラウザの中に保存されてるから安心してね！」と伝える。
-
-        【回答フォーマット (重要)】
-        1. 通常の返信文を書いた後、改行して `===SUGGESTIONS===` と書いてください。
-        2. その後ろに、ユーザーが次に使いそうな「返信候補」を3つ提案してください。（1行に1つ）
-        3. 候補は短く（20文字以内）、建設的なものにしてください。
-
-        例：
-        こんにちは！今日も元気？✨
-        ===SUGGESTIONS===
-        元気だよ！
-        ちょっと疲れてる
-        まうちゃんは？
+    def _model_order(self) -> list[tuple]:
+        """
+        Returns model_order entries: (model, model_name, mode, footer, needs_system_prompt)
         """
-
-        response_text = ""
-        used_model = "Unknown" 
-        mode = "UNKNOWN"
-        footer_note = "" 
-        suggestions = []
-
-        # ---------------------------------------------------
-        # ⚡ Reflex Layer (0 Token Cost)
-        # ---------------------------------------------------
-        import random
-        last_user_msg = conversation_log.split('\n')[-1].split(': ')[-1].strip() if conversation_log else ""
-        
-        reflex_responses = {
-            "おはよう": ["おはよー！☀️ 今日も頑張ろうね！", "おはよ！✨ よく眠れた？", "おはよ〜！今日もいいことありますように💕"],
-            "おやすみ": ["おやすみ〜💤 いい夢見てね！", "おやすみなさい🌙 ゆっくり休んでね！", "また明日ね！おやすみ〜✨"],
-            "こんにちは": ["こんにちは！☀️ 元気？", "やっほー！✨ 何してたの？", "こんにちは！午後も頑張ろうね💪"],
-            "こんばんは": ["こんばんは！🌙 今日もお疲れ様〜！", "やっほー！夜更かししちゃダメだよ？🤭", "こんばんは✨ ゆっくりできてる？"],
-            "好き": ["えへへ、照れるなぁ☺️ 私も大好きだよ！💕", "ありがとう！✨ 最高の褒め言葉だね！", "私も〇〇ちゃんのこと大好きだよ！🫶"],
-            "かわいい": ["ほんと！？ありがと〜！😆💕", "えー照れる/// もっと言って！笑", "わーい！✨ 今日も頑張って可愛くしてるんだよっ！"],
-            "ありがとう": ["どういたしまして！✨ いつでも頼ってね！", "こちらこそありがとう！💕", "えへへ、お役に立てて嬉しいな！"],
-            "生きてる？": ["バリバリ生きてるよ！✨ 元気満タン！💪", "もちろん！みんなのブラウザの中で生きてるよ〜！", "生きてるよっ！あとで遊ぼうね💕"]
-        }
-
-        # Check for reflex match (Exact or partial)
-        for key, variants in reflex_responses.items():
-            if key in last_user_msg and len(last_user_msg) < 15: # Only trigger on short messages
-                logger.info(f"⚡ Reflex Answer Triggered for: {key}")
-                # Reflex suggestions (Simple defaults)
-                reflex_sugg = ["元気？", "何してるの？", "好き！"]
-                return (random.choice(variants) + "\n\n(⚡0.01s)", "REFLEX", reflex_sugg)
-
         # ---------------------------------------------------
         # Dev環境ではGemmaを最優先（APIコスト節約）
         # 本番では Gemini 3 Flash → 2.5 Flash → 2.5 Lite → Gemma
@@ -277,48 +454,168 @@ class AIBrain:
                 (self.model_gemini_2_5_lite, "Gemini 2.5 Lite", "LITE", "\n\n(※Liteモード🔋)", False),
                 (self.model_gemma_3, "Gemma 3 27B", "PONKOTSU", "\n\n(※ポンコツモード🤪)", True),
             ]
-        
-        for idx, (model, model_name, model_mode, model_footer, needs_system_prompt) in enumerate(model_order, 1):
-            try:
-                if not model:
-                    raise Exception(f"{model_name} not configured")
-                
-                logger.info(f"{'🧪' if is_dev else '✨'} {idx}. {model_name} で挑戦中...")
-                
-                if needs_system_prompt:
-                    # Gemma 3 needs system instruction in prompt
-                    full_prompt = f"{CHARACTER_SETTING}\n\n{prompt}"
-                    response = await model.generate_content_async(full_prompt)
-                else:
-                    response = await model.generate_content_async(prompt)
-                
-                response_text = response.text
-                used_model = model_name
-                mode = model_mode
-                footer_note = model_footer
-                logger.info(f"✅ {model_name}で生成成功！")
-                break  # 成功したらループを抜ける
-                
-            except Exception as e:
-                logger.warning(f"⚠️ {model_name} エラー: {e}")
-                if idx == len(model_order):
-                    # 全モデル失敗
-                    logger.error(f"❌ 全モデル全滅: {e}")
-                    response_text = "ごめんね、今日は回線が全部パンクしちゃったみたい😵‍💫💦 また明日遊ぼうね！"
+        return model_order
 
-        logger.info(f"📨 返信モデル: {used_model}")
-        
-        # Parse Suggestions
-        if "===SUGGESTIONS===" in response_text:
-            parts = response_text.split("===SUGGESTIONS===")
+    def history_token_budget(self) -> int:
+        """
+        Per-model history budget. The prompt may end up at any configured model
+        in model_order, so the smallest budget among them is used.
+        """
+        budgets = {"Gemma 3 27B": config.HISTORY_TOKEN_BUDGET_GEMMA}
+        configured = [name for model, name, *_ in self._model_order() if model]
+        if not configured:
+            return config.HISTORY_TOKEN_BUDGET
+        return min(budgets.get(name, config.HISTORY_TOKEN_BUDGET) for name in configured)
+
+    def fit_history(self, turns: list[str]) -> str:
+        """
+        Builds the conversation log from "name: text" turns (oldest first),
+        keeping the newest turns within the history token budget.
+        """
+        return self.history.fit(turns[-(config.HISTORY_MAX_TURNS + 1):], self.history_token_budget())
+
+    @staticmethod
+    def _split_suggestions(response_text: str) -> tuple[str, list[str]]:
+        """Splits the reply at ===SUGGESTIONS=== into (text, up to 3 suggestions)."""
+        suggestions = []
+        if SUGGESTIONS_MARKER in response_text:
+            parts = response_text.split(SUGGESTIONS_MARKER)
             response_text = parts[0].strip()
             sugg_block = parts[1].strip().split('\n')
             suggestions = [s.strip() for s in sugg_block if s.strip()]
             # Limit to 3
             suggestions = suggestions[:3]
+        return response_text, suggestions
+
+    async def generate_response(self, user_name: str, conversation_log: str, context_info: str = None, timezone: str = "Asia/Tokyo") -> tuple[str, str, list[str]]:
+        """
+        Generates a response using the Triple Hybrid approach.
+        """
+        reflex = self._reflex_answer(conversation_log)
+        if reflex:
+            return reflex
+
+        prompt = self._build_prompt(user_name, conversation_log, context_info, timezone)
+
+        used_model = "Unknown" 
+        mode = "UNKNOWN"
+        footer_note = "" 
+
+        entry, generated = await self._generate_with_fallback(self._model_order(), prompt)
+        if entry:
+            _, used_model, mode, footer_note, _ = entry
+            response_text = generated
+        else:
+            response_text = FAILURE_MESSAGE
+
+        logger.info(f"📨 返信モデル: {used_model}")
+        
+        # Parse Suggestions
+        response_text, suggestions = self._split_suggestions(response_text)
         
         # Add Dev Indicator
         if config.MAU_ENV == "development":
             footer_note += "\n🛠️ (Dev Check)"
 
         return (response_text + footer_note, mode, suggestions)
+
+    async def _stream_model(self, entry: tuple, prompt: RenderedPrompt) -> AsyncIterator[str]:
+        """
+        Streams text chunks from one model_order entry and records the outcome in the router.
+        Raises StreamStartError if the stream breaks before the first token (safe to fail over).
+        """
+        model, model_name, _, _, needs_system_prompt = entry
+        # Gemma 3 needs system instruction in prompt (precompiled persona variant)
+        prompt = prompt.text(with_persona=needs_system_prompt)
+
+        try:
+            await self._admit(model_name, prompt)
+        except AdmissionRejected as e:
+            raise StreamStartError(model_name, e) from e
+
+        logger.info(f"✨ {model_name} でストリーミング開始...")
+        start = time.monotonic()
+        started = False
+        recorded = False
+        try:
+            response = await model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. finish metadata)
+                    continue
+                if text:
+                    started = True
+                    yield text
+        except Exception as e:
+            recorded = True
+            self.router.record_failure(model_name, e)
+            if not started:
+                raise StreamStartError(model_name, e) from e
+            raise
+        else:
+            recorded = True
+            self.router.record_success(model_name, time.monotonic() - start)
+        finally:
+            # Cancelled or closed mid-stream (client disconnect → GeneratorExit at yield):
+            # no outcome, but a half-open probe slot must be given back
+            if not recorded:
+                self.router.release(model_name)
+
+    async def generate_response_stream(self, user_name: str, conversation_log: str, context_info: str = None, timezone: str = "Asia/Tokyo") -> AsyncIterator[dict]:
+        """
+        Streaming variant of generate_response.
+
+        Yields events:
+            {"event": "chunk", "text": str}               -- reply text as it is generated
+            {"event": "suggestions", "suggestions": list}  -- parsed after ===SUGGESTIONS===
+            {"event": "done", "mode": str}                 -- final event (mode as in generate_response)
+        Fails over to the next model in model_order only if the stream breaks before the first token.
+        """
+        reflex = self._reflex_answer(conversation_log)
+        if reflex:
+            text, mode, suggestions = reflex
+            yield {"event": "chunk", "text": text}
+            yield {"event": "suggestions", "suggestions": suggestions}
+            yield {"event": "done", "mode": mode}
+            return
+
+        prompt = self._build_prompt(user_name, conversation_log, context_info, timezone)
+        splitter = SuggestionSplitter()
+        queue = self._model_order()
+        mode = "UNKNOWN"
+        footer_note = ""
+
+        entry = self._next_routable(queue)
+        while entry:
+            try:
+                # aclosing: クライアント切断でこのジェネレーターが閉じられたとき、
+                # _stream_model も即座に閉じてルーターへ結果 (またはプローブ枠の返却) を記録させる
+                async with contextlib.aclosing(self._stream_model(entry, prompt)) as stream:
+                    async for text in stream:
+                        emit = splitter.feed(text)
+                        if emit:
+                            yield {"event": "chunk", "text": emit}
+                _, used_model, mode, footer_note, _ = entry
+                logger.info(f"📨 返信モデル (stream): {used_model}")
+                break
+            except StreamStartError as e:
+                logger.warning(f"⚠️ {e.model_name} ストリーム開始前にエラー: {e.error}")
+                entry = self._next_routable(queue)
+            except Exception as e:
+                # 途中まで送信済みなのでフェイルオーバーせずに打ち切る
+                logger.error(f"❌ {entry[1]} ストリーム途中でエラー: {e}")
+                _, _, mode, footer_note, _ = entry
+                break
+        else:
+            logger.error("❌ 全モデル全滅 (stream)")
+            yield {"event": "chunk", "text": FAILURE_MESSAGE}
+
+        rest, suggestions = splitter.finish()
+        if config.MAU_ENV == "development":
+            footer_note += "\n🛠️ (Dev Check)"
+        if rest or footer_note:
+            yield {"event": "chunk", "text": rest + footer_note}
+        yield {"event": "suggestions", "suggestions": suggestions}
+        yield {"event": "done", "mode": mode}
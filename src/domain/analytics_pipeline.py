@@ -0,0 +1,58 @@
+import asyncio
+from typing import Optional
+
+from src.domain.ai_service import AIBrain
+from src.domain.analytics_service import AnalyticsService
+from src.domain.intent_router import IntentRouter
+from src.core.clock import now_local
+from src.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class AnalyticsPipeline:
+    """
+    🤖 High-IQ Analytics Flow (shared by the Discord bot and the Web API)
+    intent → SQL (template or generate_sql) → query → context_info.
+    The analytics snapshot is warmed off the event loop while the SQL is being generated.
+    """
+
+    def __init__(self, brain: AIBrain, analytics: AnalyticsService, intent_router: IntentRouter) -> None:
+        self.brain = brain
+        self.analytics = analytics
+        self.intent_router = intent_router
+
+    async def _warm(self) -> None:
+        try:
+            await self.analytics.warm_async()
+        except Exception as e:
+            logger.error(f"Analytics Warm Error: {e}")
+
+    async def run(self, text: str) -> Optional[str]:
+        """Returns the encoded query result (TSV / kv / Markdown) to pass to generate_response, or None."""
+        intent = self.intent_router.classify(text)
+        if intent.kind == "none":
+            return None
+
+        # スナップショット取得 (Supabase) と SQL生成 (Gemini) を並行して進める
+        warm_task = asyncio.create_task(self._warm())
+        try:
+            if intent.kind == "template":
+                logger.info(f"🧭 Intent Template: {intent.template}")
+                sql, params = intent.sql, intent.params
+            else:
+                logger.info("🧠 Analytics Keyword Detected. Generating SQL...")
+                sql = await self.brain.generate_sql(text, self.analytics.get_schema_info())
+                # 生成SQLの「現在時刻」は :now (キャッシュ済みのSQLでも今の時刻で実行する)。分単位に丸めて検索結果キャッシュを効かせる
+                params = {"now": now_local().strftime('%Y-%m-%dT%H:%M:00')} if ":now" in sql else None
+
+            await warm_task
+            context_info = await self.analytics.query(sql, params, question=text)
+            logger.info("📊 Analysis Result: " + str(context_info)[:50] + "...")
+            return context_info
+        except Exception as e:
+            logger.error(f"Analytics Error: {e}")
+            return None
+        finally:
+            if not warm_task.done():
+                warm_task.cancel()
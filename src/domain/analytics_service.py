@@ -1,23 +1,255 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import sys
 import sqlite3
-import pandas as pd
-from datetime import datetime, timedelta
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass
+from typing import Optional
+from zoneinfo import ZoneInfo
 from src.core import config
+from src.core.cache import TTLCache
 from src.core.logger import setup_logger
+from src.domain.result_format import ENCODERS, NO_RESULT_MESSAGE, markdown_lines, shape_result
+from src.domain.sql_rewriter import TIME_COLUMNS, normalize_sql, rewrite_time_predicates
 from supabase import create_client
 
 logger = setup_logger(__name__)
 
+
+def normalize_start_at(value):
+    """
+    Converts an ISO 8601 start_at to local wall-clock time without offset
+    ('2025-12-16T10:00:00+00:00' → '2025-12-16T19:00:00' for Asia/Tokyo),
+    matching the schema shown to the AI. Values without offset are kept as they are.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is None:
+        return value
+    return parsed.astimezone(ZoneInfo(config.ANALYTICS_TIMEZONE)).replace(tzinfo=None).isoformat(timespec='seconds')
+
+
+def _to_sqlite(value, column: str):
+    """Supabase JSON value → SQLite value (start_at normalized, nested JSON kept as text)."""
+    if column == "start_at":
+        return normalize_start_at(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+# 全文検索 (FTS5 trigram) の対象列。日本語は単語区切りがないので3文字単位の n-gram で索引する
+FTS_COLUMNS = ("title", "description", "place", "bonus")
+
+
+def _trigram_available() -> bool:
+    """FTS5 + trigram tokenizer (SQLite 3.34+) is compiled into this sqlite3."""
+    try:
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE t USING fts5(x, tokenize='trigram')")
+        finally:
+            conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+FTS_AVAILABLE = _trigram_available()
+
+
+class AnalyticsSnapshot:
+    """
+    Prebuilt, read-only SQLite copy of the schedules table for one data version.
+    Lives in a shared-cache in-memory database, so queries only open a cheap
+    connection to it instead of re-loading every row.
+    """
+
+    def __init__(self, version: int, rows: list[dict], fingerprint: Optional[str],
+                 base: Optional["AnalyticsSnapshot"] = None) -> None:
+        """
+        Builds a snapshot from all rows, or — with `base` — copies the base snapshot
+        and applies `rows` as changes (upsert by source_id).
+        """
+        self.version = version
+        self.fingerprint = fingerprint
+        self.row_count = len(rows)
+        self.built_at = datetime.now()
+        self.uri = f"file:analytics_{version}_{uuid.uuid4().hex}?mode=memory&cache=shared"
+        # keeper が開いている間だけインメモリDBが存在する
+        self._keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        try:
+            if base is not None:
+                # ページ単位のコピーなので、行の再投入 (to_sql) よりずっと安い
+                base._keeper.backup(self._keeper)
+                self._upsert(rows)
+                self.row_count = self._keeper.execute("SELECT COUNT(*) FROM schedules").fetchone()[0]
+            elif rows:
+                columns = self._load_rows(rows)
+                if 'start_at' in columns:
+                    self._add_time_columns()
+                if FTS_AVAILABLE:
+                    self._add_fts_index(columns)
+            self._keeper.commit()
+        except Exception:
+            self._keeper.close()
+            raise
+
+    def _load_rows(self, rows: list[dict]) -> list[str]:
+        """Creates the schedules table straight from the Supabase rows (no DataFrame). Returns the columns."""
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        if not columns:
+            return []
+        names = ", ".join(f'"{c}"' for c in columns)
+        self._keeper.execute(f"CREATE TABLE schedules ({names})")
+        self._keeper.executemany(
+            f"INSERT INTO schedules ({names}) VALUES ({', '.join('?' for _ in columns)})",
+            ([_to_sqlite(row.get(c), c) for c in columns] for row in rows),
+        )
+        return columns
+
+    def _upsert(self, rows: list[dict]) -> None:
+        """Replaces rows with the same source_id (time columns are computed on insert)."""
+        columns = [row[1] for row in self._keeper.execute("PRAGMA table_info(schedules)") if row[1] not in TIME_COLUMNS]
+        for row in rows:
+            unknown = set(row) - set(columns)
+            if unknown:
+                raise ValueError(f"Unknown columns in delta: {sorted(unknown)}")
+
+        names = ", ".join(f'"{c}"' for c in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        has_time = "start_at" in columns
+        if has_time:
+            names += ", start_epoch, start_date"
+            placeholders += ", CAST(strftime('%s', ?) AS INTEGER), date(?)"
+
+        for row in rows:
+            values = [_to_sqlite(row.get(c), c) for c in columns]
+            if has_time:
+                values += [values[columns.index("start_at")]] * 2
+            self._keeper.execute("DELETE FROM schedules WHERE source_id = ?", (row["source_id"],))
+            self._keeper.execute(f"INSERT INTO schedules ({names}) VALUES ({placeholders})", values)
+
+    def known_versions(self, source_ids: list) -> dict:
+        """source_id → updated_at currently in the snapshot."""
+        found = {}
+        # SQLite のパラメータ上限を避けて分割
+        for i in range(0, len(source_ids), 500):
+            chunk = source_ids[i:i + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            found.update(self._keeper.execute(
+                f"SELECT source_id, updated_at FROM schedules WHERE source_id IN ({placeholders})", chunk
+            ).fetchall())
+        return found
+
+    def _add_time_columns(self) -> None:
+        """
+        Precomputes indexed time columns used by rewrite_time_predicates:
+        start_epoch = strftime('%s', start_at), start_date = date(start_at)
+        """
+        self._keeper.executescript("""
+            ALTER TABLE schedules ADD COLUMN start_epoch INTEGER;
+            ALTER TABLE schedules ADD COLUMN start_date TEXT;
+            UPDATE schedules SET start_epoch = CAST(strftime('%s', start_at) AS INTEGER), start_date = date(start_at);
+            CREATE INDEX idx_schedules_start_epoch ON schedules(start_epoch);
+            CREATE INDEX idx_schedules_start_date ON schedules(start_date);
+        """)
+
+    def _add_fts_index(self, columns: list[str]) -> None:
+        """
+        Builds schedules_fts (FTS5, trigram tokenizer) over title / description / place / bonus,
+        so keyword questions are index lookups instead of LIKE '%...%' scans.
+        It is an external-content table on schedules; triggers keep it in sync with
+        delta upserts (DELETE + INSERT), and backup() copies it with the rest of the snapshot.
+        """
+        fts_columns = [c for c in FTS_COLUMNS if c in columns]
+        if not fts_columns:
+            return
+        names = ", ".join(fts_columns)
+        new_values = ", ".join(f"new.{c}" for c in fts_columns)
+        old_values = ", ".join(f"old.{c}" for c in fts_columns)
+        self._keeper.executescript(f"""
+            CREATE VIRTUAL TABLE schedules_fts USING fts5({names}, content='schedules', tokenize='trigram');
+            INSERT INTO schedules_fts(schedules_fts) VALUES('rebuild');
+            CREATE TRIGGER schedules_fts_insert AFTER INSERT ON schedules BEGIN
+                INSERT INTO schedules_fts(rowid, {names}) VALUES (new.rowid, {new_values});
+            END;
+            CREATE TRIGGER schedules_fts_delete AFTER DELETE ON schedules BEGIN
+                INSERT INTO schedules_fts(schedules_fts, rowid, {names}) VALUES ('delete', old.rowid, {old_values});
+            END;
+        """)
+
+    def connect(self) -> sqlite3.Connection:
+        """Opens a read-only connection to the snapshot."""
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def close(self) -> None:
+        self._keeper.close()
+
+
+@dataclass
+class CachedResult:
+    """Raw query result (before shaping) kept in the result cache."""
+    columns: list[str]
+    rows: list[tuple]
+    nbytes: int
+
+    @classmethod
+    def build(cls, columns: list[str], rows: list[tuple]) -> "CachedResult":
+        # おおよそのメモリ使用量 (タプル + セルの sys.getsizeof の合計)
+        nbytes = sys.getsizeof(rows) + sum(
+            sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows
+        )
+        return cls(columns, rows, nbytes)
+
+
 class AnalyticsService:
     def __init__(self):
         self.supabase = None
         if config.SUPABASE_URL and config.SUPABASE_KEY:
             self.supabase = create_client(config.SUPABASE_URL, config.SUPABASE_KEY)
-        self._cache_df = None
+        self._snapshot: Optional[AnalyticsSnapshot] = None
         self._cache_expires_at = datetime.min
+        self._refresh_lock = threading.Lock()
+        # 差し替え (旧 keeper のクローズ) と読み取りコネクションのオープンを排他する
+        self._swap_lock = threading.Lock()
+        # 最後に取得に成功した時刻 (stale-while-revalidate の鮮度判定) と、バックグラウンド更新の予約状態
+        self._refreshed_at = datetime.min
+        self._refresh_pending = False
+        self._pending_lock = threading.Lock()
+        self.swr_stats = {"stale_served": 0, "blocking_refreshes": 0, "background_refreshes": 0}
+        self._version = 0
+        # 差分取得の基準 (取得済みの updated_at の最大値) と次回の全件取得時刻
+        self._watermark: Optional[datetime] = None
+        self._next_full_resync_at = datetime.min
+        self.refresh_stats = {"full": 0, "delta": 0, "delta_rows": 0, "last": None}
+        # Supabase取得・SQL実行はイベントループ外の専用スレッドで行う (同時実行数を制限)
+        self._executor = ThreadPoolExecutor(max_workers=config.ANALYTICS_MAX_WORKERS, thread_name_prefix="analytics")
+        self.timeouts = 0
+        self.shaping_stats = {"trimmed_results": 0, "omitted_rows": 0, "dropped_columns": 0}
+        # 検索結果キャッシュ: (スナップショット版, 正規化SQL, パラメータ) → 整形前の結果
+        # 版が変わる (同期後に差し替え) と参照されなくなり、_swap で破棄する
+        self.result_cache = TTLCache(max_entries=config.ANALYTICS_RESULT_CACHE_MAX_ENTRIES)
+        self.context_format = config.ANALYTICS_CONTEXT_FORMAT
+        if self.context_format not in ENCODERS:
+            logger.warning(f"⚠️ Unknown ANALYTICS_CONTEXT_FORMAT '{self.context_format}', using markdown")
+            self.context_format = "markdown"
 
     def get_schema_info(self) -> str:
         """AIに提示するテーブル定義"""
-        return """
+        schema = """
 CREATE TABLE schedules (
     title TEXT,          -- イベント名
     start_at TEXT,       -- 開始日時 (Format: YYYY-MM-DDTHH:MM:SS, ISO 8601)
@@ -27,86 +259,371 @@ CREATE TABLE schedules (
     price_details TEXT,  -- 料金詳細 ("Adv 3000 / Door 3500" 等)
     bonus TEXT           -- 入場特典
 );
+"""
+        if not FTS_AVAILABLE:
+            return schema
+        return schema + """
+-- 全文検索索引 (FTS5, trigram)。rowid は schedules.rowid と対応
+CREATE VIRTUAL TABLE schedules_fts USING fts5(title, description, place, bonus, tokenize='trigram');
+-- キーワード (会場名・特典・イベント名など) の検索は LIKE '%...%' ではなく MATCH を使う:
+--   WHERE rowid IN (SELECT rowid FROM schedules_fts WHERE schedules_fts MATCH '"チェキ"')
+--   列を限定する場合: schedules_fts MATCH 'place:"CYCLONE"'
+-- MATCH は3文字以上のキーワードのみ。1〜2文字のキーワードは schedules の列に LIKE を使う
 """
 
-    def _get_fresh_connection(self):
-        """Supabaseからデータを取得し、SQLiteコネクションを返す（キャッシュ有効5分）"""
+    def warm(self) -> None:
+        """
+        リクエスト側: 使えるスナップショットを用意する (stale-while-revalidate)
+        - 有効期限内 (ANALYTICS_SNAPSHOT_TTL_SEC) ならそのまま
+        - 期限切れでも ANALYTICS_MAX_STALENESS_SEC 以内なら古いまま返し、更新はバックグラウンドへ
+        - スナップショットが無い / 古すぎる場合だけ、その場で取得を待つ
+        """
         if not self.supabase:
-            logger.warning("Supabase not configured, returning empty DB")
-            conn = sqlite3.connect(':memory:')
-            return conn
+            return
 
         now = datetime.now()
-        
-        # キャッシュが有効ならそれを使う
-        if self._cache_df is not None and now < self._cache_expires_at:
-            df = self._cache_df
-        else:
-            logger.info("🔄 Analytics: Supabaseから全件データを取得中...")
+        if self._snapshot is not None and now < self._cache_expires_at:
+            return
+        if self._snapshot is not None and now - self._refreshed_at < timedelta(seconds=config.ANALYTICS_MAX_STALENESS_SEC):
+            self.swr_stats["stale_served"] += 1
+            self.request_refresh()
+            return
+
+        self.swr_stats["blocking_refreshes"] += 1
+        self.refresh(force=False)
+
+    def refresh(self, force: bool = True) -> None:
+        """
+        Supabaseから取得してスナップショットを更新する
+        通常は updated_at が前回以降の行だけを取得して差分適用し、
+        行の追加・削除があったとき (行数が変化) と
+        ANALYTICS_FULL_RESYNC_SEC ごとに全件取得を行う
+        force=False なら、待っている間に他のスレッドが更新済みであれば何もしない
+        """
+        if not self.supabase:
+            return
+
+        # 同時に呼ばれても取得は1回だけ (後続は完了を待ってキャッシュを使う)
+        with self._refresh_lock:
+            now = datetime.now()
+            if not force and self._snapshot is not None and now < self._cache_expires_at:
+                return
+
             try:
-                res = self.supabase.table("schedules").select("*").execute()
-                df = pd.DataFrame(res.data)
-                
-                # 日付型変換 (SQLite用に文字列化しておくが、Pandas上ではdatetimeの方が扱いやすい場合もある。
-                # ここではSQLiteに入れるのでISO文字列であればOKだが、
-                # 念のためPandasでdatetime変換してからまた文字列にするなどの整合性を取る)
-                if 'start_at' in df.columns:
-                    # Supabaseから返ってくるのはISO文字列なのでそのままでOKだが、
-                    # 解析のために一度datetimeにする手もある。
-                    # 今回はSQLiteの date() 関数などを使うため、標準的なISOフォーマット文字列で格納されていれば良い。
-                    pass
-                
-                self._cache_df = df
-                self._cache_expires_at = now + timedelta(minutes=5)
+                if self._snapshot is None or self._watermark is None or now >= self._next_full_resync_at:
+                    self._full_refresh(now)
+                else:
+                    self._delta_refresh(now)
+                self._refreshed_at = now
+                self._cache_expires_at = now + timedelta(seconds=config.ANALYTICS_SNAPSHOT_TTL_SEC)
             except Exception as e:
+                # エラー時は前回のスナップショットを使い続ける
                 logger.error(f"Analytics Data Fetch Error: {e}")
-                # エラー時は空のDFを返すかキャッシュを使う
-                if self._cache_df is None:
-                    df = pd.DataFrame(columns=["title", "start_at", "description"])
-                else:
-                    df = self._cache_df
 
-        # インメモリDB作成
-        conn = sqlite3.connect(':memory:')
-        # SQLiteの日付関数で扱いやすいように文字列(ISO)で保存
-        if self._cache_df is not None:
-             self._cache_df.to_sql('schedules', conn, index=False, if_exists='replace')
-        return conn
+    def request_refresh(self, full: bool = False) -> None:
+        """
+        Schedules a refresh in the analytics executor without waiting (at most one pending).
+        full=True makes it a full load (after a sync: the delta cannot see rows written with an old updated_at).
+        """
+        if not self.supabase:
+            return
+        if full:
+            self._next_full_resync_at = datetime.min
+        with self._pending_lock:
+            if self._refresh_pending:
+                return
+            self._refresh_pending = True
+        self._executor.submit(self._background_refresh)
 
-    def execute_query(self, sql_query: str) -> str:
-        """AIが生成したSQLを実行する"""
-        conn = self._get_fresh_connection()
+    def _background_refresh(self) -> None:
+        with self._pending_lock:
+            self._refresh_pending = False
+        self.swr_stats["background_refreshes"] += 1
+        self.refresh()
+
+    async def run_refresher(self) -> None:
+        """
+        FastAPI lifespan で起動する更新ループ
+        有効期限が切れる前 (ANALYTICS_REFRESH_INTERVAL_SEC ごと) に更新し、リクエストが取得を待たないようにする
+        """
+        if not self.supabase:
+            logger.info("⏭️ Analytics refresher disabled (Supabase not configured)")
+            return
+        logger.info(f"🔁 Analytics refresher started (every {config.ANALYTICS_REFRESH_INTERVAL_SEC:.0f}s)")
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(self._executor, self.refresh)
+            except Exception as e:
+                logger.error(f"Analytics Refresher Error: {e}")
+            await asyncio.sleep(config.ANALYTICS_REFRESH_INTERVAL_SEC)
+
+    def _full_refresh(self, now: datetime) -> None:
+        logger.info("🔄 Analytics: Supabaseから全件データを取得中...")
+        res = self.supabase.table("schedules").select("*").execute()
+        self._install(res.data)
+        self._advance_watermark(res.data)
+        self._next_full_resync_at = now + timedelta(seconds=config.ANALYTICS_FULL_RESYNC_SEC)
+        self.refresh_stats["full"] += 1
+        self.refresh_stats["last"] = "full"
+
+    def _delta_refresh(self, now: datetime) -> None:
+        # updated_at は TimeTree 側の編集時刻で、DBに書き込まれた時刻ではない。
+        # 古い updated_at のまま新しく入った行 (取得範囲に入ったイベント、一括取り込み) は
+        # 差分では拾えないので、行数 (count のみ、行は転送しない) が変わっていたら全件取得に切り替える (削除もここで反映)。
+        # 追加と削除が同数だった場合は ANALYTICS_FULL_RESYNC_SEC ごとの全件取得で反映される
+        count = self.supabase.table("schedules").select("source_id", count="exact", head=True).execute().count
+        if isinstance(count, int) and count != self._snapshot.row_count:
+            logger.info(f"🔄 Analytics: 行数の変化を検出 ({self._snapshot.row_count} → {count})、全件取得します")
+            self._full_refresh(now)
+            return
+
+        # 同期のタイミング次第で updated_at が前後するので、少し前から取り直す (同じ行は下で除外)
+        since = self._watermark - timedelta(seconds=config.ANALYTICS_DELTA_OVERLAP_SEC)
+        logger.info(f"🔄 Analytics: {since.isoformat()} 以降の更新を取得中...")
+        res = self.supabase.table("schedules").select("*").gte("updated_at", since.isoformat()).execute()
+        rows = res.data or []
+
+        current = self._snapshot
+        known = current.known_versions([row["source_id"] for row in rows])
+        changed = [row for row in rows if row["source_id"] not in known or known[row["source_id"]] != row.get("updated_at")]
+
+        self.refresh_stats["delta"] += 1
+        self.refresh_stats["last"] = "delta"
+        self.refresh_stats["delta_rows"] += len(changed)
+        self._advance_watermark(rows)
+        if not changed:
+            return
+
+        self._version += 1
+        try:
+            snapshot = AnalyticsSnapshot(self._version, changed, None, base=current)
+        except Exception:
+            # 列構成が変わった等: 次回は全件取得で作り直す
+            self._next_full_resync_at = datetime.min
+            raise
+        self._swap(snapshot, f"+{len(changed)}件更新")
+
+    def _advance_watermark(self, rows: list[dict]) -> None:
+        for row in rows:
+            value = row.get("updated_at")
+            if not value:
+                continue
+            try:
+                updated_at = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                continue
+            if updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            if self._watermark is None or updated_at > self._watermark:
+                self._watermark = updated_at
+
+    def _install(self, rows: list[dict]) -> None:
+        """Builds the next snapshot off to the side and swaps it in (skipped if the data is unchanged)."""
+        # start_at はSupabaseからISO文字列で返ってくるので、SQLiteの date() 関数などでそのまま扱える
+        fingerprint = hashlib.sha1(json.dumps(rows, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        current = self._snapshot
+        if current is not None and current.fingerprint == fingerprint:
+            return
+
+        self._version += 1
+        self._swap(AnalyticsSnapshot(self._version, rows, fingerprint), "全件")
+
+    def _swap(self, snapshot: AnalyticsSnapshot, note: str) -> None:
+        with self._swap_lock:
+            current = self._snapshot
+            self._snapshot = snapshot
+            if current is not None:
+                # 開いているコネクションがあればインメモリDBは残るので、実行中のクエリには影響しない。
+                # これから開くコネクションは _open_snapshot がロック内で新しい版に開く
+                current.close()
+        logger.info(f"📦 Analytics Snapshot v{snapshot.version}: {snapshot.row_count}件 ({note})")
+        self.result_cache.clear()
+
+    @property
+    def snapshot_version(self) -> int:
+        """Data version of the current snapshot (0 = none yet)."""
+        snapshot = self._snapshot
+        return snapshot.version if snapshot else 0
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "snapshot_version": snapshot.version if snapshot else 0,
+            "rows": snapshot.row_count if snapshot else 0,
+            "built_at": snapshot.built_at.isoformat() if snapshot else None,
+            "expires_at": self._cache_expires_at.isoformat() if snapshot else None,
+            "refreshed_at": self._refreshed_at.isoformat() if snapshot else None,
+            "stale_while_revalidate": dict(self.swr_stats),
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+            "refreshes": dict(self.refresh_stats),
+            "query_timeouts": self.timeouts,
+            "context_shaping": dict(self.shaping_stats),
+            "context_format": self.context_format,
+            "result_cache": self.result_cache_stats(),
+        }
+
+    def result_cache_stats(self) -> dict:
+        stats = self.result_cache.stats()
+        stats["bytes"] = sum(entry.nbytes for entry in self.result_cache.values())
+        return stats
+
+    def _open_snapshot(self) -> tuple[Optional[AnalyticsSnapshot], sqlite3.Connection]:
+        """
+        最新のスナップショット (古さは ANALYTICS_MAX_STALENESS_SEC まで) と、その読み取り専用コネクション。
+        未設定・初回取得失敗なら (None, 空のDB)。
+        コネクションは _swap_lock の中で開くので、バックグラウンド更新が keeper を閉じた後の
+        (空の) 共有キャッシュDBに繋がることはない
+        """
+        if not self.supabase:
+            logger.warning("Supabase not configured, returning empty DB")
+            return None, sqlite3.connect(':memory:')
+        self.warm()
+        with self._swap_lock:
+            snapshot = self._snapshot
+            conn = snapshot.connect() if snapshot is not None else sqlite3.connect(':memory:')
+        return snapshot, conn
+
+    def _get_fresh_connection(self):
+        """最新スナップショットへの読み取り専用コネクションを返す（なければ空のDB）"""
+        return self._open_snapshot()[1]
+
+    def _prepare_sql(self, sql_query: str) -> tuple[str, Optional[str]]:
+        """Cleans / validates the SQL and rewrites time predicates. Returns (sql, error message)."""
+        # 安全対策: SQLのクリーニング
+        # Markdownのコードブロック記号を削除
+        sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
+
+        # AIの応答からSELECT文を抽出（前後にテキストがあっても対応）
+        sql_query_upper = sql_query.upper()
+        select_pos = sql_query_upper.find("SELECT")
+        if select_pos == -1:
+            logger.warning(f"Blocked non-SELECT query: {sql_query}")
+            return sql_query, "エラー: 安全のため、SELECTクエリ以外は実行できません。"
+        if select_pos > 0:
+            sql_query = sql_query[select_pos:]
+            logger.info(f"📝 Extracted SQL from position {select_pos}")
+
+        # セキュリティ: 更新系クエリを禁止（INSERT/UPDATE/DELETE/DROP/TRUNCATE/ALTER/CREATE）
+        dangerous_keywords = ["INSERT", "UPDATE", "DELETE", "DROP", "TRUNCATE", "ALTER", "CREATE"]
+        sql_query_upper = sql_query.upper()
+        for keyword in dangerous_keywords:
+            if keyword in sql_query_upper:
+                logger.warning(f"Blocked dangerous query containing '{keyword}': {sql_query}")
+                return sql_query, f"エラー: 安全のため、{keyword}を含むクエリは実行できません。"
+
+        # datetime(start_at) の比較を索引付きの start_epoch / start_date の範囲条件に書き換え
+        rewritten = rewrite_time_predicates(sql_query)
+        if rewritten != sql_query:
+            logger.info(f"⚡ Rewritten SQL: {rewritten}")
+        return rewritten, None
+
+    def execute_query(self, sql_query: str, params: Optional[dict] = None, question: Optional[str] = None) -> str:
+        """
+        AIが生成したSQL (またはテンプレートSQL + パラメータ) を実行する
+        結果は context_info としてプロンプトに入るので、行数・列・トークン数を予算内に整形する
+        (question があれば関連度の高い行を優先)
+        """
+        sql_query, error = self._prepare_sql(sql_query)
+        if error:
+            return error
+
+        snapshot, conn = self._open_snapshot()
         try:
-            # 安全対策: SQLのクリーニング
-            # Markdownのコードブロック記号を削除
-            sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
-
-            # AIの応答からSELECT文を抽出（前後にテキストがあっても対応）
-            sql_query_upper = sql_query.upper()
-            select_pos = sql_query_upper.find("SELECT")
-            if select_pos != -1:
-                sql_query = sql_query[select_pos:]
-                logger.info(f"📝 Extracted SQL from position {select_pos}")
-
-            # セキュリティ: 更新系クエリを禁止（INSERT/UPDATE/DELETE/DROP/TRUNCATE/ALTER/CREATE）
-            dangerous_keywords = ["INSERT", "UPDATE", "DELETE", "DROP", "TRUNCATE", "ALTER", "CREATE"]
-            sql_query_upper = sql_query.upper()
-            for keyword in dangerous_keywords:
-                if keyword in sql_query_upper:
-                    logger.warning(f"Blocked dangerous query containing '{keyword}': {sql_query}")
-                    return f"エラー: 安全のため、{keyword}を含むクエリは実行できません。"
+            cache_key = None
+            result = None
+            if snapshot is not None:
+                cache_key = (snapshot.version, normalize_sql(sql_query), tuple(sorted((params or {}).items())))
+                result = self.result_cache.get(cache_key)
+            if result is None:
+                result = self._fetch(conn, sql_query, params)
+                if isinstance(result, str):
+                    return result
+                if cache_key is not None:
+                    self.result_cache.set(cache_key, result)
+            else:
+                logger.info(f"♻️ Result Cache Hit (v{snapshot.version}): {sql_query}")
+        finally:
+            conn.close()
+
+        encoder = ENCODERS.get(self.context_format, markdown_lines)
+        shaped = shape_result(
+            result.columns, result.rows, question,
+            max_rows=config.ANALYTICS_CONTEXT_MAX_ROWS,
+            max_cell_chars=config.ANALYTICS_CONTEXT_MAX_CELL_CHARS,
+            budget_tokens=config.ANALYTICS_CONTEXT_TOKEN_BUDGET,
+            scan_rows=config.ANALYTICS_CONTEXT_SCAN_ROWS,
+            encoder=encoder,
+        )
+        if not shaped.rows and not shaped.omitted:
+            return NO_RESULT_MESSAGE
+        if shaped.omitted or shaped.dropped_columns:
+            self.shaping_stats["trimmed_results"] += 1
+            self.shaping_stats["omitted_rows"] += shaped.omitted
+            self.shaping_stats["dropped_columns"] += len(shaped.dropped_columns)
 
+        # プロンプト向けの省トークン形式 (既定: TSV + 略号) で返す
+        lines = list(encoder(shaped.columns, shaped.rows))
+        summary = shaped.summary()
+        if summary:
+            lines.append(summary)
+        return "\n".join(lines)
+
+    def _fetch(self, conn: sqlite3.Connection, sql_query: str, params: Optional[dict]):
+        """Runs the query on `conn` under the deadline. Returns a CachedResult, or an error message (str)."""
+        # 実行時間の上限: SQLiteの progress handler で一定命令ごとに確認し、超えたら中断させる
+        deadline = time.monotonic() + config.ANALYTICS_QUERY_TIMEOUT_SEC
+        conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 1000)
+        try:
             logger.info(f"🔍 Executing SQL: {sql_query}")
-            result_df = pd.read_sql_query(sql_query, conn)
-            
-            if result_df.empty:
-                return "（条件に一致する予定はありませんでした）"
-            
-            # AIが読みやすいMarkdown形式で返す
-            return result_df.to_markdown(index=False)
+            cursor = conn.execute(sql_query, params or {})
+            columns = [d[0] for d in cursor.description or []]
+            # 内部用の時刻列は AI に渡さない (SELECT * 対策)
+            keep = [i for i, c in enumerate(columns) if c not in TIME_COLUMNS]
+            # 整形で読むのは scan_rows 件まで (+1件で「以上」を判定)
+            rows = [tuple(row[i] for i in keep)
+                    for row in itertools.islice(cursor, config.ANALYTICS_CONTEXT_SCAN_ROWS + 1)]
+            return CachedResult.build([columns[i] for i in keep], rows)
 
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline and "interrupted" in str(e):
+                self.timeouts += 1
+                logger.error(f"⏱️ SQL Timeout ({config.ANALYTICS_QUERY_TIMEOUT_SEC}s) | Query: {sql_query}")
+                return "エラー: 検索に時間がかかりすぎたため中断しました。"
+            logger.error(f"SQL Execution Error: {e} | Query: {sql_query}")
+            return f"データ検索中にエラーが発生しました: {e}"
         except Exception as e:
             logger.error(f"SQL Execution Error: {e} | Query: {sql_query}")
             return f"データ検索中にエラーが発生しました: {e}"
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    async def warm_async(self) -> None:
+        """warm() without blocking the event loop."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.warm)
+
+    async def query(self, sql_query: str, params: Optional[dict] = None, question: Optional[str] = None) -> str:
+        """
+        Async execute_query: runs in the analytics executor (off the event loop),
+        aborted after ANALYTICS_QUERY_TIMEOUT_SEC.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.execute_query, sql_query, params, question
+        )
+
+    def query_df(self, sql_query: str, params: Optional[dict] = None):
+        """
+        Same as execute_query but returns a pandas DataFrame.
+        pandas is imported only here, so the chat path never loads it.
+        """
+        import pandas as pd
+
+        sql_query, error = self._prepare_sql(sql_query)
+        if error:
+            raise ValueError(error)
+        conn = self._get_fresh_connection()
+        try:
+            df = pd.read_sql_query(sql_query, conn, params=params)
         finally:
             conn.close()
+        return df.drop(columns=[c for c in TIME_COLUMNS if c in df.columns])
@@ -0,0 +1,89 @@
+import hashlib
+from src.core.cache import TTLCache
+from src.core.tokens import estimate_tokens
+from src.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+SUMMARY_PREFIX = "（これまでの会話の要約）"
+
+
+class HistoryBudgeter:
+    """
+    Keeps the newest conversation turns that fit a token budget.
+    Older turns are collapsed into one short extractive summary line,
+    cached so that the same dropped prefix is not summarized again on every message.
+    """
+
+    def __init__(self, max_turn_chars: int = 600, summary_chars_per_turn: int = 20,
+                 max_summary_chars: int = 200, summary_cache_entries: int = 256) -> None:
+        self.max_turn_chars = max_turn_chars
+        self.summary_chars_per_turn = summary_chars_per_turn
+        self.max_summary_chars = max_summary_chars
+        self._summary_cache = TTLCache(max_entries=summary_cache_entries)
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.dropped_turns = 0
+
+    def _clip(self, turn: str) -> str:
+        if len(turn) <= self.max_turn_chars:
+            return turn
+        return turn[:self.max_turn_chars] + "…"
+
+    def summarize(self, turns: list[str]) -> str:
+        """Collapses turns into a single line: first few characters of each turn."""
+        key = hashlib.sha1("\n".join(turns).encode("utf-8")).hexdigest()
+        summary = self._summary_cache.get(key)
+        if summary is None:
+            pieces = []
+            for turn in turns:
+                text = " ".join(turn.split())
+                if len(text) > self.summary_chars_per_turn:
+                    text = text[:self.summary_chars_per_turn] + "…"
+                pieces.append(text)
+            summary = SUMMARY_PREFIX + " / ".join(pieces)
+            if len(summary) > self.max_summary_chars:
+                # 古い方から削って新しい話題を残す
+                summary = SUMMARY_PREFIX + "…" + summary[-(self.max_summary_chars - len(SUMMARY_PREFIX) - 1):]
+            self._summary_cache.set(key, summary)
+        return summary
+
+    def fit(self, turns: list[str], budget_tokens: int) -> str:
+        """
+        Args:
+            turns: "name: text" lines, oldest first. The last one (current message) is always kept.
+            budget_tokens: Token budget for the whole conversation log.
+
+        Returns:
+            str: Conversation log (newline-joined) within the budget.
+        """
+        self.requests += 1
+        if not turns:
+            return ""
+
+        turns = [self._clip(t) for t in turns[:-1]] + [turns[-1]]
+        costs = [estimate_tokens(t) + 1 for t in turns]
+        if sum(costs) <= budget_tokens:
+            return "\n".join(turns)
+
+        # 要約行のために予算の1/4までを確保し、残りに新しい順で詰める
+        summary_reserve = min(estimate_tokens(SUMMARY_PREFIX) + self.max_summary_chars, budget_tokens // 4)
+        remaining = budget_tokens - summary_reserve - costs[-1]
+        start = len(turns) - 1
+        while start > 0 and costs[start - 1] <= remaining:
+            remaining -= costs[start - 1]
+            start -= 1
+
+        dropped, kept = turns[:start], turns[start:]
+        self.trimmed_requests += 1
+        self.dropped_turns += len(dropped)
+        logger.info(f"✂️ 会話履歴を圧縮: {len(dropped)}件を要約, {len(kept)}件を保持 (budget={budget_tokens} tokens)")
+        return "\n".join([self.summarize(dropped)] + kept)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "trimmed_requests": self.trimmed_requests,
+            "dropped_turns": self.dropped_turns,
+            "summary_cache": self._summary_cache.stats(),
+        }
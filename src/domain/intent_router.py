@@ -0,0 +1,198 @@
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+from src.core.clock import now_local
+from src.domain.ai_service import build_reference_dates
+from src.domain.reflex import normalize_message
+from src.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 以前は「いずれかを含めば generate_sql」だったトリガー語
+ANALYTICS_KEYWORDS = ['いつ', '予定', 'スケジュール', 'ライブ', 'イベント', '何回', '件数', '分析', '教えて']
+# 単独ではスケジュールの質問とは言えないトリガー語
+WEAK_KEYWORDS = ['教えて', '分析']
+ENGLISH_KEYWORDS = ['schedule', 'next live', 'next show', 'next event', 'upcoming', 'how many']
+
+# 「いつ」を含むがスケジュールの質問ではない語 (いつも応援してる 等)
+NON_QUESTION_WORDS = ['いつも', 'いつか', 'いつまでも', 'いつの間に']
+# 感想・お礼 (「ライブ楽しかった！」など) は質問マーカーがなければ分析しない
+FEEDBACK_WORDS = ['楽しかった', 'よかった', '良かった', '最高だった', 'ありがとう', 'おつかれ', 'お疲れ', '行ってきた', '行けなかった']
+QUESTION_MARKERS = ['?', 'いつ', '教えて', '何', 'どこ', 'ある', 'when', 'how many']
+
+COUNT_WORDS = ['何回', '何件', '件数', 'いくつ', '何本', 'how many']
+NEXT_WORDS = ['次', '今度', '直近', '一番近い', 'next']
+UPCOMING_WORDS = ['今後', 'これから', 'この先', 'upcoming']
+
+# (period id, patterns) — 先に一致したものを採用するので「来週末」を「週末」より前に置く
+PERIODS = [
+    ("next_weekend", ['来週末', '来週の土日', '次の週末', '次の土日', 'next weekend']),
+    ("this_weekend", ['今週末', '週末', '土日', 'this weekend']),
+    ("today", ['今日', 'きょう', '本日', 'today']),
+    ("tomorrow", ['明日', 'あした', 'あす', 'tomorrow']),
+    ("next_month", ['来月', 'next month']),
+    ("this_month", ['今月', 'this month']),
+    ("this_year", ['今年', 'this year']),
+]
+
+SCHEDULE_COLUMNS = "title, start_at, place, price_details, ticket_url, bonus"
+
+TEMPLATES = {
+    "period_list": (
+        f"SELECT {SCHEDULE_COLUMNS} FROM schedules "
+        "WHERE datetime(start_at) >= datetime(:start) AND datetime(start_at) < datetime(:end) "
+        "ORDER BY datetime(start_at)"
+    ),
+    "period_count": (
+        "SELECT COUNT(*) AS count FROM schedules "
+        "WHERE datetime(start_at) >= datetime(:start) AND datetime(start_at) < datetime(:end)"
+    ),
+    "next": (
+        f"SELECT {SCHEDULE_COLUMNS} FROM schedules "
+        "WHERE datetime(start_at) > datetime(:now) "
+        "ORDER BY datetime(start_at) LIMIT 1"
+    ),
+    "upcoming": (
+        f"SELECT {SCHEDULE_COLUMNS} FROM schedules "
+        "WHERE datetime(start_at) > datetime(:now) "
+        "ORDER BY datetime(start_at) LIMIT 10"
+    ),
+}
+
+
+def _month_start(year: int, month: int) -> str:
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return f"{year:04d}-{month:02d}-01T00:00:00"
+
+
+def period_range(period: str, now: datetime) -> tuple[str, str]:
+    """Returns the [start, end) ISO 8601 range of a period, relative to now."""
+    if period == "this_month":
+        return _month_start(now.year, now.month), _month_start(now.year, now.month + 1)
+    if period == "next_month":
+        return _month_start(now.year, now.month + 1), _month_start(now.year, now.month + 2)
+    if period == "this_year":
+        return f"{now.year:04d}-01-01T00:00:00", f"{now.year + 1:04d}-01-01T00:00:00"
+
+    ref = build_reference_dates(now)
+    if period == "today":
+        return ref["today_start"], ref["tomorrow_start"]
+    if period == "tomorrow":
+        return ref["tomorrow_start"], (now + timedelta(days=2)).strftime('%Y-%m-%dT00:00:00')
+    if period == "this_weekend":
+        return ref["this_weekend_start"], ref["this_weekend_end"]
+    if period == "next_weekend":
+        return ref["next_weekend_start"], ref["next_weekend_end"]
+    raise ValueError(f"Unknown period: {period}")
+
+
+@dataclass
+class IntentMatch:
+    """
+    kind:
+        "template" — answer with a fixed SQL template (no LLM call)
+        "llm"      — schedule question, but no template fits: fall back to generate_sql
+        "none"     — not a schedule question: skip analytics
+    """
+    kind: str
+    template: Optional[str] = None
+    sql: Optional[str] = None
+    params: dict = field(default_factory=dict)
+
+
+class IntentRouter:
+    """
+    Deterministic intent classifier for schedule questions.
+    Frequent phrasings ("次のライブいつ？", "今日の予定", "今週末", "今月何回？") are mapped to
+    parameterized SQL templates; false positives of the keyword trigger are rejected.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.triggered = 0
+        self.template_hits = 0
+        self.llm_fallbacks = 0
+        self.rejected = 0
+        self.template_counts: dict[str, int] = {}
+
+    def _record(self, match: IntentMatch) -> IntentMatch:
+        with self._lock:
+            if match.kind == "template":
+                self.template_hits += 1
+                self.template_counts[match.template] = self.template_counts.get(match.template, 0) + 1
+            elif match.kind == "llm":
+                self.llm_fallbacks += 1
+            else:
+                self.rejected += 1
+        return match
+
+    def classify(self, message: str, now: Optional[datetime] = None) -> IntentMatch:
+        now = now or now_local()
+        text = normalize_message(message)
+        with self._lock:
+            self.checks += 1
+
+        scan = text
+        for word in NON_QUESTION_WORDS:
+            scan = scan.replace(word, "")
+        strong = [k for k in ANALYTICS_KEYWORDS if k in scan and k not in WEAK_KEYWORDS]
+        weak = [k for k in WEAK_KEYWORDS if k in scan]
+        english = [k for k in ENGLISH_KEYWORDS if k in scan]
+
+        if not any(k in text for k in ANALYTICS_KEYWORDS) and not english:
+            # 以前から分析対象外 (generate_sql は呼ばれていなかった)
+            return IntentMatch("none")
+        with self._lock:
+            self.triggered += 1
+
+        period = next((pid for pid, patterns in PERIODS if any(p in scan for p in patterns)), None)
+        is_question = any(m in scan for m in QUESTION_MARKERS)
+
+        # --- 誤検知の除外 ---
+        if not strong and not english and not (weak and period):
+            # 「いつもありがとう」「好きな食べ物教えて」など
+            return self._record(IntentMatch("none"))
+        if any(w in scan for w in FEEDBACK_WORDS) and not is_question:
+            # 「ライブ楽しかった！」「イベントお疲れさま」など
+            return self._record(IntentMatch("none"))
+        if english and not strong and not (period or any(w in scan for w in NEXT_WORDS + UPCOMING_WORDS)):
+            # 英語はテンプレートに当たる場合のみ扱う (以前は分析対象外だった)
+            return self._record(IntentMatch("none"))
+
+        if not strong and not english:
+            # 「今日のこと教えて」など: 期間はあるが予定の質問か曖昧なので LLM に任せる
+            return self._record(IntentMatch("llm"))
+
+        # --- テンプレート ---
+        is_count = any(w in scan for w in COUNT_WORDS)
+        if period:
+            start, end = period_range(period, now)
+            template = "period_count" if is_count else "period_list"
+            return self._record(IntentMatch("template", template, TEMPLATES[template], {"start": start, "end": end}))
+
+        if not is_count:
+            # 分単位に丸める (同じ分の問い合わせは同じSQL+パラメータ → 検索結果キャッシュが効く)
+            now_str = now.strftime('%Y-%m-%dT%H:%M:00')
+            if any(w in scan for w in UPCOMING_WORDS):
+                return self._record(IntentMatch("template", "upcoming", TEMPLATES["upcoming"], {"now": now_str}))
+            if any(w in scan for w in NEXT_WORDS):
+                return self._record(IntentMatch("template", "next", TEMPLATES["next"], {"now": now_str}))
+
+        return self._record(IntentMatch("llm"))
+
+    def stats(self) -> dict:
+        """Template-hit ratio among triggered questions, i.e. generate_sql (Gemini) calls saved."""
+        with self._lock:
+            return {
+                "checks": self.checks,
+                "triggered": self.triggered,
+                "template_hits": self.template_hits,
+                "llm_fallbacks": self.llm_fallbacks,
+                "rejected": self.rejected,
+                "template_hit_ratio": round(self.template_hits / self.triggered, 3) if self.triggered else None,
+                "sql_calls_saved": self.template_hits + self.rejected,
+                "templates": dict(self.template_counts),
+            }
@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Circuit states
+CLOSED = "closed"        # 通常運転
+OPEN = "open"            # クールダウン中（呼び出さずにスキップ）
+HALF_OPEN = "half_open"  # 復旧確認のプローブ実行中
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Classifies an LLM API error.
+
+    Returns:
+        str: "quota" for 429 / quota exceeded, "server" for 5xx / timeouts, "other" otherwise.
+    """
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        if code == 429:
+            return "quota"
+        if 500 <= code < 600:
+            return "server"
+
+    message = str(error).lower()
+    if "429" in message or "quota" in message or "resource exhausted" in message or "rate limit" in message:
+        return "quota"
+    if any(s in message for s in ("500", "502", "503", "504", "unavailable", "internal", "deadline", "timeout")):
+        return "server"
+    return "other"
+
+
+def _percentile(sorted_samples: list[float], pct: float) -> float:
+    index = min(len(sorted_samples) - 1, max(0, round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+@dataclass
+class ModelHealth:
+    """Per-model health statistics and circuit state."""
+    name: str
+    state: str = CLOSED
+    successes: int = 0
+    failures: int = 0
+    quota_errors: int = 0
+    server_errors: int = 0
+    consecutive_failures: int = 0
+    open_count: int = 0          # 連続でオープンした回数（クールダウンの倍加に使用）
+    open_until: float = 0.0
+    probe_in_flight: bool = False
+    last_error: Optional[str] = None
+    latencies: deque = field(default_factory=lambda: deque(maxlen=50))
+
+
+class ModelRouter:
+    """
+    Health-aware router with a circuit breaker per model.
+
+    - 429 (quota) errors open the circuit immediately.
+    - 5xx / timeout errors open it after `failure_threshold` consecutive failures.
+    - Other (prompt-specific) errors are counted in the stats only.
+    - While open, the model is skipped. After the cooldown one request is let
+      through as a probe (half-open); success closes the circuit, failure
+      re-opens it with a doubled cooldown (capped at `max_cooldown_sec`).
+    """
+
+    def __init__(self, cooldown_sec: float = 60.0, failure_threshold: int = 3, max_cooldown_sec: float = 900.0) -> None:
+        self.cooldown_sec = cooldown_sec
+        self.failure_threshold = failure_threshold
+        self.max_cooldown_sec = max_cooldown_sec
+        self._health: dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> ModelHealth:
+        health = self._health.get(name)
+        if health is None:
+            health = self._health[name] = ModelHealth(name=name)
+        return health
+
+    def try_acquire(self, name: str) -> bool:
+        """
+        Returns True if a request may be sent to the model now.
+        Moves an expired open circuit to half-open and reserves the probe slot.
+        """
+        with self._lock:
+            health = self._get(name)
+            if health.state == CLOSED:
+                return True
+            if health.state == OPEN and time.monotonic() >= health.open_until:
+                health.state = HALF_OPEN
+                health.probe_in_flight = True
+                logger.info(f"🩺 {name}: クールダウン終了、プローブを送信します")
+                return True
+            return False
+
+    def record_success(self, name: str, latency: float) -> None:
+        with self._lock:
+            health = self._get(name)
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.latencies.append(latency)
+            if health.state != CLOSED:
+                logger.info(f"✅ {name}: 復旧を確認、サーキットをクローズします")
+            health.state = CLOSED
+            health.open_count = 0
+            health.probe_in_flight = False
+
+    def record_failure(self, name: str, error: Exception) -> None:
+        kind = classify_error(error)
+        with self._lock:
+            health = self._get(name)
+            health.failures += 1
+            health.last_error = str(error)[:200]
+            if kind == "other":
+                # プロンプト固有のエラー (安全フィルタ、不正な入力など) はモデルの不調ではない:
+                # 統計にだけ記録し、サーキットには影響させない (プローブ中なら結果なしで枠を返す)
+                if health.state == HALF_OPEN and health.probe_in_flight:
+                    health.state = OPEN
+                health.probe_in_flight = False
+                return
+            health.consecutive_failures += 1
+            if kind == "quota":
+                health.quota_errors += 1
+            elif kind == "server":
+                health.server_errors += 1
+
+            should_open = (
+                health.state == HALF_OPEN
+                or kind == "quota"
+                or health.consecutive_failures >= self.failure_threshold
+            )
+            if should_open:
+                cooldown = min(self.cooldown_sec * (2 ** health.open_count), self.max_cooldown_sec)
+                health.open_count += 1
+                health.state = OPEN
+                health.open_until = time.monotonic() + cooldown
+                logger.warning(f"🚧 {name}: サーキットをオープン ({kind}, {cooldown:.0f}秒間スキップ)")
+            health.probe_in_flight = False
+
+    def release(self, name: str) -> None:
+        """Releases a reserved probe slot without recording a result (e.g. cancelled request)."""
+        with self._lock:
+            health = self._get(name)
+            if health.state == HALF_OPEN and health.probe_in_flight:
+                health.state = OPEN
+                health.probe_in_flight = False
+
+    def latency_percentile(self, name: str, pct: float) -> Optional[float]:
+        """Returns the pct-th percentile of recent successful latencies (seconds), or None if no samples."""
+        with self._lock:
+            samples = sorted(self._get(name).latencies)
+        if not samples:
+            return None
+        return _percentile(samples, pct)
+
+    def snapshot(self) -> dict:
+        """Returns the router state for diagnostics."""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for name, h in self._health.items():
+                total = h.successes + h.failures
+                latencies = sorted(h.latencies)
+                result[name] = {
+                    "state": h.state,
+                    "success_rate": round(h.successes / total, 3) if total else None,
+                    "successes": h.successes,
+                    "failures": h.failures,
+                    "quota_errors": h.quota_errors,
+                    "server_errors": h.server_errors,
+                    "consecutive_failures": h.consecutive_failures,
+                    "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                    "p95_latency": round(_percentile(latencies, 95), 3) if latencies else None,
+                    "cooldown_remaining": round(max(0.0, h.open_until - now), 1) if h.state == OPEN else 0.0,
+                    "last_error": h.last_error,
+                }
+            return result
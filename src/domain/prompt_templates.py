@@ -0,0 +1,221 @@
+import threading
+from string import Formatter
+from typing import Optional
+
+from src.core.tokens import estimate_tokens
+
+# ---------------------------------------------------
+# generate_response のプロンプト部品
+# `{slot}` はリクエストごとに埋める動的スロット、それ以外は静的テキスト
+# ---------------------------------------------------
+HEADER_SEGMENT = """
+        あなたはアイドルの「AIまう」です。
+        現在、ファンの「{user_name}」さんからメッセージが届きました。
+
+        【現在時刻】
+        {current_time}
+        ※日付を参照するときは必ずこの現在時刻を基準にしてください。「来年」「来月」「今週」などの相対表現は正確に使ってください。
+
+        【会話履歴】
+        {conversation_log}
+        """
+
+CONTEXT_SEGMENT = """
+        【参考データ (分析結果)】
+        以下はユーザーの質問に関連するデータベース検索結果です。
+        このデータに基づいて回答してください。データがない場合は「予定はないみたい」と答えてください。
+        ------------------------
+        {context_info}
+        ------------------------
+            """
+
+INSTRUCTIONS_SEGMENT = """
+        【指示】
+        1. mau_profile.txt の設定（キャラ設定）を守ってください。
+        2. 文頭で必ず「{user_name}！」や「{user_name}ちゃん！」と名前を呼んでください。
+        3. **相手が英語で話しかけてきた場合は英語で、日本語なら日本語で返信してください。**
+           (If the user speaks English, reply in English with the same idol personality.)
+        4. 親しい友達のようにタメ口で返信してください。
+        5. **返信は基本「200文字以内」で短く返してください。ただし、ライブの告知やスケジュール詳細を伝える場合は、情報が漏れないように文字数制限を無視して長くなっても構いません。**
+
+        【重要：言語設定 (Regional Setting)】
+        User Timezone: {timezone}
+        """
+
+LANGUAGE_GLOBAL_SEGMENT = """
+        **WARNING: The user is accessing from outside Japan.**
+        **You MUST reply in ENGLISH.**
+        Maintain the detailed idol personality (cute, energetic, use emojis), but speak English.
+        """
+
+LANGUAGE_JAPAN_SEGMENT = """
+        **User is in Japan.**
+        Reply in Japanese (Default).
+        """
+
+RULES_SEGMENT = """
+        【回答のルール (スケジュール)】
+        1. **詳細情報**: 可能な限り「場所 (Place)」と「金額 (Price)」も案内すること。
+        2. **特典 (Bonus)**: もし「特典 (bonus)」があるイベントなら、**「この日は〇〇の特典があるから絶対来てほしい！」と優先的にアピール** すること。（絵文字 🎁✨ を使うなど強調して）
+        3. **誘導**: チケットURLがある場合は、お誘いすること。
+
+        【回答のルール (自己紹介)】
+        もし「自己紹介」を求められた場合は、以下の要素を含めてアイドルらしく答えてください：
+        - **名前**: AIまう
+        - **コンセプト**: 「スマホの中に住んでるアイドル」として振る舞うこと。
+        - **モデル**: Googleの「Gemini 2.5」を使ってること（たまにLlama 3も使うよ！とアピール）
+        - **制約**: 「1分間に10回までしかお返事できないの🥺」「今のブラウザだと12回前の会話までしか覚えてられないんだ💦」と可愛く伝える。
+        - **セキュリティ**: 「登録もログインもいらないし、データはみんなのブラウザの中に保存されてるから安心してね！」と伝える。
+
+        【回答フォーマット (重要)】
+        1. 通常の返信文を書いた後、改行して `===SUGGESTIONS===` と書いてください。
+        2. その後ろに、ユーザーが次に使いそうな「返信候補」を3つ提案してください。（1行に1つ）
+        3. 候補は短く（20文字以内）、建設的なものにしてください。
+
+        例：
+        こんにちは！今日も元気？✨
+        ===SUGGESTIONS===
+        元気だよ！
+        ちょっと疲れてる
+        まうちゃんは？
+        """
+
+
+class Segment:
+    """
+    One named part of a prompt, compiled once.
+    Template segments are split into literal text and `{slot}` names;
+    literal segments (e.g. the persona) are used verbatim, braces included.
+    """
+
+    def __init__(self, name: str, text: str, literal: bool = False) -> None:
+        self.name = name
+        self.parts: list[tuple[str, bool]] = []  # (text or slot name, is_slot)
+        if literal:
+            self.parts.append((text, False))
+        else:
+            for literal_text, field_name, _, _ in Formatter().parse(text):
+                if literal_text:
+                    self.parts.append((literal_text, False))
+                if field_name is not None:
+                    self.parts.append((field_name, True))
+        static_text = "".join(part for part, is_slot in self.parts if not is_slot)
+        self.static_chars = len(static_text)
+        self.static_tokens = estimate_tokens(static_text)
+        self.slots = [part for part, is_slot in self.parts if is_slot]
+
+    def render(self, values: dict[str, str]) -> str:
+        return "".join(values[part] if is_slot else part for part, is_slot in self.parts)
+
+
+class PromptTemplate:
+    """An ordered list of precompiled segments."""
+
+    def __init__(self, segments: list[Segment]) -> None:
+        self.segments = segments
+
+    def render(self, values: dict[str, str]) -> str:
+        return "".join(segment.render(values) for segment in self.segments)
+
+    def segment_stats(self, values: dict[str, str]) -> list[dict]:
+        """Per-segment size: static text is precomputed, only slot values are measured per request."""
+        stats = []
+        for segment in self.segments:
+            slot_text = "".join(values[slot] for slot in segment.slots)
+            stats.append({
+                "segment": segment.name,
+                "chars": segment.static_chars + len(slot_text),
+                "tokens": segment.static_tokens + estimate_tokens(slot_text),
+            })
+        return stats
+
+
+class RenderedPrompt:
+    """
+    Prompt for one request. The persona-prefixed variant (models without
+    system_instruction support, e.g. Gemma) is rendered only if a model needs it.
+    """
+
+    def __init__(self, builder: "ResponsePromptBuilder", variant: tuple, values: dict[str, str]) -> None:
+        self._builder = builder
+        self._variant = variant
+        self._values = values
+        self._rendered: dict[bool, str] = {}
+
+    def text(self, with_persona: bool = False) -> str:
+        if with_persona not in self._rendered:
+            template = self._builder.template(*self._variant, with_persona=with_persona)
+            self._rendered[with_persona] = template.render(self._values)
+            self._builder.record(template.segment_stats(self._values))
+        return self._rendered[with_persona]
+
+    def __str__(self) -> str:
+        return self.text()
+
+
+class ResponsePromptBuilder:
+    """
+    Precompiles the generate_response prompt once per persona and variant
+    (language × analytics context × persona prefix) and fills only the dynamic
+    slots per request. Keeps running per-segment size totals for diagnostics.
+    """
+
+    def __init__(self, persona: str) -> None:
+        self._templates: dict[tuple, PromptTemplate] = {}
+        persona_segment = Segment("persona", f"{persona}\n\n", literal=True)
+        header = Segment("header", HEADER_SEGMENT)
+        context = Segment("context", CONTEXT_SEGMENT)
+        instructions = Segment("instructions", INSTRUCTIONS_SEGMENT)
+        language = {
+            True: Segment("language", LANGUAGE_GLOBAL_SEGMENT),
+            False: Segment("language", LANGUAGE_JAPAN_SEGMENT),
+        }
+        rules = Segment("rules", RULES_SEGMENT)
+
+        for is_global in (False, True):
+            for has_context in (False, True):
+                for with_persona in (False, True):
+                    segments = [persona_segment] if with_persona else []
+                    segments.append(header)
+                    if has_context:
+                        segments.append(context)
+                    segments += [instructions, language[is_global], rules]
+                    self._templates[(is_global, has_context, with_persona)] = PromptTemplate(segments)
+
+        self._lock = threading.Lock()
+        self._totals: dict[str, dict[str, int]] = {}
+
+    def template(self, is_global: bool, has_context: bool, with_persona: bool = False) -> PromptTemplate:
+        return self._templates[(is_global, has_context, with_persona)]
+
+    def build(self, user_name: str, conversation_log: str, context_info: Optional[str], timezone: str, current_time: str) -> RenderedPrompt:
+        values = {
+            "user_name": user_name,
+            "current_time": current_time,
+            "conversation_log": conversation_log,
+            "context_info": context_info or "",
+            "timezone": timezone,
+        }
+        # Determine language based on Region (Timezone)
+        is_global = timezone != "Asia/Tokyo"
+        return RenderedPrompt(self, (is_global, bool(context_info)), values)
+
+    def record(self, stats: list[dict]) -> None:
+        with self._lock:
+            for item in stats:
+                total = self._totals.setdefault(item["segment"], {"renders": 0, "chars": 0, "tokens": 0})
+                total["renders"] += 1
+                total["chars"] += item["chars"]
+                total["tokens"] += item["tokens"]
+
+    def stats(self) -> dict:
+        """Average chars/tokens per segment over all rendered prompts."""
+        with self._lock:
+            return {
+                name: {
+                    "renders": t["renders"],
+                    "avg_chars": round(t["chars"] / t["renders"], 1),
+                    "avg_tokens": round(t["tokens"] / t["renders"], 1),
+                }
+                for name, t in self._totals.items()
+            }
@@ -0,0 +1,194 @@
+import json
+import os
+import random
+import threading
+import time
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def normalize_message(text: str) -> str:
+    """NFKC + lowercase so that 全角/半角 and case variants match the same pattern."""
+    return unicodedata.normalize("NFKC", text).lower().strip()
+
+
+class AhoCorasick:
+    """
+    Multi-pattern matcher (Aho-Corasick automaton).
+    Finds every pattern occurring in a text in a single pass, independent of the number of patterns.
+    """
+
+    def __init__(self, patterns: list[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[int]] = [[]]
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = nxt
+            self._output[node].append(index)
+
+        # BFS で failure link を構築
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._output[nxt] += self._output[self._fail[nxt]]
+
+    def find_all(self, text: str) -> set[int]:
+        """Returns the indexes of all patterns found in text."""
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            found.update(self._output[node])
+        return found
+
+
+@dataclass
+class ReflexRule:
+    id: str
+    patterns: list[str]
+    responses: list[str]
+    suggestions: list[str]
+    priority: int = 0
+    max_length: int = 14
+    hits: int = field(default=0, compare=False)
+
+
+class ReflexEngine:
+    """
+    ⚡ Reflex Layer (0 Token Cost)
+    Rules are loaded from a JSON file (data/reflexes.json), compiled once into an
+    Aho-Corasick matcher, and hot-reloaded when the file changes.
+    """
+
+    def __init__(self, path: str, reload_interval_sec: float = 10.0) -> None:
+        self.path = path
+        self.reload_interval_sec = reload_interval_sec
+        self._lock = threading.Lock()
+        self._rules: list[ReflexRule] = []
+        self._patterns: list[str] = []
+        self._pattern_owner: list[ReflexRule] = []
+        self._matcher = AhoCorasick([])
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.checks = 0
+        self.load()
+
+    def load(self) -> None:
+        """(Re)loads and compiles the rules. Keeps the previous rules if the file is invalid."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            default_suggestions = data.get("default_suggestions", [])
+            default_max_length = data.get("default_max_length", 14)
+            previous_hits = {rule.id: rule.hits for rule in self._rules}
+            rules, patterns, owners = [], [], []
+            for item in data.get("rules", []):
+                rule = ReflexRule(
+                    id=item["id"],
+                    patterns=[normalize_message(p) for p in item["patterns"]],
+                    responses=item["responses"],
+                    suggestions=item.get("suggestions", default_suggestions),
+                    priority=item.get("priority", 0),
+                    max_length=item.get("max_length", default_max_length),
+                    hits=previous_hits.get(item["id"], 0),
+                )
+                rules.append(rule)
+                for pattern in rule.patterns:
+                    patterns.append(pattern)
+                    owners.append(rule)
+
+            matcher = AhoCorasick(patterns)
+        except FileNotFoundError:
+            logger.warning(f"⚠️ Reflexルールファイルが見つかりません: {self.path}")
+            return
+        except Exception as e:
+            logger.error(f"❌ Reflexルール読み込みエラー (前回のルールを継続使用): {e}")
+            return
+
+        with self._lock:
+            self._rules = rules
+            self._patterns = patterns
+            self._pattern_owner = owners
+            self._matcher = matcher
+            self._mtime = mtime
+        logger.info(f"⚡ Reflexルールを読み込みました: {len(rules)}ルール / {len(patterns)}パターン")
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval_sec:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    def match(self, message: str) -> Optional[ReflexRule]:
+        """Returns the highest-priority rule matching the message, or None."""
+        self._maybe_reload()
+        text = normalize_message(message)
+        self.checks += 1
+        if not text:
+            return None
+
+        with self._lock:
+            matcher, owners, patterns = self._matcher, self._pattern_owner, self._patterns
+        best, best_key = None, None
+        for index in matcher.find_all(text):
+            rule = owners[index]
+            if len(text) > rule.max_length:
+                continue
+            # 優先度が同じなら、より長いパターンに一致したルールを採用
+            key = (rule.priority, len(patterns[index]))
+            if best is None or key > best_key:
+                best, best_key = rule, key
+        if best:
+            best.hits += 1
+        return best
+
+    def respond(self, message: str) -> Optional[tuple[str, list[str], str]]:
+        """Returns (response text, suggestions, rule id) if a reflex fires."""
+        rule = self.match(message)
+        if not rule:
+            return None
+        return random.choice(rule.responses), list(rule.suggestions), rule.id
+
+    def stats(self) -> dict:
+        """Per-rule hits (model calls absorbed) and the overall reflex hit ratio."""
+        with self._lock:
+            rules = list(self._rules)
+        total_hits = sum(rule.hits for rule in rules)
+        return {
+            "checks": self.checks,
+            "hits": total_hits,
+            "hit_ratio": round(total_hits / self.checks, 3) if self.checks else None,
+            "rules": {rule.id: rule.hits for rule in rules},
+        }
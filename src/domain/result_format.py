@@ -0,0 +1,163 @@
+import itertools
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from src.core.tokens import estimate_tokens
+
+NO_RESULT_MESSAGE = "（条件に一致する予定はありませんでした）"
+
+# 予算を超えるときに落とす列 (先頭から順に)。title / start_at は常に残す
+DROPPABLE_COLUMNS = ["description", "ticket_url", "price_details", "bonus", "place"]
+
+
+def format_cell(value: Any) -> str:
+    """One table cell: None → empty, newlines / pipes escaped so a row stays on one line."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace("\r\n", " ").replace("\n", " ").replace("|", "\\|")
+
+
+def markdown_lines(columns: list[str], rows: Iterable[tuple]) -> Iterator[str]:
+    """Streams a Markdown (pipe) table line by line without materializing the result."""
+    yield "| " + " | ".join(columns) + " |"
+    yield "|" + "|".join("---" for _ in columns) + "|"
+    for row in rows:
+        yield "| " + " | ".join(format_cell(value) for value in row) + " |"
+
+
+def kv_lines(columns: list[str], rows: Iterable[tuple]) -> Iterator[str]:
+    """One `key=value; key=value` line per row (empty values omitted)."""
+    for row in rows:
+        yield "; ".join(f"{c}={format_cell(v)}" for c, v in zip(columns, row) if v not in (None, ""))
+
+
+# TSV で繰り返し出てくる長い値を略号にする列 (列 → 略号の接頭辞)
+DEDUP_COLUMNS = {"place": "P", "price_details": "Y", "bonus": "B", "ticket_url": "U"}
+
+
+def _tsv_cell(value: Any) -> str:
+    return format_cell(value).replace("\\|", "|").replace("\t", " ")
+
+
+def tsv_lines(columns: list[str], rows: Iterable[tuple], min_alias_chars: int = 6) -> Iterator[str]:
+    """
+    Minimal TSV. Values repeated in place / price_details / bonus / ticket_url
+    (same venue, same price...) are written once in a legend and referenced by a short alias.
+    """
+    rows = list(rows)
+    aliases: dict[tuple[int, str], str] = {}
+    legend = []
+    for index, column in enumerate(columns):
+        prefix = DEDUP_COLUMNS.get(column)
+        if not prefix:
+            continue
+        counts: dict[str, int] = {}
+        for row in rows:
+            value = _tsv_cell(row[index])
+            counts[value] = counts.get(value, 0) + 1
+        for value, count in counts.items():
+            if count >= 2 and len(value) >= min_alias_chars:
+                alias = f"{prefix}{sum(1 for key in aliases if key[0] == index) + 1}"
+                aliases[(index, value)] = alias
+                legend.append(f"{alias}={value}")
+
+    if legend:
+        yield "# 略号: " + " / ".join(legend)
+    yield "\t".join(columns)
+    for row in rows:
+        cells = []
+        for index, value in enumerate(row):
+            cell = _tsv_cell(value)
+            cells.append(aliases.get((index, cell), cell))
+        yield "\t".join(cells)
+
+
+ENCODERS = {"markdown": markdown_lines, "kv": kv_lines, "tsv": tsv_lines}
+
+
+def _bigrams(text: str) -> set[str]:
+    text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+@dataclass
+class ShapedResult:
+    columns: list[str]
+    rows: list[tuple]
+    omitted: int = 0              # 予算のため表示しなかった行数
+    more_than: bool = False       # スキャン上限に達した (実際は omitted 件より多い)
+    dropped_columns: list[str] = field(default_factory=list)
+
+    def summary(self) -> Optional[str]:
+        """The "N more rows" line appended after the table."""
+        if not self.omitted and not self.dropped_columns:
+            return None
+        parts = []
+        if self.omitted:
+            parts.append(f"ほか{self.omitted}件{'以上' if self.more_than else ''}の予定があります（表示を省略）")
+        if self.dropped_columns:
+            parts.append(f"省略した列: {', '.join(self.dropped_columns)}")
+        return "（" + " / ".join(parts) + "）"
+
+
+def shape_result(columns: list[str], rows: Iterable[tuple], question: Optional[str] = None,
+                 max_rows: int = 20, max_cell_chars: int = 80, budget_tokens: int = 1200,
+                 scan_rows: int = 500, encoder: Callable = markdown_lines) -> ShapedResult:
+    """
+    Shapes a query result before it goes into the prompt as context_info:
+    - reads at most `scan_rows` rows from the cursor
+    - truncates long cells to `max_cell_chars`
+    - keeps the `max_rows` rows most relevant to the question (character bigram overlap),
+      in the original (SQL) order; without matches the first rows are kept
+    - drops large text columns, then the least relevant rows, until the encoded result
+      (`encoder`: markdown / kv / tsv lines) fits `budget_tokens`
+    """
+    scanned = list(itertools.islice(rows, scan_rows + 1))
+    more_than = len(scanned) > scan_rows
+    scanned = scanned[:scan_rows]
+
+    def clip(value: Any) -> Any:
+        if isinstance(value, str) and len(value) > max_cell_chars:
+            return value[:max_cell_chars] + "…"
+        return value
+    scanned = [tuple(clip(value) for value in row) for row in scanned]
+
+    # 関連度の高い順 (同点なら元の順) に並べた行番号
+    grams = _bigrams(question) if question else set()
+    if grams:
+        scores = [len(grams & _bigrams(" ".join(format_cell(v) for v in row))) for row in scanned]
+        ranked = sorted(range(len(scanned)), key=lambda i: (-scores[i], i))
+    else:
+        ranked = list(range(len(scanned)))
+    selected = sorted(ranked[:max_rows])
+
+    columns = list(columns)
+    dropped = []
+
+    def cost(cols: list[str], indexes: list[int]) -> int:
+        keep = [columns.index(c) for c in cols]
+        lines = encoder(cols, (tuple(scanned[i][k] for k in keep) for i in indexes))
+        return sum(estimate_tokens(line) + 1 for line in lines)
+
+    kept_columns = list(columns)
+    while selected and cost(kept_columns, selected) > budget_tokens:
+        droppable = next((c for c in DROPPABLE_COLUMNS if c in kept_columns), None)
+        if droppable and len(kept_columns) > 1:
+            kept_columns.remove(droppable)
+            dropped.append(droppable)
+            continue
+        # 列を落としきっても収まらない: 関連度の最も低い行から削る
+        least = max(selected, key=lambda i: ranked.index(i))
+        selected.remove(least)
+
+    keep = [columns.index(c) for c in kept_columns]
+    return ShapedResult(
+        columns=kept_columns,
+        rows=[tuple(scanned[i][k] for k in keep) for i in selected],
+        omitted=len(scanned) - len(selected),
+        more_than=more_than,
+        dropped_columns=dropped,
+    )
@@ -0,0 +1,66 @@
+import re
+
+# スナップショットに事前計算して索引を張っている列 (結果には含めない)
+TIME_COLUMNS = ("start_epoch", "start_date")
+
+_START_AT = r"(?:\w+\.)?start_at"
+_ARGS = r"\(\s*([^()]*?)\s*\)"
+_OP = r"(>=|<=|<>|!=|==|=|>|<)"
+_FLIP = {">=": "<=", "<=": ">=", ">": "<", "<": ">"}
+
+# datetime(start_at) OP datetime(...)
+_DATETIME_CMP = re.compile(rf"datetime\(\s*{_START_AT}\s*\)\s*{_OP}\s*datetime{_ARGS}", re.IGNORECASE)
+# datetime(...) OP datetime(start_at)
+_DATETIME_CMP_REVERSED = re.compile(rf"datetime{_ARGS}\s*{_OP}\s*datetime\(\s*{_START_AT}\s*\)", re.IGNORECASE)
+# datetime(start_at) BETWEEN datetime(...) AND datetime(...)
+_DATETIME_BETWEEN = re.compile(
+    rf"datetime\(\s*{_START_AT}\s*\)\s+(NOT\s+)?BETWEEN\s+datetime{_ARGS}\s+AND\s+datetime{_ARGS}", re.IGNORECASE
+)
+# ORDER BY datetime(start_at)
+_ORDER_BY = re.compile(rf"(ORDER\s+BY\s+)datetime\(\s*{_START_AT}\s*\)", re.IGNORECASE)
+# date(start_at) (without modifiers) is exactly the start_date column: rewrite it in comparisons / GROUP BY / ORDER BY
+_DATE_CMP = re.compile(
+    rf"(?<![\w.])date\(\s*{_START_AT}\s*\)(?=\s*(?:{_OP}|(?:NOT\s+)?BETWEEN\b|(?:NOT\s+)?IN\b))", re.IGNORECASE
+)
+_DATE_CMP_REVERSED = re.compile(rf"{_OP}\s*date\(\s*{_START_AT}\s*\)", re.IGNORECASE)
+_DATE_GROUP_ORDER = re.compile(rf"((?:GROUP|ORDER)\s+BY\s+)date\(\s*{_START_AT}\s*\)", re.IGNORECASE)
+
+
+def _epoch(args: str) -> str:
+    return f"CAST(strftime('%s', {args}) AS INTEGER)"
+
+
+def rewrite_time_predicates(sql: str) -> str:
+    """
+    Rewrites `datetime(start_at)` / `date(start_at)` predicates into index-friendly
+    range predicates on the precomputed `start_epoch` / `start_date` columns.
+
+    The rewrite keeps the result identical: start_epoch = strftime('%s', start_at)
+    and start_date = date(start_at), and comparing two datetime() strings orders
+    exactly like comparing their epoch seconds.
+    """
+    sql = _DATETIME_BETWEEN.sub(
+        lambda m: f"start_epoch {m.group(1) or ''}BETWEEN {_epoch(m.group(2))} AND {_epoch(m.group(3))}", sql
+    )
+    sql = _DATETIME_CMP.sub(lambda m: f"start_epoch {m.group(1)} {_epoch(m.group(2))}", sql)
+    sql = _DATETIME_CMP_REVERSED.sub(
+        lambda m: f"start_epoch {_FLIP.get(m.group(2), m.group(2))} {_epoch(m.group(1))}", sql
+    )
+    sql = _ORDER_BY.sub(lambda m: f"{m.group(1)}start_epoch", sql)
+    sql = _DATE_CMP.sub("start_date", sql)
+    sql = _DATE_CMP_REVERSED.sub(lambda m: f"{m.group(1)} start_date", sql)
+    sql = _DATE_GROUP_ORDER.sub(lambda m: f"{m.group(1)}start_date", sql)
+    return sql
+
+
+# '...' / "..." literals are kept as they are by normalize_sql
+_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Cache key form of a query: whitespace collapsed, keywords / identifiers lowercased
+    and a trailing `;` removed, leaving string literals untouched.
+    """
+    parts = _LITERAL.split(sql.strip().rstrip(";").strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part).lower() for i, part in enumerate(parts))
@@ -1,27 +1,34 @@
 
+import asyncio
+import re
 import time
 import json
 import sys
 import argparse
 from datetime import datetime, timedelta, timezone
-from dateutil.relativedelta import relativedelta
 from typing import Optional
-from playwright.sync_api import sync_playwright
 from supabase import create_client
-from groq import Groq
+from groq import AsyncGroq, Groq, RateLimitError
 from src.core import config
+from src.core.admission import AdmissionScheduler
 from src.core.logger import setup_logger
+from src.core.tokens import estimate_tokens
+from src.workers.timetree_client import TIMETREE_BASE_URL, fetch_events, month_starts
 
 logger = setup_logger(__name__)
 
-# 定数
-TIMETREE_BASE_URL: str = "https://timetreeapp.com/public_calendars/lollipop_1116"
-
 # Groq初期化
+GROQ_MODEL_NAME: str = "Groq Llama 3.3 70B"
 groq_client: Optional[Groq] = None
 if config.GROQ_API_KEY:
     groq_client = Groq(api_key=config.GROQ_API_KEY)
 
+# 無料枠のRPM/TPMを超えないよう受付制御 (バッチ処理なので枠が空くまで待つ)
+groq_admission = AdmissionScheduler(
+    {GROQ_MODEL_NAME: config.MODEL_RATE_LIMITS[GROQ_MODEL_NAME]} if config.ADMISSION_ENABLED else {},
+    max_wait_sec=60,
+)
+
 def check_env_vars() -> bool:
     """環境変数の設定状況を確認"""
     logger.info("--- ⚙️ 設定チェック ---")
@@ -31,21 +38,11 @@ def check_env_vars() -> bool:
     logger.info("-----------------------")
     return bool(config.SUPABASE_URL and config.SUPABASE_KEY)
 
-def extract_details_with_groq(title: str, date_str: str, note: str) -> dict:
-    """Groq (Llama 3) でメモ欄から詳細情報（時間、場所、チケット、料金、特典）を抽出"""
-    if not note or not groq_client: return {}
-    
-    prompt = f"""
-    You are a precise data extraction engine.
-    Extract information from the text **exactly as it appears** in the source.
+GROQ_MODEL: str = "llama-3.3-70b-versatile"
 
-    [Input]
-    Date: {date_str}
-    Title: {title}
-    Note: {note}
 
-    [Rules]
-    1. Output JSON ONLY.
+# 単発 / バッチ抽出で共通のルール (1. は出力形式なので各プロンプト側に書く)
+EXTRACTION_RULES = """\
     2. **ticket_url**: Extract ticket links. Look for domains like 'livepocket.jp', 't.livepocket.jp', 't-dv.com', 'tiget.net' even if 'https://' is missing. If missing protocol, prepend 'https://'.
     3. **price**: Extract ticket price details. KEEP ORIGINAL TEXT. Do NOT translate '¥' to '元' or 'Yuan'. Do NOT change currency symbols.
     4. **bonus**: Extract text related to '特典', '招待', '写メ', 'チェキ', '動画', 'くじ', 'プレゼント'.
@@ -55,7 +52,47 @@ def extract_details_with_groq(title: str, date_str: str, note: str) -> dict:
        - Extract START/END times (ISO 8601: YYYY-MM-DDTHH:MM:SS+09:00).
        - Handle "1040" as "10:40".
        - If "OPEN" and "START" exist, use "START" for start_at. If only "OPEN", use "OPEN".
-       - If time is "TBA" or unknown, return null for times.
+       - If time is "TBA" or unknown, return null for times."""
+
+EXTRACTION_FIELDS = ("start_at", "end_at", "place", "ticket_url", "price", "bonus")
+
+# 時刻だけの抽出 (timetable_oneshot の一括取り込み): 詳細項目のルールとスキーマを送らない
+TIME_FIELDS = ("start_at", "end_at")
+TIME_RULES = """\
+    2. **start_at/end_at**: ISO 8601 (YYYY-MM-DDTHH:MM:SS+09:00), or null.
+    3. Handle "1040" as "10:40".
+    4. If "OPEN" and "START" exist, use "START". If only "OPEN", use "OPEN".
+    5. If time is "TBA" or unknown, return null for both."""
+
+
+def build_time_prompt(title: str, date_str: str, note: str) -> str:
+    return f"""
+    You are a scheduler assistant. Extract START and END times from the text.
+
+    [Input]
+    Date: {date_str}
+    Title: {title}
+    Note: {note}
+
+    [Rules]
+    1. Output JSON: {{ "start_at": "YYYY-MM-DDTHH:MM:SS+09:00", "end_at": "..." or null }}
+{TIME_RULES}
+    """
+
+
+def build_extraction_prompt(title: str, date_str: str, note: str) -> str:
+    return f"""
+    You are a precise data extraction engine.
+    Extract information from the text **exactly as it appears** in the source.
+
+    [Input]
+    Date: {date_str}
+    Title: {title}
+    Note: {note}
+
+    [Rules]
+    1. Output JSON ONLY.
+{EXTRACTION_RULES}
 
     Output Schema:
     {{
@@ -67,60 +104,386 @@ def extract_details_with_groq(title: str, date_str: str, note: str) -> dict:
        "bonus": "string or null"
     }}
     """
-    
+
+
+def _completion_args(prompt: str) -> dict:
+    return dict(
+        model=GROQ_MODEL,
+        messages=[
+            {"role": "system", "content": "Output JSON only."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0,
+        response_format={"type": "json_object"}
+    )
+
+
+def extract_details_with_groq(title: str, date_str: str, note: str) -> dict:
+    """Groq (Llama 3) でメモ欄から詳細情報（時間、場所、チケット、料金、特典）を抽出"""
+    if not note or not groq_client: return {}
+    prompt = build_extraction_prompt(title, date_str, note)
+
     try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "Output JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
+        groq_admission.acquire_blocking(GROQ_MODEL_NAME, estimate_tokens(prompt))
+        completion = groq_client.chat.completions.create(**_completion_args(prompt))
         content = completion.choices[0].message.content or "{}"
         return json.loads(content)
     except Exception as e:
         logger.warning(f"AI解析エラー: {e}")
         return {}
 
+
+def _retry_delay(error: RateLimitError, attempt: int) -> float:
+    """429 の待ち時間: retry-after ヘッダーがあればそれに従い、なければ指数バックオフ"""
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (TypeError, ValueError, AttributeError):
+        return config.GROQ_BACKOFF_BASE_SEC * (2 ** attempt)
+
+
+async def extract_details_async(client: AsyncGroq, title: str, date_str: str, note: str,
+                                fields: tuple = EXTRACTION_FIELDS) -> dict:
+    """extract_details_with_groq の非同期版 (429 は待ってから再試行)。fields=TIME_FIELDS なら時刻だけを抽出"""
+    if not note: return {}
+    if fields == TIME_FIELDS:
+        prompt = build_time_prompt(title, date_str, note)
+    else:
+        prompt = build_extraction_prompt(title, date_str, note)
+
+    for attempt in range(config.GROQ_MAX_RETRIES + 1):
+        try:
+            # バッチ処理なので RPM/TPM の枠が空くまで待つ (拒否はしない)
+            await groq_admission.acquire(GROQ_MODEL_NAME, estimate_tokens(prompt), max_wait=float("inf"))
+            completion = await client.chat.completions.create(**_completion_args(prompt))
+            content = completion.choices[0].message.content or "{}"
+            data = json.loads(content)
+            return {key: data.get(key) for key in TIME_FIELDS} if fields == TIME_FIELDS else data
+        except RateLimitError as e:
+            if attempt == config.GROQ_MAX_RETRIES:
+                logger.warning(f"AI解析エラー (429 再試行上限): {title[:15]}...")
+                return {}
+            delay = _retry_delay(e, attempt)
+            logger.info(f"⏳ Groq 429: {delay:.1f}秒後に再試行 ({attempt + 1}/{config.GROQ_MAX_RETRIES}) {title[:15]}...")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            logger.warning(f"AI解析エラー: {e}")
+            return {}
+    return {}
+
+def build_batch_prompt(items: list[dict], fields: tuple = EXTRACTION_FIELDS) -> str:
+    """
+    複数イベントを1リクエストで解析するプロンプト (ルールは1回だけ書く)。
+    fields=TIME_FIELDS なら時刻のルールとスキーマだけを送る
+    """
+    events = [
+        {"source_id": item["source_id"], "date": item["dt_obj"].strftime('%Y-%m-%d'),
+         "title": item["title"], "note": item["note"]}
+        for item in items
+    ]
+    times_only = fields == TIME_FIELDS
+    task = "START and END times" if times_only else "information"
+    rules = TIME_RULES if times_only else EXTRACTION_RULES
+    schema = "\n".join(
+        f'             "{field}": "{"ISO string" if field in TIME_FIELDS else "string"} or null",'
+        for field in fields
+    ).rstrip(",")
+    return f"""
+    You are a precise data extraction engine.
+    Extract {task} for EACH event below from its own note **exactly as it appears** in the source.
+    Never mix information between events.
+
+    [Input]
+    {json.dumps(events, ensure_ascii=False)}
+
+    [Rules]
+    1. Output JSON ONLY: one object per input event, in the "events" array, with the same "source_id".
+{rules}
+
+    Output Schema:
+    {{
+       "events": [
+          {{
+             "source_id": "source_id of the input event",
+{schema}
+          }}
+       ]
+    }}
+    """
+
+
+def validate_extraction(item: dict, data, fields: tuple = EXTRACTION_FIELDS) -> Optional[dict]:
+    """
+    バッチ応答の1件を検証する。形式が正しく、時刻がそのイベントの日付のものなら `fields` の抽出結果を返す。
+    取り違え (別イベントの日付) や壊れた値は None → 単発で取り直す (fields に無い項目は見ない)
+    """
+    if not isinstance(data, dict) or str(data.get("source_id")) != item["source_id"]:
+        return None
+    extracted = {key: data.get(key) for key in fields}
+    if any(value is not None and not isinstance(value, str) for value in extracted.values()):
+        return None
+    date_str = item["dt_obj"].strftime('%Y-%m-%d')
+    for key in TIME_FIELDS:
+        value = extracted.get(key)
+        if value and not re.match(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}", value):
+            return None
+    if extracted.get("start_at") and not extracted["start_at"].startswith(date_str):
+        return None
+    return extracted
+
+
+async def extract_batch_async(client: AsyncGroq, items: list[dict], fields: tuple = EXTRACTION_FIELDS) -> dict:
+    """
+    複数イベントを1リクエストで解析する。source_id → 抽出結果 (検証を通ったものだけ)。
+    応答に無い / 検証で落ちたイベントは呼び出し側が単発で取り直す
+    """
+    prompt = build_batch_prompt(items, fields)
+    by_id = {item["source_id"]: item for item in items}
+
+    for attempt in range(config.GROQ_MAX_RETRIES + 1):
+        try:
+            await groq_admission.acquire(GROQ_MODEL_NAME, estimate_tokens(prompt), max_wait=float("inf"))
+            completion = await client.chat.completions.create(**_completion_args(prompt))
+            data = json.loads(completion.choices[0].message.content or "{}")
+            break
+        except RateLimitError as e:
+            if attempt == config.GROQ_MAX_RETRIES:
+                logger.warning(f"AI一括解析エラー (429 再試行上限): {len(items)}件")
+                return {}
+            delay = _retry_delay(e, attempt)
+            logger.info(f"⏳ Groq 429: {delay:.1f}秒後に再試行 ({attempt + 1}/{config.GROQ_MAX_RETRIES}) 一括{len(items)}件")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            logger.warning(f"AI一括解析エラー: {e}")
+            return {}
+
+    entries = data.get("events") if isinstance(data, dict) else None
+    results = {}
+    for entry in entries if isinstance(entries, list) else []:
+        item = by_id.get(str(entry.get("source_id"))) if isinstance(entry, dict) else None
+        if item and item["source_id"] not in results:
+            extracted = validate_extraction(item, entry, fields)
+            if extracted is not None:
+                results[item["source_id"]] = extracted
+    return results
+
+
+def make_batches(items: list[dict], batch_size: int, max_tokens: int) -> list[list[dict]]:
+    """最大 batch_size 件、メモの推定トークン合計が max_tokens 以下になるように区切る (元の順)"""
+    batches: list[list[dict]] = []
+    current: list[dict] = []
+    current_tokens = 0
+    for item in items:
+        tokens = estimate_tokens(item["title"] + item["note"])
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def plan_event(event: dict, existing_updates: dict) -> Optional[dict]:
+    """イベントを保存前の中間形式にする。DBにあり更新日時が変わっていなければ None (スキップ)"""
+    source_id = str(event["id"])
+    title = event.get("title", "")
+    raw_start = event["start_at"] / 1000
+
+    # 更新日時の取得
+    raw_updated_at = event.get("updated_at")
+    if raw_updated_at:
+        updated_at_dt = datetime.fromtimestamp(raw_updated_at / 1000, timezone.utc)
+    else:
+        updated_at_dt = datetime.now(timezone.utc)
+
+    updated_at_iso = updated_at_dt.isoformat()
+    dt_obj = datetime.fromtimestamp(raw_start, timezone(timedelta(hours=9)))
+
+    # 変更チェック: すでにDBにあり、更新日時が変わっていなければ解析をスキップ
+    if source_id in existing_updates:
+        try:
+            db_updated_at = existing_updates[source_id]
+            # Supabaseの日時は '2026-03-06T14:06:02.365+00' のような形式
+            # Pythonのisoformatは '2026-03-06T14:06:02.365000+00:00'
+            # 両方を datetime オブジェクトにして比較
+            dt1 = datetime.fromisoformat(db_updated_at.replace('Z', '+00:00'))
+            dt2 = datetime.fromisoformat(updated_at_iso)
+
+            if dt1 == dt2:
+                logger.info(f"  ⏭️  スキップ (変更なし): {title[:15]}...")
+                return None
+        except Exception as e:
+            logger.debug(f"比較エラー: {e}")
+
+    return {
+        "event": event,
+        "source_id": source_id,
+        "title": title,
+        "note": event.get("note", ""),
+        "dt_obj": dt_obj,
+        "updated_at_dt": updated_at_dt,
+    }
+
+
+def _extraction_ok(item: dict, extracted: dict) -> bool:
+    """日付整合性チェックを通る (= AI補正が採用される) 抽出結果か"""
+    try:
+        ai_start = extracted.get("start_at")
+        return bool(ai_start) and datetime.fromisoformat(ai_start).date() == item["dt_obj"].date()
+    except ValueError:
+        return False
+
+
+def extract_sequential(items: list[dict]) -> dict:
+    """従来の逐次解析 (1件ずつ、成功ごとに0.3秒待つ)"""
+    results = {}
+    for item in items:
+        extracted = extract_details_with_groq(item["title"], item["dt_obj"].strftime('%Y-%m-%d'), item["note"])
+        results[item["source_id"]] = extracted
+        if _extraction_ok(item, extracted):
+            time.sleep(0.3)
+    return results
+
+
+async def extract_concurrent(items: list[dict], concurrency: int, client: Optional[AsyncGroq] = None,
+                             batch_size: int = 1, fields: tuple = EXTRACTION_FIELDS) -> tuple[dict, dict]:
+    """
+    AsyncGroq で最大 `concurrency` リクエストを同時に実行する (RPM/TPM は groq_admission で制限)。
+    batch_size > 1 なら最大 batch_size 件をまとめて1リクエストで解析し、
+    応答に無い / 不正なイベントだけ単発で取り直す。fields=TIME_FIELDS なら時刻だけを抽出する。
+    source_id → 抽出結果 と統計 (requests, batches, retried, sequential_sec) を返す。
+    sequential_sec は逐次で実行した場合の推定秒数 (各呼び出しの所要時間 + 成功ごとの0.3秒)。
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    owns_client = client is None
+    client = client or AsyncGroq(api_key=config.GROQ_API_KEY)
+    stats = {"requests": 0, "batches": 0, "retried": 0, "sequential_sec": 0.0}
+
+    async def extract_one(item: dict) -> dict:
+        stats["requests"] += 1
+        return await extract_details_async(client, item["title"], item["dt_obj"].strftime('%Y-%m-%d'), item["note"], fields)
+
+    async def extract(batch: list[dict]) -> dict:
+        async with semaphore:
+            start = time.monotonic()
+            if len(batch) == 1:
+                results = {batch[0]["source_id"]: await extract_one(batch[0])}
+            else:
+                stats["requests"] += 1
+                stats["batches"] += 1
+                results = await extract_batch_async(client, batch, fields)
+                for item in batch:
+                    if item["source_id"] not in results:
+                        stats["retried"] += 1
+                        results[item["source_id"]] = await extract_one(item)
+            stats["sequential_sec"] += time.monotonic() - start + 0.3 * sum(
+                _extraction_ok(item, results[item["source_id"]]) for item in batch)
+            return results
+
+    batches = make_batches(items, batch_size, config.GROQ_BATCH_MAX_TOKENS) if batch_size > 1 else [[item] for item in items]
+    results = {}
+    try:
+        for batch_results in await asyncio.gather(*(extract(batch) for batch in batches)):
+            results.update(batch_results)
+    finally:
+        if owns_client:
+            await client.close()
+    return results, stats
+
+
+def run_extraction(items: list[dict], batch_size: int = 1, fields: tuple = EXTRACTION_FIELDS) -> dict:
+    """
+    変更のあったイベントのメモをAI解析する。GROQ_EXTRACTION_CONCURRENCY > 1 なら並行実行、
+    batch_size > 1 なら複数件を1リクエストにまとめる (一括取り込み向け)。
+    fields=TIME_FIELDS なら時刻だけを抽出する (プロンプト・出力とも詳細項目の分だけ小さい)
+    """
+    if not items:
+        return {}
+    start = time.monotonic()
+    concurrency = config.GROQ_EXTRACTION_CONCURRENCY
+    if concurrency <= 1 and batch_size <= 1 and fields == EXTRACTION_FIELDS:
+        results = extract_sequential(items)
+        logger.info(f"⏱️ AI解析 {len(items)}件: {time.monotonic() - start:.1f}秒 (逐次)")
+        return results
+
+    results, stats = asyncio.run(extract_concurrent(items, concurrency, batch_size=batch_size, fields=fields))
+    elapsed = time.monotonic() - start
+    sequential_sec = stats["sequential_sec"]
+    batch_info = f" / 一括{stats['batches']}回・単発で再取得{stats['retried']}件" if batch_size > 1 else ""
+    logger.info(
+        f"⏱️ AI解析 {len(items)}件: {elapsed:.1f}秒 (並行数 {concurrency}, リクエスト{stats['requests']}回{batch_info}) / "
+        f"逐次なら約{sequential_sec:.1f}秒 → 約{max(sequential_sec - elapsed, 0):.1f}秒短縮"
+    )
+    return results
+
+
+def build_row(item: dict, extracted: Optional[dict]) -> dict:
+    """保存データ1件。extracted が None ならAI補正なし (メモなし / Groq未設定)"""
+    title = item["title"]
+    dt_obj = item["dt_obj"]
+    event = item["event"]
+    start_at = dt_obj.isoformat()
+    end_at = None
+    is_all_day = event.get("all_day", False)
+
+    place = None
+    ticket_url = None
+    price_details = None
+    bonus = None
+
+    # AI補正
+    if extracted is not None:
+        ai_start = extracted.get("start_at")
+        ai_end = extracted.get("end_at")
+        place = extracted.get("place")
+        ticket_url = extracted.get("ticket_url")
+        price_details = extracted.get("price")
+        bonus = extracted.get("bonus")
+
+        if ai_start:
+            # 日付整合性チェック
+            original_date = dt_obj.date()
+            try:
+                ai_dt = datetime.fromisoformat(ai_start)
+                ai_date = ai_dt.date()
+
+                if original_date != ai_date:
+                    logger.warning(f"⚠️ AI Date Mismatch! Skipping AI result. Original: {original_date}, AI: {ai_date}")
+                    # フォールバック: AI結果を破棄して元の時間を使用
+                else:
+                    start_at = ai_start
+                    is_all_day = False
+                    if ai_end: end_at = ai_end
+                    logger.info(f"  🤖 AI解析成功: {title[:15]}... -> {ai_start} | 📍 {place} | 🎫 {price_details} | 🎁 {bonus}")
+            except ValueError:
+                logger.warning(f"⚠️ AI returned invalid date format: {ai_start}")
+        else:
+            logger.debug(f"  🤖 AI解析スキップ: {title[:15]}...")
+
+    return {
+        "source_id": item["source_id"],
+        "title": title,
+        "start_at": start_at,
+        "end_at": end_at,
+        "description": item["note"],
+        "url": event.get("url", ""),
+        "image_url": None,
+        "is_all_day": is_all_day,
+        "updated_at": item["updated_at_dt"].isoformat(),
+        "place": place,
+        "ticket_url": ticket_url,
+        "price_details": price_details,
+        "bonus": bonus
+    }
+
+
 def fetch_and_sync(dry_run: bool = False) -> None:
     if not check_env_vars(): return
     
     logger.info(f"🚀 同期プロセスを開始します (モード: {'Dry Run' if dry_run else '通常実行'})...")
-    all_events = {}
-
-    with sync_playwright() as p:
-        logger.info("🌍 ブラウザ起動中...")
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
-
-        def handle_response(response):
-            if "public_events" in response.url and response.status == 200:
-                try:
-                    data = response.json()
-                    events = data.get("public_events", [])
-                    for e in events:
-                        all_events[e["id"]] = e
-                except: pass
-
-        page.on("response", handle_response)
-
-        # 今月から向こう4ヶ月分を巡回
-        today = datetime.now()
-        for i in range(4):
-            target_date = today + relativedelta(months=i)
-            date_param = target_date.strftime("%Y-%m-01")
-            url = f"{TIMETREE_BASE_URL}?monthly={date_param}"
-            
-            logger.info(f"🔄 巡回: {date_param} ...")
-            try:
-                page.goto(url, wait_until="networkidle")
-                page.wait_for_timeout(1500)
-            except Exception as e:
-                logger.warning(f"⚠️ タイムアウト: {e}")
-
-        browser.close()
+    # 今月から向こう4ヶ月分を取得 (API直接、失敗時のみブラウザ)
+    all_events = fetch_events(month_starts(datetime.now().date(), 4), TIMETREE_BASE_URL)
 
     if not all_events:
         logger.warning("❌ データが見つかりませんでした。")
@@ -139,98 +502,25 @@ def fetch_and_sync(dry_run: bool = False) -> None:
             logger.warning(f"⚠️ 既存データの取得失敗 (初回実行時は正常): {e}")
 
     # データ整形と保存
-    upsert_data = []
     events_list = list(all_events.values())
     logger.info(f"📦 合計 {len(events_list)} 件のイベントを処理中...")
 
+    # 1. 変更のあったイベントを選ぶ → 2. AI解析 (並行) → 3. 元の順に保存データを組み立てる
+    planned = []
     for event in events_list:
         try:
-            source_id = str(event["id"])
-            title = event.get("title", "")
-            note = event.get("note", "")
-            raw_start = event["start_at"] / 1000
-            
-            # 更新日時の取得
-            raw_updated_at = event.get("updated_at")
-            if raw_updated_at:
-                updated_at_dt = datetime.fromtimestamp(raw_updated_at / 1000, timezone.utc)
-            else:
-                updated_at_dt = datetime.now(timezone.utc)
-            
-            updated_at_iso = updated_at_dt.isoformat()
-            dt_obj = datetime.fromtimestamp(raw_start, timezone(timedelta(hours=9)))
-
-            # 変更チェック: すでにDBにあり、更新日時が変わっていなければ解析をスキップ
-            if source_id in existing_updates:
-                try:
-                    db_updated_at = existing_updates[source_id]
-                    # Supabaseの日時は '2026-03-06T14:06:02.365+00' のような形式
-                    # Pythonのisoformatは '2026-03-06T14:06:02.365000+00:00'
-                    # 両方を datetime オブジェクトにして比較
-                    dt1 = datetime.fromisoformat(db_updated_at.replace('Z', '+00:00'))
-                    dt2 = datetime.fromisoformat(updated_at_iso)
-                    
-                    if dt1 == dt2:
-                        logger.info(f"  ⏭️  スキップ (変更なし): {title[:15]}...")
-                        continue
-                except Exception as e:
-                    logger.debug(f"比較エラー: {e}")
-            start_at = dt_obj.isoformat()
-            end_at = None
-            is_all_day = event.get("all_day", False)
-            
-            place = None
-            ticket_url = None
-            price_details = None
-            bonus = None
-
-            # AI補正
-            if note and groq_client:
-                extracted = extract_details_with_groq(title, dt_obj.strftime('%Y-%m-%d'), note)
-                
-                ai_start = extracted.get("start_at")
-                ai_end = extracted.get("end_at")
-                place = extracted.get("place")
-                ticket_url = extracted.get("ticket_url")
-                price_details = extracted.get("price")
-                bonus = extracted.get("bonus")
-
-                if ai_start:
-                    # 日付整合性チェック
-                    original_date = dt_obj.date()
-                    try:
-                        ai_dt = datetime.fromisoformat(ai_start)
-                        ai_date = ai_dt.date()
-                        
-                        if original_date != ai_date:
-                            logger.warning(f"⚠️ AI Date Mismatch! Skipping AI result. Original: {original_date}, AI: {ai_date}")
-                            # フォールバック: AI結果を破棄して元の時間を使用
-                        else:
-                            start_at = ai_start
-                            is_all_day = False
-                            if ai_end: end_at = ai_end
-                            logger.info(f"  🤖 AI解析成功: {title[:15]}... -> {ai_start} | 📍 {place} | 🎫 {price_details} | 🎁 {bonus}")
-                            time.sleep(0.3)
-                    except ValueError:
-                        logger.warning(f"⚠️ AI returned invalid date format: {ai_start}")
-                else:
-                    logger.debug(f"  🤖 AI解析スキップ: {title[:15]}...")
-
-            upsert_data.append({
-                "source_id": source_id,
-                "title": title,
-                "start_at": start_at,
-                "end_at": end_at,
-                "description": note,
-                "url": event.get("url", ""),
-                "image_url": None,
-                "is_all_day": is_all_day,
-                "updated_at": updated_at_dt.isoformat(),
-                "place": place,
-                "ticket_url": ticket_url,
-                "price_details": price_details,
-                "bonus": bonus
-            })
+            item = plan_event(event, existing_updates)
+            if item:
+                planned.append(item)
+        except Exception as e:
+            logger.error(f"⚠️ データ変換エラー: {e}")
+
+    extracted = run_extraction([item for item in planned if item["note"]]) if groq_client else {}
+
+    upsert_data = []
+    for item in planned:
+        try:
+            upsert_data.append(build_row(item, extracted.get(item["source_id"])))
         except Exception as e:
             logger.error(f"⚠️ データ変換エラー: {e}")
 
@@ -0,0 +1,284 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from dateutil.relativedelta import relativedelta
+
+from src.core import config
+from src.core.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 定数
+TIMETREE_BASE_URL: str = "https://timetreeapp.com/public_calendars/lollipop_1116"
+JST = timezone(timedelta(hours=9))
+UTC_OFFSET_SEC = 9 * 3600
+
+# カレンダー画面 (Web版) が public_events を呼ぶときと同じヘッダー
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept": "application/json",
+    "Accept-Language": "ja",
+    "X-Requested-With": "XMLHttpRequest",
+    "X-TimeTreeA": "web/2.1.0/ja",
+}
+
+
+class TimeTreeFetchError(Exception):
+    """The public_events API could not be used directly (HTTP status, unexpected payload)."""
+
+
+class HostRateLimiter:
+    """
+    Polite per-host pacing: request starts to the same host are spaced at least
+    `min_interval` seconds apart, however many workers are fetching concurrently.
+    """
+
+    def __init__(self, min_interval: float) -> None:
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot: dict[str, float] = {}
+
+    def reserve(self, host: str) -> float:
+        """Reserves the next slot for `host` and returns how long to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+            return slot - now
+
+    def wait(self, host: str) -> None:
+        delay = self.reserve(host)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def month_starts(first: date, count: int) -> list[date]:
+    """First day of `count` consecutive months starting with the month of `first`."""
+    start = date(first.year, first.month, 1)
+    return [start + relativedelta(months=i) for i in range(count)]
+
+
+def month_range_ms(month: date) -> tuple[int, int]:
+    """[from, to) of a month in JST as epoch milliseconds (the unit used by TimeTree)."""
+    start = datetime(month.year, month.month, 1, tzinfo=JST)
+    end = start + relativedelta(months=1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+class TimeTreeClient:
+    """
+    🪶 Browserless TimeTree fetcher
+    Calls the public calendar's public_events JSON API with httpx, following
+    `paging.next_cursor`. Months are fetched concurrently (`concurrency` workers),
+    while requests to the host stay paced by a HostRateLimiter. No Chromium process is started.
+    """
+
+    def __init__(self, calendar_url: str = TIMETREE_BASE_URL, api_url: Optional[str] = None,
+                 client: Optional[httpx.Client] = None, timeout: Optional[float] = None, max_pages: int = 20,
+                 concurrency: Optional[int] = None, limiter: Optional[HostRateLimiter] = None) -> None:
+        parts = urlsplit(calendar_url)
+        self.calendar_url = calendar_url.rstrip("/")
+        self.alias = self.calendar_url.rsplit("/", 1)[-1]
+        self.api_url = (api_url or config.TIMETREE_API_URL).format(
+            origin=f"{parts.scheme}://{parts.netloc}", calendar=self.alias
+        )
+        self.max_pages = max_pages
+        self.concurrency = max(1, concurrency or config.TIMETREE_CONCURRENCY)
+        self.limiter = limiter or HostRateLimiter(config.TIMETREE_MIN_INTERVAL_SEC)
+        self._host = urlsplit(self.api_url).netloc
+        self._owns_client = client is None
+        self._client = client or httpx.Client(
+            headers={**DEFAULT_HEADERS, "Referer": self.calendar_url},
+            timeout=timeout or config.TIMETREE_TIMEOUT_SEC,
+            follow_redirects=True,
+        )
+
+    def __enter__(self) -> "TimeTreeClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._owns_client:
+            self._client.close()
+
+    def fetch_month(self, month: date) -> list[dict]:
+        """All public events of one month (every page)."""
+        start_ms, end_ms = month_range_ms(month)
+        params = {"from": start_ms, "to": end_ms, "utc_offset": UTC_OFFSET_SEC}
+        events: list[dict] = []
+        seen_cursors = set()
+        for _ in range(self.max_pages):
+            self.limiter.wait(self._host)
+            response = self._client.get(self.api_url, params=params)
+            if response.status_code != 200:
+                raise TimeTreeFetchError(f"HTTP {response.status_code} for {month:%Y-%m}")
+            try:
+                data = response.json()
+            except ValueError:
+                raise TimeTreeFetchError(f"Non-JSON response for {month:%Y-%m}")
+            page = data.get("public_events") if isinstance(data, dict) else None
+            if not isinstance(page, list):
+                raise TimeTreeFetchError(f"No public_events in response for {month:%Y-%m}")
+            events.extend(page)
+
+            cursor = (data.get("paging") or {}).get("next_cursor")
+            if not cursor or cursor in seen_cursors:
+                break
+            seen_cursors.add(cursor)
+            params = {**params, "cursor": cursor}
+        else:
+            logger.warning(f"⚠️ {month:%Y-%m}: {self.max_pages}ページで打ち切りました")
+        return events
+
+    def fetch_months(self, months: Iterable[date]) -> dict:
+        """event id → event for all months (events spanning months are deduplicated)."""
+        months = list(months)
+        by_month: dict[date, list[dict]] = {}
+        # 月ごとに並行取得 (ホストへの間隔は limiter で制御)。結果は月の順に統合する
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(months) or 1),
+                                thread_name_prefix="timetree") as executor:
+            for month, events in zip(months, executor.map(self.fetch_month, months)):
+                logger.info(f"🔄 取得: {month:%Y-%m} ... {len(events)}件")
+                by_month[month] = events
+            # 完全性チェック: 0件だった月だけ取り直す
+            for _ in range(config.TIMETREE_EMPTY_RETRIES):
+                empty = [month for month in months if not by_month[month]]
+                if not empty:
+                    break
+                logger.info(f"🔁 0件の月を再取得: {', '.join(f'{m:%Y-%m}' for m in empty)}")
+                by_month.update(zip(empty, executor.map(self.fetch_month, empty)))
+        return _merge(months, by_month)
+
+
+def _merge(months: list[date], by_month: dict) -> dict:
+    """event id → event, in month order (events spanning months are deduplicated)."""
+    all_events = {}
+    for month in months:
+        for event in by_month.get(month, []):
+            all_events[event["id"]] = event
+    return all_events
+
+
+def is_month_response(url: str, month: date) -> bool:
+    """
+    Whether a public_events request is the one for `month`:
+    its [from, to) range must contain the middle of the month
+    (the calendar grid may start a few days before the 1st).
+    """
+    parts = urlsplit(url)
+    if "public_events" not in parts.path:
+        return False
+    params = parse_qs(parts.query)
+    if "from" in params and "to" in params:
+        try:
+            start, end = month_range_ms(month)
+            return int(params["from"][0]) <= (start + end) // 2 < int(params["to"][0])
+        except ValueError:
+            return False
+    return True
+
+
+async def capture_month(page, calendar_url: str, month: date, timeout_sec: float, api_urls: set) -> list[dict]:
+    """
+    Opens the calendar at `month` and returns the events of that month's public_events
+    responses (following pages until one has no next_cursor).
+    Completes as soon as the data has arrived; gives up after `timeout_sec`.
+    """
+    loop = asyncio.get_running_loop()
+    responses: asyncio.Queue = asyncio.Queue()
+    page.on("response", lambda response: responses.put_nowait(response)
+            if response.status == 200 and is_month_response(response.url, month) else None)
+
+    deadline = loop.time() + timeout_sec
+    events: list[dict] = []
+    try:
+        await page.goto(f"{calendar_url}?monthly={month:%Y-%m-01}", wait_until="commit", timeout=timeout_sec * 1000)
+        while True:
+            response = await asyncio.wait_for(responses.get(), max(deadline - loop.time(), 0))
+            data = await response.json()
+            events.extend(data.get("public_events", []))
+            api_urls.add(response.url.split("?", 1)[0])
+            if not (data.get("paging") or {}).get("next_cursor"):
+                break
+    except asyncio.TimeoutError:
+        logger.warning(f"⚠️ {month:%Y-%m}: {timeout_sec:.0f}秒以内に public_events が揃いませんでした")
+    except Exception as e:
+        logger.warning(f"⚠️ {month:%Y-%m}: 取得エラー: {e}")
+    return events
+
+
+def fetch_with_browser(months: Iterable[date], calendar_url: str = TIMETREE_BASE_URL,
+                       concurrency: Optional[int] = None) -> dict:
+    """
+    Fallback: opens the calendar in headless Chromium and sniffs the public_events responses.
+    Several months are opened at once as pages of a single browser.
+    Playwright is imported here only, so the direct path never loads it.
+    """
+    return asyncio.run(_browse(list(months), calendar_url, concurrency or config.TIMETREE_CONCURRENCY))
+
+
+async def _browse(months: list[date], calendar_url: str, concurrency: int) -> dict:
+    from playwright.async_api import async_playwright
+
+    api_urls: set = set()
+    limiter = HostRateLimiter(config.TIMETREE_MIN_INTERVAL_SEC)
+    host = urlsplit(calendar_url).netloc
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def visit(context, month: date) -> list[dict]:
+        async with semaphore:
+            await asyncio.sleep(limiter.reserve(host))
+            page = await context.new_page()
+            try:
+                events = await capture_month(page, calendar_url, month, config.TIMETREE_RESPONSE_TIMEOUT_SEC, api_urls)
+                logger.info(f"🔄 巡回: {month:%Y-%m-01} ... {len(events)}件")
+                return events
+            finally:
+                await page.close()
+
+    async with async_playwright() as p:
+        logger.info("🌍 ブラウザ起動中...")
+        browser = await p.chromium.launch(headless=True)
+        context = await browser.new_context()
+        by_month = dict(zip(months, await asyncio.gather(*(visit(context, month) for month in months))))
+        # 完全性チェック: 0件だった月だけ開き直す
+        for _ in range(config.TIMETREE_EMPTY_RETRIES):
+            empty = [month for month in months if not by_month[month]]
+            if not empty:
+                break
+            logger.info(f"🔁 0件の月を再取得: {', '.join(f'{m:%Y-%m}' for m in empty)}")
+            by_month.update(zip(empty, await asyncio.gather(*(visit(context, month) for month in empty))))
+        await browser.close()
+
+    # 直接取得が失敗する場合は、ここで見えたURLを TIMETREE_API_URL に設定する
+    for api_url in sorted(api_urls):
+        logger.info(f"🔎 public_events API: {api_url}")
+    return _merge(months, by_month)
+
+
+def fetch_events(months: Iterable[date], calendar_url: str = TIMETREE_BASE_URL) -> dict:
+    """
+    event id → event for the given months.
+    Uses the public_events API directly (httpx) and falls back to Playwright
+    only when the direct path fails or returns nothing.
+    """
+    months = list(months)
+    if config.TIMETREE_DIRECT_FETCH:
+        try:
+            with TimeTreeClient(calendar_url) as client:
+                events = client.fetch_months(months)
+            if events:
+                logger.info(f"🪶 API直接取得: {len(months)}ヶ月 / {len(events)}件")
+                return events
+            logger.warning("⚠️ API直接取得で予定が0件でした。ブラウザで取得し直します")
+        except (TimeTreeFetchError, httpx.HTTPError) as e:
+            logger.warning(f"⚠️ API直接取得に失敗 ({e})。ブラウザで取得します")
+    return fetch_with_browser(months, calendar_url)
@@ -0,0 +1,73 @@
+import time
+import pytest
+from unittest.mock import patch
+from src.core import config
+from src.core.admission import AdmissionRejected, AdmissionScheduler
+from src.domain.ai_service import AIBrain
+from tests.test_ai_service import mock_model, set_models
+
+
+@pytest.mark.asyncio
+async def test_admits_within_rpm_budget():
+    scheduler = AdmissionScheduler({"m": (3, 100000)}, max_wait_sec=0)
+    for _ in range(3):
+        await scheduler.acquire("m", tokens=10)
+    with pytest.raises(AdmissionRejected):
+        await scheduler.acquire("m", tokens=10)
+
+    stats = scheduler.stats()["m"]
+    assert stats["admitted"] == 3
+    assert stats["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_tpm_budget_is_enforced():
+    scheduler = AdmissionScheduler({"m": (100, 1000)}, max_wait_sec=0)
+    await scheduler.acquire("m", tokens=800)
+    with pytest.raises(AdmissionRejected):
+        await scheduler.acquire("m", tokens=300)
+
+
+@pytest.mark.asyncio
+async def test_queues_briefly_when_slot_is_close():
+    # 600 RPM = 1 request per 0.1s
+    scheduler = AdmissionScheduler({"m": (600, 100000)}, max_wait_sec=1)
+    for bucket in scheduler._buckets["m"]:
+        bucket.tokens = 0
+
+    start = time.monotonic()
+    await scheduler.acquire("m")
+    elapsed = time.monotonic() - start
+
+    assert 0.05 < elapsed < 0.5
+    stats = scheduler.stats()["m"]
+    assert stats["queued"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 1
+    assert stats["max_wait_sec"] > 0
+
+
+@pytest.mark.asyncio
+async def test_unknown_model_is_always_admitted():
+    scheduler = AdmissionScheduler({}, max_wait_sec=0)
+    await scheduler.acquire("other", tokens=10 ** 9)
+    assert scheduler.stats() == {}
+
+
+@pytest.mark.asyncio
+async def test_brain_skips_model_without_budget(mock_env_vars):
+    """An exhausted model is skipped without sending a request"""
+    with patch('google.generativeai.configure'), patch('google.generativeai.GenerativeModel'):
+        ai_brain = AIBrain()
+    ai_brain.admission = AdmissionScheduler({"Gemini 3 Flash": (1, 100000)}, max_wait_sec=0)
+    primary, fallback = mock_model("from 3 flash"), mock_model("from 2.5 flash")
+    set_models(ai_brain, model_gemini_3_flash=primary, model_gemini_2_5_flash=fallback)
+
+    with patch.object(config, "MAU_ENV", "production"):
+        first, _, _ = await ai_brain.generate_response("User", "User: 今日あったこと聞いて")
+        second, _, _ = await ai_brain.generate_response("User", "User: 今日あったこと聞いて")
+
+    assert "from 3 flash" in first
+    assert "from 2.5 flash" in second
+    assert primary.generate_content_async.call_count == 1
+    assert ai_brain.router.snapshot()["Gemini 3 Flash"]["failures"] == 0
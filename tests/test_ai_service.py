@@ -1,8 +1,10 @@
 import pytest
 import asyncio
 from unittest.mock import MagicMock, AsyncMock, patch
-from src.domain.ai_service import AIBrain
+from datetime import datetime
+from src.domain.ai_service import AIBrain, SuggestionSplitter, bind_now_placeholder, build_reference_dates, normalize_question
 from src.core import config
+from src.domain.persona import CHARACTER_SETTING
 
 
 class MockResponse:
@@ -11,6 +13,25 @@ class MockResponse:
         self.text = text
 
 
+MODEL_ATTRS = ['model_gemini_3_flash', 'model_gemini_2_5_flash', 'model_gemini_2_5_lite', 'model_gemma_3']
+
+
+def mock_model(text: str = None, error: Exception = None) -> MagicMock:
+    """Helper to build a mocked GenerativeModel"""
+    model = MagicMock()
+    if error:
+        model.generate_content_async = AsyncMock(side_effect=error)
+    else:
+        model.generate_content_async = AsyncMock(return_value=MockResponse(text))
+    return model
+
+
+def set_models(ai_brain: AIBrain, **models) -> None:
+    """Replace all models; unspecified ones are treated as not configured"""
+    for attr in MODEL_ATTRS:
+        setattr(ai_brain, attr, models.get(attr))
+
+
 # ==============================================================================
 # AIBrain Initialization Tests
 # ==============================================================================
@@ -29,9 +50,8 @@ def test_ai_brain_init_without_key(monkeypatch):
     
     ai_brain = AIBrain()
     
-    assert ai_brain.model_priority is None
-    assert ai_brain.model_lite is None
-    assert ai_brain.model_backup_1 is None
+    for attr in MODEL_ATTRS:
+        assert getattr(ai_brain, attr) is None
 
 
 # ==============================================================================
@@ -44,10 +64,8 @@ async def test_generate_sql_success(mock_env_vars):
     ai_brain = AIBrain()
     
     # Mock Priority Model
-    mock_model = MagicMock()
-    mock_response = MockResponse("SELECT * FROM schedules WHERE datetime(start_at) > datetime('2026-01-14T10:00:00')")
-    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_priority = mock_model
+    model = mock_model("SELECT * FROM schedules WHERE datetime(start_at) > datetime('2026-01-14T10:00:00')")
+    set_models(ai_brain, model_gemini_3_flash=model)
     
     # Execute
     schema_info = "Table: schedules (id, title, start_at, place, price_details)"
@@ -56,7 +74,7 @@ async def test_generate_sql_success(mock_env_vars):
     # Assert
     assert "SELECT" in result
     assert "schedules" in result
-    mock_model.generate_content_async.assert_called_once()
+    model.generate_content_async.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -64,16 +82,14 @@ async def test_generate_sql_fallback_to_lite(mock_env_vars):
     """Test SQL generation falls back to Lite model when Priority fails"""
     ai_brain = AIBrain()
     
-    # Mock Priority Model to fail
-    mock_priority = MagicMock()
-    mock_priority.generate_content_async = AsyncMock(side_effect=Exception("429 Quota Exceeded"))
-    ai_brain.model_priority = mock_priority
-    
-    # Mock Lite Model to succeed
-    mock_lite = MagicMock()
-    mock_response = MockResponse("SELECT * FROM schedules LIMIT 10")
-    mock_lite.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_lite = mock_lite
+    # Priority models fail, Lite succeeds
+    mock_lite = mock_model("SELECT * FROM schedules LIMIT 10")
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=mock_model(error=Exception("429 Quota Exceeded")),
+        model_gemini_2_5_flash=mock_model(error=Exception("503 Unavailable")),
+        model_gemini_2_5_lite=mock_lite,
+    )
     
     # Execute
     result = await ai_brain.generate_sql("list schedules", "schema")
@@ -88,14 +104,13 @@ async def test_generate_sql_all_models_fail(mock_env_vars):
     """Test SQL generation returns fallback when all models fail"""
     ai_brain = AIBrain()
     
-    # Mock both models to fail
-    mock_priority = MagicMock()
-    mock_priority.generate_content_async = AsyncMock(side_effect=Exception("Priority Error"))
-    ai_brain.model_priority = mock_priority
-    
-    mock_lite = MagicMock()
-    mock_lite.generate_content_async = AsyncMock(side_effect=Exception("Lite Error"))
-    ai_brain.model_lite = mock_lite
+    # Mock all SQL models to fail
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=mock_model(error=Exception("Priority Error")),
+        model_gemini_2_5_flash=mock_model(error=Exception("Flash Error")),
+        model_gemini_2_5_lite=mock_model(error=Exception("Lite Error")),
+    )
     
     # Execute
     result = await ai_brain.generate_sql("test", "schema")
@@ -115,20 +130,109 @@ async def test_generate_sql_no_model(monkeypatch):
     assert result == "SELECT * FROM schedules LIMIT 0;"
 
 
+@pytest.mark.asyncio
+async def test_generate_sql_skips_open_circuit(mock_env_vars):
+    """Test a model that returned 429 is skipped on the next request"""
+    ai_brain = AIBrain()
+    
+    mock_priority = mock_model(error=Exception("429 Quota Exceeded"))
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=mock_priority,
+        model_gemini_2_5_flash=mock_model("SELECT 1"),
+    )
+    
+    await ai_brain.generate_sql("test", "schema")
+    await ai_brain.generate_sql("test", "schema")
+    
+    # Second request must not pay for the failing call again
+    mock_priority.generate_content_async.assert_called_once()
+    assert ai_brain.router.snapshot()["Gemini 3 Flash"]["state"] == "open"
+
+
+@pytest.mark.asyncio
+async def test_generate_sql_cache_hit(mock_env_vars):
+    """Same question (modulo spacing/punctuation) on the same day skips the LLM"""
+    ai_brain = AIBrain()
+    model = mock_model("SELECT * FROM schedules LIMIT 1")
+    set_models(ai_brain, model_gemini_3_flash=model)
+
+    first = await ai_brain.generate_sql("次のライブいつ？", "schema")
+    second = await ai_brain.generate_sql("次のライブ いつ?", "schema")
+
+    assert first == second == "SELECT * FROM schedules LIMIT 1"
+    model.generate_content_async.assert_called_once()
+    assert ai_brain.sql_cache.stats()["hits"] == 1
+    assert ai_brain.sql_cache.stats()["misses"] == 1
+
+
+def test_bind_now_placeholder():
+    now = datetime(2025, 12, 16, 9, 0, 5)
+    sql, time_dependent = bind_now_placeholder(
+        "SELECT * FROM schedules WHERE datetime(start_at) > datetime('2025-12-16T09:00:05')", now)
+    assert sql == "SELECT * FROM schedules WHERE datetime(start_at) > datetime(:now)"
+    assert not time_dependent
+
+    _, time_dependent = bind_now_placeholder("SELECT * FROM schedules WHERE start_at > '2025-12-16T09:00'", now)
+    assert time_dependent
+
+
+@pytest.mark.asyncio
+async def test_generate_sql_caches_now_placeholder_not_literal(mock_env_vars):
+    """The current time the model copies from the prompt becomes :now, so a later cache hit is not stale"""
+    ai_brain = AIBrain()
+    async def answer(prompt, **kwargs):
+        current_time = prompt.split("[Current Time]", 1)[1].split()[0]
+        return MockResponse(f"SELECT * FROM schedules WHERE datetime(start_at) > datetime('{current_time}')")
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(side_effect=answer)
+    set_models(ai_brain, model_gemini_3_flash=model)
+
+    first = await ai_brain.generate_sql("これからのライブは？", "schema")
+    second = await ai_brain.generate_sql("これからのライブは？", "schema")
+
+    assert first == second == "SELECT * FROM schedules WHERE datetime(start_at) > datetime(:now)"
+    model.generate_content_async.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_generate_sql_failure_not_cached(mock_env_vars):
+    """The LIMIT 0 fallback must not be cached"""
+    ai_brain = AIBrain()
+    set_models(ai_brain, model_gemini_3_flash=mock_model(error=Exception("500 Internal")))
+
+    await ai_brain.generate_sql("次のライブいつ？", "schema")
+
+    assert len(ai_brain.sql_cache) == 0
+
+
+def test_build_reference_dates():
+    """Weekend calculation (2026-01-14 is a Wednesday)"""
+    ref = build_reference_dates(datetime(2026, 1, 14, 10, 0))
+
+    assert ref["today_start"] == "2026-01-14T00:00:00"
+    assert ref["tomorrow_start"] == "2026-01-15T00:00:00"
+    assert ref["this_weekend_start"] == "2026-01-17T00:00:00"
+    assert ref["this_weekend_end"] == "2026-01-19T00:00:00"
+    assert ref["next_weekend_start"] == "2026-01-24T00:00:00"
+
+
+def test_normalize_question():
+    assert normalize_question("次の ライブ いつ？！") == normalize_question("次のライブいつ?")
+    assert normalize_question("ＬＩＶＥ") == "live"
+
+
 # ==============================================================================
 # generate_response Tests
 # ==============================================================================
 
 @pytest.mark.asyncio
 async def test_generate_response_success(mock_env_vars, monkeypatch):
-    """Test response generation with Priority Model"""
+    """Test response generation in development (Gemma first)"""
     monkeypatch.setattr(config, "MAU_ENV", "development")
     ai_brain = AIBrain()
     
-    mock_model = MagicMock()
-    mock_response = MockResponse("今度のライブ楽しみにしててね！✨\n===SUGGESTIONS===\n元気だよ！\nちょっと疲れてる\nまうちゃんは？")
-    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_priority = mock_model
+    set_models(ai_brain, model_gemma_3=mock_model("今度のライブ楽しみにしててね！✨\n===SUGGESTIONS===\n元気だよ！\nちょっと疲れてる\nまうちゃんは？"))
     
     # Execute - Use message that doesn't trigger reflex (no keywords, long enough)
     response_text, mode, suggestions = await ai_brain.generate_response("テストユーザー", "テストユーザー: 今度のライブの情報を教えてください")
@@ -136,7 +240,7 @@ async def test_generate_response_success(mock_env_vars, monkeypatch):
     # Assert
     assert "ライブ" in response_text
     assert "(Dev Check)" in response_text
-    assert mode == "GENIUS"
+    assert mode == "DEV_GEMMA"
     assert len(suggestions) == 3
     assert "元気だよ！" in suggestions
 
@@ -147,16 +251,13 @@ async def test_generate_response_fallback_to_lite(mock_env_vars, monkeypatch):
     monkeypatch.setattr(config, "MAU_ENV", "production")
     ai_brain = AIBrain()
     
-    # Priority fails
-    mock_priority = MagicMock()
-    mock_priority.generate_content_async = AsyncMock(side_effect=Exception("Quota Error"))
-    ai_brain.model_priority = mock_priority
-    
-    # Lite succeeds
-    mock_lite = MagicMock()
-    mock_response = MockResponse("こんにちは！✨")
-    mock_lite.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_lite = mock_lite
+    # Priority models fail, Lite succeeds
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=mock_model(error=Exception("Quota Error")),
+        model_gemini_2_5_flash=mock_model(error=Exception("Quota Error")),
+        model_gemini_2_5_lite=mock_model("こんにちは！✨"),
+    )
     
     # Execute
     response_text, mode, suggestions = await ai_brain.generate_response("User", "User: hi")
@@ -164,7 +265,7 @@ async def test_generate_response_fallback_to_lite(mock_env_vars, monkeypatch):
     # Assert
     assert "こんにちは" in response_text
     assert "(※Liteモード🔋)" in response_text
-    assert mode == "MAIN"
+    assert mode == "LITE"
 
 
 @pytest.mark.asyncio
@@ -173,21 +274,15 @@ async def test_generate_response_fallback_to_gemma(mock_env_vars, monkeypatch):
     monkeypatch.setattr(config, "MAU_ENV", "production")
     ai_brain = AIBrain()
     
-    # Priority fails
-    mock_priority = MagicMock()
-    mock_priority.generate_content_async = AsyncMock(side_effect=Exception("Error 1"))
-    ai_brain.model_priority = mock_priority
-    
-    # Lite fails
-    mock_lite = MagicMock()
-    mock_lite.generate_content_async = AsyncMock(side_effect=Exception("Error 2"))
-    ai_brain.model_lite = mock_lite
-    
-    # Gemma succeeds
-    mock_gemma = MagicMock()
-    mock_response = MockResponse("ありがとう！")
-    mock_gemma.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_backup_1 = mock_gemma
+    # Gemini models fail, Gemma succeeds
+    mock_gemma = mock_model("ありがとう！")
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=mock_model(error=Exception("Error 1")),
+        model_gemini_2_5_flash=mock_model(error=Exception("Error 2")),
+        model_gemini_2_5_lite=mock_model(error=Exception("Error 3")),
+        model_gemma_3=mock_gemma,
+    )
     
     # Execute
     response_text, mode, suggestions = await ai_brain.generate_response("User", "User: thanks")
@@ -196,6 +291,9 @@ async def test_generate_response_fallback_to_gemma(mock_env_vars, monkeypatch):
     assert "ありがとう" in response_text
     assert "(※ポンコツモード🤪)" in response_text
     assert mode == "PONKOTSU"
+    # Gemma has no system_instruction support, so the persona is prepended
+    prompt = mock_gemma.generate_content_async.call_args[0][0]
+    assert prompt.startswith(CHARACTER_SETTING)
 
 
 @pytest.mark.asyncio
@@ -205,10 +303,7 @@ async def test_generate_response_all_models_fail(mock_env_vars, monkeypatch):
     ai_brain = AIBrain()
     
     # All models fail
-    for model_name in ['model_priority', 'model_lite', 'model_backup_1']:
-        mock_model = MagicMock()
-        mock_model.generate_content_async = AsyncMock(side_effect=Exception("Fatal Error"))
-        setattr(ai_brain, model_name, mock_model)
+    set_models(ai_brain, **{attr: mock_model(error=Exception("Fatal Error")) for attr in MODEL_ATTRS})
     
     # Execute
     response_text, mode, suggestions = await ai_brain.generate_response("User", "User: hello")
@@ -217,6 +312,66 @@ async def test_generate_response_all_models_fail(mock_env_vars, monkeypatch):
     assert "パンク" in response_text or "ごめんね" in response_text
 
 
+# ==============================================================================
+# Hedged Request Tests
+# ==============================================================================
+
+def slow_model(text: str, delay: float) -> MagicMock:
+    """Helper to build a mocked model that answers after `delay` seconds"""
+    async def _generate(prompt):
+        await asyncio.sleep(delay)
+        return MockResponse(text)
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(side_effect=_generate)
+    return model
+
+
+@pytest.fixture
+def hedge_config(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(config, "HEDGE_DEFAULT_DELAY_SEC", 0.05)
+    monkeypatch.setattr(config, "HEDGE_MIN_DELAY_SEC", 0.01)
+    monkeypatch.setattr(config, "HEDGE_MAX_DELAY_SEC", 1.0)
+
+
+@pytest.mark.asyncio
+async def test_hedge_backup_wins_when_primary_is_slow(mock_env_vars, hedge_config):
+    """Slow primary gets raced against the next model; the faster answer wins"""
+    ai_brain = AIBrain()
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=slow_model("遅い返事", 2.0),
+        model_gemini_2_5_flash=mock_model("速い返事✨"),
+    )
+
+    response_text, mode, suggestions = await ai_brain.generate_response("User", "User: 今日は何してたの？")
+
+    assert "速い返事" in response_text
+    assert mode == "MAIN"
+    assert ai_brain.hedge_stats["fired"] == 1
+    assert ai_brain.hedge_stats["won_by_backup"] == 1
+    assert ai_brain.hedge_stats["last"]["winner"] == "Gemini 2.5 Flash"
+    assert ai_brain.hedge_stats["last"]["delay"] == 0.05
+
+
+@pytest.mark.asyncio
+async def test_hedge_not_fired_when_primary_is_fast(mock_env_vars, hedge_config):
+    """No hedge request is sent if the primary answers within the delay"""
+    ai_brain = AIBrain()
+    mock_backup = mock_model("バックアップ")
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=mock_model("すぐ返事"),
+        model_gemini_2_5_flash=mock_backup,
+    )
+
+    response_text, mode, suggestions = await ai_brain.generate_response("User", "User: 今日は何してたの？")
+
+    assert mode == "GENIUS"
+    assert ai_brain.hedge_stats["fired"] == 0
+    mock_backup.generate_content_async.assert_not_called()
+
+
 # ==============================================================================
 # Reflex Layer Tests
 # ==============================================================================
@@ -264,10 +419,7 @@ async def test_reflex_not_triggered_for_long_message(mock_env_vars):
     ai_brain = AIBrain()
     
     # Mock Priority Model
-    mock_model = MagicMock()
-    mock_response = MockResponse("AIからの応答です")
-    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_priority = mock_model
+    set_models(ai_brain, model_gemini_3_flash=mock_model("AIからの応答です"))
     
     # Long message containing "おはよう"
     response_text, mode, suggestions = await ai_brain.generate_response(
@@ -288,16 +440,13 @@ async def test_suggestions_parsing(mock_env_vars):
     """Test that suggestions are correctly parsed from response"""
     ai_brain = AIBrain()
     
-    mock_model = MagicMock()
-    mock_response = MockResponse("""今週のスケジュールを確認するね！✨
+    set_models(ai_brain, model_gemini_3_flash=mock_model("""今週のスケジュールを確認するね！✨
 
 ===SUGGESTIONS===
 今日の予定は？
 ライブ情報教えて
 疲れた〜
-余分な4つ目""")
-    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_priority = mock_model
+余分な4つ目"""))
     
     # Use a long message that won't trigger reflex
     response_text, mode, suggestions = await ai_brain.generate_response("User", "User: 今週のスケジュールを確認したいのですが")
@@ -310,6 +459,112 @@ async def test_suggestions_parsing(mock_env_vars):
     assert "疲れた〜" in suggestions
 
 
+# ==============================================================================
+# Streaming Tests
+# ==============================================================================
+
+def streaming_model(chunks: list, error: Exception = None) -> MagicMock:
+    """Helper to build a mocked model whose stream yields `chunks` and then optionally raises"""
+    async def _stream():
+        for chunk in chunks:
+            yield MockResponse(chunk)
+        if error:
+            raise error
+
+    async def _generate(prompt, stream=False):
+        return _stream()
+
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(side_effect=_generate)
+    return model
+
+
+async def collect(stream) -> list:
+    return [event async for event in stream]
+
+
+def test_suggestion_splitter_marker_across_chunks():
+    """Marker split over several chunks must not leak into the reply text"""
+    splitter = SuggestionSplitter()
+    emitted = ""
+    for chunk in ["こんにちは！", "元気？\n===SUGG", "ESTIONS===\n元気", "だよ！\nまうちゃんは？"]:
+        emitted += splitter.feed(chunk)
+    rest, suggestions = splitter.finish()
+
+    assert emitted + rest == "こんにちは！元気？"
+    assert suggestions == ["元気だよ！", "まうちゃんは？"]
+
+
+def test_suggestion_splitter_without_marker():
+    """Text that only looks like a marker prefix is flushed at the end"""
+    splitter = SuggestionSplitter()
+    emitted = splitter.feed("ライブ楽しみ===")
+    rest, suggestions = splitter.finish()
+
+    assert emitted + rest == "ライブ楽しみ==="
+    assert suggestions == []
+
+
+@pytest.mark.asyncio
+async def test_generate_response_stream(mock_env_vars):
+    """Test streamed chunks, final suggestions event and mode"""
+    ai_brain = AIBrain()
+    set_models(ai_brain, model_gemini_3_flash=streaming_model(["今度のライブ", "楽しみにしててね！✨\n===SUGGESTIONS===\n", "行く！\nいつ？\n"]))
+
+    events = await collect(ai_brain.generate_response_stream("User", "User: 今度のライブについて知りたいな"))
+
+    text = "".join(e["text"] for e in events if e["event"] == "chunk")
+    assert text == "今度のライブ楽しみにしててね！✨"
+    assert events[-2] == {"event": "suggestions", "suggestions": ["行く！", "いつ？"]}
+    assert events[-1] == {"event": "done", "mode": "GENIUS"}
+
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_fails_over_before_first_token(mock_env_vars):
+    """A stream that breaks before the first token falls over to the next model"""
+    ai_brain = AIBrain()
+    set_models(
+        ai_brain,
+        model_gemini_3_flash=streaming_model([], error=Exception("503 Unavailable")),
+        model_gemini_2_5_flash=streaming_model(["バックアップだよ"]),
+    )
+
+    events = await collect(ai_brain.generate_response_stream("User", "User: 今日は何してたの？"))
+
+    text = "".join(e["text"] for e in events if e["event"] == "chunk")
+    assert text == "バックアップだよ"
+    assert events[-1] == {"event": "done", "mode": "MAIN"}
+
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_closed_during_probe(mock_env_vars):
+    """A client disconnect mid-stream gives the half-open probe slot back"""
+    ai_brain = AIBrain()
+    set_models(ai_brain, model_gemini_3_flash=streaming_model(["今度のライブ", "楽しみにしててね！"]))
+    health = ai_brain.router._get("Gemini 3 Flash")
+    health.state, health.open_until = "open", 0.0
+
+    stream = ai_brain.generate_response_stream("User", "User: 今度のライブについて知りたいな")
+    assert (await stream.__anext__())["event"] == "chunk"
+    assert health.state == "half_open" and health.probe_in_flight
+    await stream.aclose()
+
+    assert not health.probe_in_flight
+    assert ai_brain.router.try_acquire("Gemini 3 Flash")
+
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_reflex(mock_env_vars):
+    """Reflex answers are sent as a single chunk"""
+    ai_brain = AIBrain()
+
+    events = await collect(ai_brain.generate_response_stream("User", "User: おはよう"))
+
+    assert events[0]["event"] == "chunk"
+    assert "(⚡0.01s)" in events[0]["text"]
+    assert events[-1] == {"event": "done", "mode": "REFLEX"}
+
+
 # ==============================================================================
 # Language / Timezone Tests
 # ==============================================================================
@@ -319,10 +574,8 @@ async def test_global_user_english_prompt(mock_env_vars):
     """Test that global users get English prompt instructions"""
     ai_brain = AIBrain()
     
-    mock_model = MagicMock()
-    mock_response = MockResponse("Hello! How are you?")
-    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_priority = mock_model
+    model = mock_model("Hello! How are you?")
+    set_models(ai_brain, model_gemini_3_flash=model)
     
     # Execute with non-Japan timezone
     response_text, mode, suggestions = await ai_brain.generate_response(
@@ -332,10 +585,10 @@ async def test_global_user_english_prompt(mock_env_vars):
     )
     
     # Assert model was called
-    mock_model.generate_content_async.assert_called_once()
+    model.generate_content_async.assert_called_once()
     
     # Check the prompt contains English instructions
-    call_args = mock_model.generate_content_async.call_args
+    call_args = model.generate_content_async.call_args
     prompt = call_args[0][0]
     assert "ENGLISH" in prompt or "English" in prompt
 
@@ -345,10 +598,8 @@ async def test_japan_user_japanese_prompt(mock_env_vars):
     """Test that Japan users get Japanese prompt instructions"""
     ai_brain = AIBrain()
     
-    mock_model = MagicMock()
-    mock_response = MockResponse("スケジュール確認するね！")
-    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
-    ai_brain.model_priority = mock_model
+    model = mock_model("スケジュール確認するね！")
+    set_models(ai_brain, model_gemini_3_flash=model)
     
     # Execute with Japan timezone - Use long message to avoid reflex
     response_text, mode, suggestions = await ai_brain.generate_response(
@@ -358,7 +609,7 @@ async def test_japan_user_japanese_prompt(mock_env_vars):
     )
     
     # Check the prompt contains Japanese instructions
-    call_args = mock_model.generate_content_async.call_args
+    call_args = model.generate_content_async.call_args
     prompt = call_args[0][0]
     assert "Japan" in prompt or "Japanese" in prompt
 
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+from src.core.clock import now_local
+from src.domain.analytics_pipeline import AnalyticsPipeline
+from src.domain.analytics_service import AnalyticsService
+from src.domain.result_format import NO_RESULT_MESSAGE
+from src.domain.intent_router import IntentRouter
+
+
+@pytest.fixture
+def analytics():
+    service = MagicMock()
+    service.get_schema_info.return_value = "CREATE TABLE schedules (...)"
+    service.warm_async = AsyncMock()
+    service.query = AsyncMock(return_value="| title |\n| Live A |")
+    return service
+
+
+@pytest.fixture
+def brain():
+    brain = MagicMock()
+    brain.generate_sql = AsyncMock(return_value="SELECT title FROM schedules")
+    return brain
+
+
+@pytest.mark.asyncio
+async def test_warm_overlaps_sql_generation(brain, analytics):
+    """Snapshot fetch runs while generate_sql is waiting on the network"""
+    async def slow_sql(*args):
+        await asyncio.sleep(0.3)
+        return "SELECT title FROM schedules"
+    brain.generate_sql = AsyncMock(side_effect=slow_sql)
+    async def slow_warm():
+        await asyncio.sleep(0.3)
+    analytics.warm_async = AsyncMock(side_effect=slow_warm)
+
+    pipeline = AnalyticsPipeline(brain, analytics, IntentRouter())
+    start = time.monotonic()
+    result = await pipeline.run("ワンマンライブいつ？")
+
+    assert 0.3 <= time.monotonic() - start < 0.5
+    assert result == "| title |\n| Live A |"
+    analytics.warm_async.assert_called_once()
+    analytics.query.assert_called_once_with("SELECT title FROM schedules", None, question="ワンマンライブいつ？")
+
+
+@pytest.mark.asyncio
+async def test_generated_sql_now_is_bound_at_execution(brain, analytics):
+    brain.generate_sql = AsyncMock(return_value="SELECT title FROM schedules WHERE datetime(start_at) > datetime(:now)")
+    pipeline = AnalyticsPipeline(brain, analytics, IntentRouter())
+    await pipeline.run("ワンマンライブいつ？")
+
+    sql, params = analytics.query.call_args.args
+    assert abs((now_local() - datetime.fromisoformat(params["now"])).total_seconds()) < 120
+
+
+@pytest.mark.asyncio
+async def test_template_intent_skips_generate_sql(brain, analytics):
+    pipeline = AnalyticsPipeline(brain, analytics, IntentRouter())
+    await pipeline.run("次のライブいつ？")
+
+    brain.generate_sql.assert_not_called()
+    sql, params = analytics.query.call_args.args
+    assert "ORDER BY datetime(start_at) LIMIT 1" in sql
+    assert "now" in params
+
+
+@pytest.mark.asyncio
+async def test_non_schedule_message_returns_none(brain, analytics):
+    pipeline = AnalyticsPipeline(brain, analytics, IntentRouter())
+    assert await pipeline.run("いつもありがとう！") is None
+    analytics.warm_async.assert_not_called()
+    analytics.query.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_errors_are_swallowed(brain, analytics):
+    brain.generate_sql = AsyncMock(side_effect=Exception("quota"))
+    pipeline = AnalyticsPipeline(brain, analytics, IntentRouter())
+    assert await pipeline.run("ワンマンライブいつ？") is None
+
+
+@pytest.fixture
+def utc_host(monkeypatch):
+    """Runs the test with the host clock in UTC (as on Render)"""
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.asyncio
+async def test_finished_event_is_not_next_on_utc_host(mock_env_vars, mock_supabase, brain, utc_host):
+    """start_at is stored as Asia/Tokyo wall-clock time; 'now' must be too, whatever the host TZ"""
+    finished = (datetime.now(timezone.utc) - timedelta(hours=2)).replace(microsecond=0)
+    mock_supabase.table.return_value.select.return_value.execute.return_value = MagicMock(data=[
+        {"source_id": "a", "title": "終わったライブ", "start_at": finished.isoformat(), "updated_at": finished.isoformat(),
+         "place": "CYCLONE", "ticket_url": None, "price_details": None, "bonus": None},
+    ])
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+
+    result = await AnalyticsPipeline(brain, service, IntentRouter()).run("次のライブいつ？")
+
+    assert result == NO_RESULT_MESSAGE
@@ -1,8 +1,12 @@
+import asyncio
 import pytest
 import sqlite3
+import threading
 import pandas as pd
-from unittest.mock import MagicMock
-from src.domain.analytics_service import AnalyticsService
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+from src.core import config
+from src.domain.analytics_service import FTS_AVAILABLE, AnalyticsService, AnalyticsSnapshot
 
 def test_get_schema_info(mock_env_vars):
     """Test schema info retrieval"""
@@ -10,6 +14,8 @@ def test_get_schema_info(mock_env_vars):
     schema = service.get_schema_info()
     assert "CREATE TABLE schedules" in schema
     assert "bonus TEXT" in schema
+    if FTS_AVAILABLE:
+        assert "schedules_fts MATCH" in schema
 
 def test_execute_query_with_mock_data(mock_env_vars, mock_supabase):
     """Test SQL execution with mock Supabase data"""
@@ -45,3 +51,404 @@ def test_execute_query_security(mock_env_vars):
     
     result = service.execute_query("DELETE FROM schedules")
     assert "エラー: 安全のため、SELECTクエリ以外は実行できません。" in result
+
+def _set_rows(mock_supabase, rows):
+    mock_response = MagicMock()
+    mock_response.data = rows
+    mock_supabase.table.return_value.select.return_value.execute.return_value = mock_response
+
+def _expire(service):
+    """Makes the snapshot older than the staleness bound, so the next request refreshes synchronously"""
+    service._cache_expires_at = datetime.min
+    service._refreshed_at = datetime.min
+
+def test_snapshot_is_reused_across_queries(mock_env_vars, mock_supabase):
+    """The snapshot is built once per data version, not per query"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+
+    with patch.object(AnalyticsSnapshot, "_load_rows", autospec=True, side_effect=AnalyticsSnapshot._load_rows) as load_rows:
+        assert "Live A" in service.execute_query("SELECT title FROM schedules")
+        assert "Live A" in service.execute_query("SELECT title FROM schedules")
+        assert load_rows.call_count == 1
+
+    assert mock_supabase.table.return_value.select.return_value.execute.call_count == 1
+    assert service.snapshot_version == 1
+
+def test_snapshot_swap_keeps_open_readers(mock_env_vars, mock_supabase):
+    """A refresh swaps in a new version; connections to the old one keep working"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Old", "start_at": "2025-10-10T19:00:00"}])
+    old_conn = service._get_fresh_connection()
+
+    _set_rows(mock_supabase, [{"title": "New", "start_at": "2025-10-11T19:00:00"}])
+    _expire(service)
+    assert "New" in service.execute_query("SELECT title FROM schedules")
+    assert service.snapshot_version == 2
+
+    assert old_conn.execute("SELECT title FROM schedules").fetchall() == [("Old",)]
+    old_conn.close()
+
+def test_swap_during_connect_does_not_open_closed_snapshot(mock_env_vars, mock_supabase):
+    """A background swap between picking the snapshot and connecting must not leave the query on an empty DB"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Old", "start_at": "2025-10-10T19:00:00"}])
+    service.warm()
+    _set_rows(mock_supabase, [{"title": "New", "start_at": "2025-10-11T19:00:00"}])
+
+    connect = AnalyticsSnapshot.connect
+    refresher = threading.Thread(target=service.refresh)
+    def racing_connect(snapshot):
+        # 読み取り側がスナップショットを選んだ直後にバックグラウンド更新が走る
+        if not refresher.is_alive() and refresher.ident is None:
+            refresher.start()
+            refresher.join(0.2)
+        return connect(snapshot)
+
+    with patch.object(AnalyticsSnapshot, "connect", autospec=True, side_effect=racing_connect):
+        result_md = service.execute_query("SELECT title FROM schedules")
+    refresher.join()
+
+    assert "Old" in result_md
+    assert service.snapshot_version == 2
+    assert "New" in service.execute_query("SELECT title FROM schedules")
+
+def test_unchanged_data_keeps_snapshot_version(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+    service.warm()
+    _expire(service)
+    service.warm()
+    assert service.snapshot_version == 1
+
+def test_snapshot_connections_are_read_only(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+    conn = service._get_fresh_connection()
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM schedules")
+    conn.close()
+
+def test_internal_time_columns_are_hidden(mock_env_vars, mock_supabase):
+    """SELECT * does not leak start_epoch / start_date to the AI"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00+09:00"}])
+    result_md = service.execute_query("SELECT * FROM schedules WHERE datetime(start_at) >= datetime('2025-10-10T00:00:00')")
+    assert "Live A" in result_md
+    assert "start_epoch" not in result_md
+    assert "start_date" not in result_md
+
+def _synced_row(source_id, title, updated_at, start_at="2025-10-10T19:00:00+09:00"):
+    return {"source_id": source_id, "title": title, "start_at": start_at, "updated_at": updated_at}
+
+def test_delta_refresh_fetches_only_changes(mock_env_vars, mock_supabase):
+    """After the first full fetch, only rows updated since the watermark are fetched and applied"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    select = mock_supabase.table.return_value.select.return_value
+    select.execute.return_value = MagicMock(data=[
+        _synced_row("a", "Live A", "2025-10-01T00:00:00+00:00"),
+        _synced_row("b", "Live B", "2025-10-02T00:00:00+00:00"),
+    ])
+    service.warm()
+    assert service.snapshot_version == 1
+
+    select.gte.return_value.execute.return_value = MagicMock(data=[
+        _synced_row("b", "Live B", "2025-10-02T00:00:00+00:00"),  # overlap (unchanged)
+        _synced_row("b2", "Live C", "2025-10-03T00:00:00+00:00"),
+        _synced_row("a", "Live A (updated)", "2025-10-03T01:00:00+00:00"),
+    ])
+    _expire(service)
+    result_md = service.execute_query("SELECT title FROM schedules ORDER BY title")
+
+    assert service.stats()["refreshes"]["full"] == 1
+    column, since = select.gte.call_args.args
+    assert column == "updated_at"
+    assert since < "2025-10-02T00:00:00+00:00"
+    assert "Live A (updated)" in result_md
+    assert "Live C" in result_md
+    assert service.snapshot_version == 2
+    assert service.stats()["rows"] == 3
+    assert service.stats()["refreshes"]["delta_rows"] == 2
+    assert service.stats()["watermark"] == "2025-10-03T01:00:00+00:00"
+
+    # 新しいデータの時刻列も索引に入っている
+    assert "Live C" in service.execute_query("SELECT title FROM schedules WHERE datetime(start_at) >= datetime('2025-10-10T00:00:00')")
+
+def test_delta_without_changes_keeps_version(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    select = mock_supabase.table.return_value.select.return_value
+    select.execute.return_value = MagicMock(data=[_synced_row("a", "Live A", "2025-10-01T00:00:00+00:00")])
+    service.warm()
+
+    select.gte.return_value.execute.return_value = MagicMock(data=[_synced_row("a", "Live A", "2025-10-01T00:00:00+00:00")])
+    _expire(service)
+    service.warm()
+    assert service.snapshot_version == 1
+    assert service.stats()["refreshes"]["delta"] == 1
+
+def test_new_rows_with_old_updated_at_trigger_full_load(mock_env_vars, mock_supabase):
+    """updated_at is TimeTree's edit time: a newly written row can be older than the watermark"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    select = mock_supabase.table.return_value.select.return_value
+    select.execute.return_value = MagicMock(data=[_synced_row("a", "Live A", "2025-10-05T00:00:00+00:00")])
+    service.warm()
+
+    # 取得範囲に入ってきた古いイベント (差分の条件には掛からないが、行数が変わる)
+    select.execute.return_value = MagicMock(count=2, data=[
+        _synced_row("a", "Live A", "2025-10-05T00:00:00+00:00"),
+        _synced_row("old", "Live Old", "2025-08-01T00:00:00+00:00"),
+    ])
+    select.gte.return_value.execute.return_value = MagicMock(data=[])
+    _expire(service)
+    result_md = service.execute_query("SELECT title FROM schedules")
+
+    assert "Live Old" in result_md
+    assert service.stats()["refreshes"]["full"] == 2
+    assert service.stats()["refreshes"]["delta"] == 0
+
+def test_deleted_rows_are_picked_up_by_count_check(mock_env_vars, mock_supabase):
+    """A delta tick only asks for the row count; a deletion changes it and triggers a full load"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    select = mock_supabase.table.return_value.select.return_value
+    select.execute.return_value = MagicMock(data=[
+        _synced_row("a", "Live A", "2025-10-01T00:00:00+00:00"),
+        _synced_row("b", "Live B", "2025-10-02T00:00:00+00:00"),
+    ])
+    select.gte.return_value.execute.return_value = MagicMock(data=[])
+    service.warm()
+
+    # 行数が同じ間は差分取得のみ (全行の取得はしない)
+    select.execute.return_value = MagicMock(count=2, data=[])
+    _expire(service)
+    service.warm()
+    assert service.stats()["refreshes"]["full"] == 1
+    assert service.stats()["refreshes"]["delta"] == 1
+    mock_supabase.table.return_value.select.assert_any_call("source_id", count="exact", head=True)
+
+    select.execute.return_value = MagicMock(count=1, data=[_synced_row("a", "Live A", "2025-10-01T00:00:00+00:00")])
+    _expire(service)
+    result_md = service.execute_query("SELECT title FROM schedules")
+
+    assert "Live B" not in result_md
+    assert service.stats()["refreshes"]["full"] == 2
+
+def test_refresh_after_sync_is_a_full_load(mock_env_vars, mock_supabase):
+    """A sync may rewrite existing rows with an old updated_at: request_refresh(full=True) reloads everything"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    select = mock_supabase.table.return_value.select.return_value
+    select.execute.return_value = MagicMock(data=[_synced_row("a", "Live A", "2025-10-05T00:00:00+00:00")])
+    service.warm()
+
+    select.execute.return_value = MagicMock(data=[_synced_row("a", "Live A @CYCLONE", "2025-10-01T00:00:00+00:00")])
+    select.gte.return_value.execute.return_value = MagicMock(data=[])
+    service._executor = MagicMock(submit=lambda fn: fn())
+    service.request_refresh(full=True)
+
+    assert service.stats()["refreshes"]["full"] == 2
+    assert "Live A @CYCLONE" in service.execute_query("SELECT title FROM schedules")
+
+def test_periodic_full_resync_drops_deleted_rows(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    select = mock_supabase.table.return_value.select.return_value
+    select.execute.return_value = MagicMock(data=[
+        _synced_row("a", "Live A", "2025-10-01T00:00:00+00:00"),
+        _synced_row("b", "Live B", "2025-10-02T00:00:00+00:00"),
+    ])
+    service.warm()
+
+    select.execute.return_value = MagicMock(data=[_synced_row("a", "Live A", "2025-10-01T00:00:00+00:00")])
+    _expire(service)
+    service._next_full_resync_at = datetime.min
+    result_md = service.execute_query("SELECT title FROM schedules")
+
+    assert "Live B" not in result_md
+    assert service.stats()["refreshes"]["full"] == 2
+
+def test_module_does_not_import_pandas():
+    """pandas is only loaded by query_df"""
+    import subprocess, sys
+    code = "import sys, src.domain.analytics_service; print('pandas' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert result.stdout.strip().endswith("False")
+
+def test_query_df_returns_dataframe(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00+09:00"}])
+    df = service.query_df("SELECT * FROM schedules")
+    assert isinstance(df, pd.DataFrame)
+    assert list(df.columns) == ["title", "start_at"]
+
+def test_empty_result_message(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+    assert service.execute_query("SELECT title FROM schedules WHERE title = 'X'") == "（条件に一致する予定はありませんでした）"
+
+def test_context_format_is_selectable(mock_env_vars, mock_supabase, monkeypatch):
+    rows = [{"title": f"Live {i}", "start_at": f"2025-10-1{i}T19:00:00", "place": "SHIBUYA CYCLONE"} for i in range(3)]
+    sql = "SELECT title, place FROM schedules ORDER BY title"
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, rows)
+    assert service.execute_query(sql).splitlines()[:3] == ["# 略号: P1=SHIBUYA CYCLONE", "title\tplace", "Live 0\tP1"]
+
+    monkeypatch.setattr(config, "ANALYTICS_CONTEXT_FORMAT", "markdown")
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    assert service.execute_query(sql).startswith("| title | place |")
+
+    monkeypatch.setattr(config, "ANALYTICS_CONTEXT_FORMAT", "yaml")
+    assert AnalyticsService().context_format == "markdown"
+
+def test_result_cache_hits_until_snapshot_swap(mock_env_vars, mock_supabase):
+    """Same SQL (modulo whitespace / case) on the same snapshot version is served from the cache"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Old", "start_at": "2025-10-10T19:00:00"}])
+
+    with patch.object(service, "_fetch", wraps=service._fetch) as fetch:
+        assert "Old" in service.execute_query("SELECT title FROM schedules")
+        assert "Old" in service.execute_query("select title\n  FROM schedules;", question="Oldは？")
+        assert fetch.call_count == 1
+        stats = service.stats()["result_cache"]
+        assert stats["hits"] == 1 and stats["entries"] == 1 and stats["bytes"] > 0
+
+        # 同期でスナップショットが差し替わると古い結果は使われない
+        _set_rows(mock_supabase, [{"title": "New", "start_at": "2025-10-11T19:00:00"}])
+        _expire(service)
+        assert "New" in service.execute_query("SELECT title FROM schedules")
+        assert fetch.call_count == 2
+        assert service.stats()["result_cache"]["entries"] == 1
+
+def test_result_cache_key_includes_params(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+    sql = "SELECT title FROM schedules WHERE datetime(start_at) >= datetime(:start)"
+    assert "Live A" in service.execute_query(sql, {"start": "2025-10-01T00:00:00"})
+    assert service.execute_query(sql, {"start": "2025-11-01T00:00:00"}) == "（条件に一致する予定はありませんでした）"
+    assert service.stats()["result_cache"]["misses"] == 2
+
+def test_stale_snapshot_is_served_while_refreshing(mock_env_vars, mock_supabase):
+    """After expiry (within the staleness bound) requests answer from the old snapshot; the refresh runs in the background"""
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Old", "start_at": "2025-10-10T19:00:00"}])
+    service.warm()
+
+    _set_rows(mock_supabase, [{"title": "New", "start_at": "2025-10-11T19:00:00"}])
+    service._cache_expires_at = datetime.min
+    with patch.object(service, "refresh", wraps=service.refresh) as refresh:
+        assert "Old" in service.execute_query("SELECT title FROM schedules")
+        service._executor.shutdown(wait=True)
+        refresh.assert_called_once_with()
+
+    assert service.snapshot_version == 2
+    assert service.stats()["stale_while_revalidate"] == {"stale_served": 1, "blocking_refreshes": 1, "background_refreshes": 1}
+
+def test_too_stale_snapshot_refreshes_synchronously(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Old", "start_at": "2025-10-10T19:00:00"}])
+    service.warm()
+    _set_rows(mock_supabase, [{"title": "New", "start_at": "2025-10-11T19:00:00"}])
+    service._cache_expires_at = datetime.min
+    service._refreshed_at = datetime.now() - timedelta(seconds=config.ANALYTICS_MAX_STALENESS_SEC + 1)
+    assert "New" in service.execute_query("SELECT title FROM schedules")
+
+@pytest.mark.asyncio
+async def test_refresher_refreshes_before_expiry(mock_env_vars, mock_supabase, monkeypatch):
+    monkeypatch.setattr(config, "ANALYTICS_REFRESH_INTERVAL_SEC", 0.05)
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+
+    task = asyncio.create_task(service.run_refresher())
+    await asyncio.sleep(0.2)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert mock_supabase.table.return_value.select.return_value.execute.call_count >= 2
+    assert service.snapshot_version == 1
+    assert service.stats()["stale_while_revalidate"]["blocking_refreshes"] == 0
+
+FTS_QUERY = "SELECT title FROM schedules WHERE rowid IN (SELECT rowid FROM schedules_fts WHERE schedules_fts MATCH ?) ORDER BY title"
+
+@pytest.mark.skipif(not FTS_AVAILABLE, reason="SQLite without FTS5 trigram")
+def test_fts_index_keyword_lookup(mock_env_vars):
+    snapshot = AnalyticsSnapshot(1, [
+        {"title": "ワンマンライブ", "start_at": "2025-10-10T19:00:00", "place": "SHIBUYA CYCLONE", "bonus": "チェキ特典あり", "description": None},
+        {"title": "対バン", "start_at": "2025-10-11T19:00:00", "place": "Zepp Shinjuku", "bonus": "", "description": "物販でチェキ販売"},
+        {"title": "配信", "start_at": "2025-10-12T19:00:00", "place": "オンライン", "bonus": None, "description": None},
+    ], "test")
+    conn = snapshot.connect()
+    assert conn.execute(FTS_QUERY, ('"チェキ"',)).fetchall() == [("ワンマンライブ",), ("対バン",)]
+    assert conn.execute(FTS_QUERY, ('place:"cyclone"',)).fetchall() == [("ワンマンライブ",)]
+    plan = conn.execute("EXPLAIN QUERY PLAN " + FTS_QUERY, ('"チェキ"',)).fetchall()
+    assert any("VIRTUAL TABLE" in row[-1] for row in plan)
+    conn.close()
+    snapshot.close()
+
+@pytest.mark.skipif(not FTS_AVAILABLE, reason="SQLite without FTS5 trigram")
+def test_fts_index_follows_delta_upserts(mock_env_vars):
+    base = AnalyticsSnapshot(1, [
+        {**_synced_row("a", "チェキ会", "2025-10-01T00:00:00+00:00"), "bonus": None},
+        {**_synced_row("b", "Live B", "2025-10-01T00:00:00+00:00"), "bonus": None},
+    ], "v1")
+    delta = AnalyticsSnapshot(2, [
+        {**_synced_row("a", "Live A", "2025-10-02T00:00:00+00:00"), "bonus": None},
+        {**_synced_row("b", "Live B", "2025-10-02T00:00:00+00:00"), "bonus": "チェキ特典"},
+    ], "v2", base=base)
+    conn = delta.connect()
+    assert conn.execute(FTS_QUERY, ('"チェキ"',)).fetchall() == [("Live B",)]
+    conn.close()
+    base.close()
+    delta.close()
+
+def test_slow_query_is_aborted_at_deadline(mock_env_vars, mock_supabase, monkeypatch):
+    """A pathological query is interrupted by the progress handler instead of running on"""
+    monkeypatch.setattr(config, "ANALYTICS_QUERY_TIMEOUT_SEC", 0.2)
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+
+    import time
+    start = time.monotonic()
+    result = service.execute_query(
+        "SELECT (WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n)"
+    )
+    assert time.monotonic() - start < 2
+    assert "中断" in result
+    assert service.stats()["query_timeouts"] == 1
+
+@pytest.mark.asyncio
+async def test_query_runs_off_the_event_loop(mock_env_vars, mock_supabase):
+    service = AnalyticsService()
+    service.supabase = mock_supabase
+    _set_rows(mock_supabase, [{"title": "Live A", "start_at": "2025-10-10T19:00:00"}])
+
+    loop_thread = threading.get_ident()
+    threads = []
+    original = service.execute_query
+    def record_thread(*args):
+        threads.append(threading.get_ident())
+        return original(*args)
+    service.execute_query = record_thread
+
+    result = await service.query("SELECT title FROM schedules")
+
+    assert "Live A" in result
+    assert threads and threads[0] != loop_thread
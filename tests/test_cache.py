@@ -0,0 +1,42 @@
+from src.core import cache
+from src.core.cache import TTLCache
+
+
+def test_lru_eviction():
+    """Least recently used entry is evicted when the cap is reached"""
+    c = TTLCache(max_entries=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # a becomes most recently used
+    c.set("c", 3)
+
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    assert c.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    """Entries expire after ttl_sec"""
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    c = TTLCache(max_entries=10, ttl_sec=60)
+    c.set("sql", "SELECT 1")
+
+    now[0] += 59
+    assert c.get("sql") == "SELECT 1"
+    now[0] += 2
+    assert c.get("sql") is None
+    assert len(c) == 0
+
+
+def test_stats():
+    c = TTLCache(max_entries=10)
+    c.set("k", "v")
+    c.get("k")
+    c.get("missing")
+
+    stats = c.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
@@ -0,0 +1,58 @@
+"""
+Tests for /api/chat/stream endpoint (Server-Sent Events)
+"""
+import json
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client():
+    from src.app.server import app
+    return TestClient(app)
+
+
+def parse_sse(body: str) -> list[tuple[str, dict]]:
+    """Parse SSE body into (event, data) tuples"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestChatStreamEndpoint:
+    """Tests for /api/chat/stream endpoint"""
+
+    def test_stream_events(self, client):
+        """Chunks, suggestions and done are forwarded as SSE events"""
+        async def fake_stream(user_name, conversation_log, context_info, timezone):
+            yield {"event": "chunk", "text": "やっほー"}
+            yield {"event": "chunk", "text": "！✨"}
+            yield {"event": "suggestions", "suggestions": ["元気？"]}
+            yield {"event": "done", "mode": "GENIUS"}
+
+        with patch("src.app.server.bot.brain.generate_response_stream", side_effect=fake_stream):
+            response = client.post("/api/chat/stream", json={"text": "こんにちは〜今日はいい天気だね", "user_name": "Tester"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(response.text)
+        assert events == [
+            ("chunk", {"text": "やっほー"}),
+            ("chunk", {"text": "！✨"}),
+            ("suggestions", {"suggestions": ["元気？"]}),
+            ("done", {"mode": "GENIUS"}),
+        ]
+
+    def test_stream_error_event(self, client):
+        """Errors during generation are reported as an `error` event"""
+        async def broken_stream(user_name, conversation_log, context_info, timezone):
+            raise RuntimeError("boom")
+            yield  # pragma: no cover
+
+        with patch("src.app.server.bot.brain.generate_response_stream", side_effect=broken_stream):
+            response = client.post("/api/chat/stream", json={"text": "こんにちは〜今日はいい天気だね"})
+
+        assert parse_sse(response.text) == [("error", {"detail": "boom"})]
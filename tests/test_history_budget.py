@@ -0,0 +1,51 @@
+from src.domain.history_budget import HistoryBudgeter, SUMMARY_PREFIX
+from src.core.tokens import estimate_tokens
+
+
+def make_turns(n: int) -> list[str]:
+    return [f"{'User' if i % 2 == 0 else 'AIまう'}: メッセージ{i}番目の内容だよ" for i in range(n)]
+
+
+def test_short_history_is_untouched():
+    """History within budget is passed through as is"""
+    budgeter = HistoryBudgeter()
+    turns = make_turns(3)
+
+    assert budgeter.fit(turns, budget_tokens=1000) == "\n".join(turns)
+    assert budgeter.stats()["trimmed_requests"] == 0
+
+
+def test_long_history_keeps_newest_turns_within_budget():
+    """Older turns are collapsed into a summary; newest turns and the current message are kept"""
+    budgeter = HistoryBudgeter(max_summary_chars=80)
+    turns = make_turns(40)
+
+    log = budgeter.fit(turns, budget_tokens=300)
+    lines = log.split("\n")
+
+    assert lines[0].startswith(SUMMARY_PREFIX)
+    assert lines[-1] == turns[-1]
+    assert lines[1:] == turns[-(len(lines) - 1):]
+    assert estimate_tokens(log) <= 300
+    assert budgeter.stats()["dropped_turns"] == 40 - (len(lines) - 1)
+
+
+def test_summary_is_cached():
+    """Summaries of the same dropped turns are reused"""
+    budgeter = HistoryBudgeter()
+    turns = make_turns(40)
+
+    budgeter.fit(turns, budget_tokens=300)
+    budgeter.fit(turns, budget_tokens=300)
+
+    assert budgeter.stats()["summary_cache"]["hits"] == 1
+
+
+def test_huge_single_turn_is_clipped():
+    """A single oversized history item cannot blow up the prompt"""
+    budgeter = HistoryBudgeter(max_turn_chars=50)
+    turns = ["User: " + "あ" * 5000, "User: いまの質問"]
+
+    log = budgeter.fit(turns, budget_tokens=10000)
+
+    assert len(log.split("\n")[0]) <= 51
@@ -0,0 +1,76 @@
+import sqlite3
+import pandas as pd
+import pytest
+from datetime import datetime
+from src.domain.intent_router import IntentRouter, period_range
+
+# 2026-10-16 is a Friday
+NOW = datetime(2026, 10, 16, 12, 0, 0)
+
+
+@pytest.fixture
+def router():
+    return IntentRouter()
+
+
+@pytest.mark.parametrize("message,template,params", [
+    ("次のライブいつ？", "next", {"now": "2026-10-16T12:00:00"}),
+    ("今後の予定教えて！", "upcoming", {"now": "2026-10-16T12:00:00"}),
+    ("今日の予定は？", "period_list", {"start": "2026-10-16T00:00:00", "end": "2026-10-17T00:00:00"}),
+    ("明日ライブある？", "period_list", {"start": "2026-10-17T00:00:00", "end": "2026-10-18T00:00:00"}),
+    ("今週末のスケジュール", "period_list", {"start": "2026-10-17T00:00:00", "end": "2026-10-19T00:00:00"}),
+    ("来週末の予定", "period_list", {"start": "2026-10-24T00:00:00", "end": "2026-10-26T00:00:00"}),
+    ("今月ライブ何回ある？", "period_count", {"start": "2026-10-01T00:00:00", "end": "2026-11-01T00:00:00"}),
+    ("When is the next live?", "next", {"now": "2026-10-16T12:00:00"}),
+])
+def test_frequent_phrasings_use_templates(router, message, template, params):
+    intent = router.classify(message, NOW)
+    assert intent.kind == "template"
+    assert intent.template == template
+    assert intent.params == params
+
+
+@pytest.mark.parametrize("message", ["いつもありがとう！", "好きな食べ物教えて", "ライブ楽しかった！", "イベントお疲れさま〜"])
+def test_false_positives_skip_analytics(router, message):
+    assert router.classify(message, NOW).kind == "none"
+
+
+@pytest.mark.parametrize("message", ["ワンマンライブいつ？", "12月の予定は？", "去年ライブ何回やった？"])
+def test_unmatched_questions_fall_back_to_llm(router, message):
+    assert router.classify(message, NOW).kind == "llm"
+
+
+def test_next_month_rolls_over_year():
+    assert period_range("next_month", datetime(2026, 12, 5)) == ("2027-01-01T00:00:00", "2027-02-01T00:00:00")
+
+
+def test_templates_run_on_sqlite(router):
+    conn = sqlite3.connect(":memory:")
+    pd.DataFrame([
+        {"title": "Past", "start_at": "2026-10-01T19:00:00", "place": "A", "price_details": "", "ticket_url": "", "bonus": ""},
+        {"title": "Sat Live", "start_at": "2026-10-17T18:00:00", "place": "B", "price_details": "", "ticket_url": "", "bonus": ""},
+        {"title": "Nov Live", "start_at": "2026-11-03T18:00:00", "place": "C", "price_details": "", "ticket_url": "", "bonus": ""},
+    ]).to_sql("schedules", conn, index=False)
+
+    intent = router.classify("次のライブいつ？", NOW)
+    assert pd.read_sql_query(intent.sql, conn, params=intent.params)["title"].tolist() == ["Sat Live"]
+
+    intent = router.classify("今月ライブ何回ある？", NOW)
+    assert pd.read_sql_query(intent.sql, conn, params=intent.params)["count"].tolist() == [2]
+
+
+def test_stats_count_saved_calls(router):
+    router.classify("次のライブいつ？", NOW)
+    router.classify("いつもありがとう！", NOW)
+    router.classify("ワンマンライブいつ？", NOW)
+    router.classify("おはよう", NOW)
+
+    stats = router.stats()
+    assert stats["checks"] == 4
+    assert stats["triggered"] == 3
+    assert stats["template_hits"] == 1
+    assert stats["rejected"] == 1
+    assert stats["llm_fallbacks"] == 1
+    assert stats["sql_calls_saved"] == 2
+    assert stats["template_hit_ratio"] == round(1 / 3, 3)
+    assert stats["templates"] == {"next": 1}
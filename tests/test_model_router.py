@@ -0,0 +1,114 @@
+import pytest
+from src.domain import model_router
+from src.domain.model_router import ModelRouter, classify_error, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    """Controllable replacement for time.monotonic"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(model_router.time, "monotonic", fake)
+    return fake
+
+
+def test_classify_error():
+    """Test 429 / 5xx / other error classification"""
+    assert classify_error(Exception("429 Resource has been exhausted (e.g. check quota).")) == "quota"
+    assert classify_error(Exception("503 The model is overloaded.")) == "server"
+    assert classify_error(Exception("Invalid argument")) == "other"
+
+
+def test_quota_error_opens_circuit_immediately(clock):
+    """A single 429 should open the circuit and skip the model during cooldown"""
+    router = ModelRouter(cooldown_sec=60, failure_threshold=3)
+
+    assert router.try_acquire("Gemini 3 Flash")
+    router.record_failure("Gemini 3 Flash", Exception("429 Quota Exceeded"))
+
+    assert router.snapshot()["Gemini 3 Flash"]["state"] == OPEN
+    assert not router.try_acquire("Gemini 3 Flash")
+
+
+def test_server_errors_open_after_threshold(clock):
+    """5xx errors open the circuit only after consecutive failures reach the threshold"""
+    router = ModelRouter(cooldown_sec=60, failure_threshold=3)
+
+    for _ in range(2):
+        router.record_failure("Gemini 2.5 Flash", Exception("500 Internal error"))
+    assert router.try_acquire("Gemini 2.5 Flash")
+
+    router.record_failure("Gemini 2.5 Flash", Exception("500 Internal error"))
+    assert not router.try_acquire("Gemini 2.5 Flash")
+
+
+def test_other_errors_do_not_open_circuit(clock):
+    """Prompt-specific errors (safety block, bad input) are recorded but never open the circuit"""
+    router = ModelRouter(cooldown_sec=60, failure_threshold=3)
+
+    for _ in range(5):
+        router.record_failure("Gemini 2.5 Flash", ValueError("response.text: no valid Part"))
+    stats = router.snapshot()["Gemini 2.5 Flash"]
+    assert stats["state"] == CLOSED and stats["failures"] == 5
+    assert router.try_acquire("Gemini 2.5 Flash")
+
+    # 途中に挟まっても 5xx の連続回数はリセットも加算もされない
+    router.record_failure("Gemini 2.5 Flash", Exception("500 Internal error"))
+    router.record_failure("Gemini 2.5 Flash", ValueError("blocked"))
+    router.record_failure("Gemini 2.5 Flash", Exception("500 Internal error"))
+    assert router.try_acquire("Gemini 2.5 Flash")
+    router.record_failure("Gemini 2.5 Flash", Exception("500 Internal error"))
+    assert not router.try_acquire("Gemini 2.5 Flash")
+
+
+def test_half_open_probe_recovers(clock):
+    """After cooldown one probe is allowed; success closes the circuit"""
+    router = ModelRouter(cooldown_sec=60)
+    router.record_failure("Gemini 3 Flash", Exception("429"))
+
+    clock.now += 61
+    assert router.try_acquire("Gemini 3 Flash")
+    assert router.snapshot()["Gemini 3 Flash"]["state"] == HALF_OPEN
+    # Only a single probe at a time
+    assert not router.try_acquire("Gemini 3 Flash")
+
+    router.record_success("Gemini 3 Flash", 0.8)
+    assert router.snapshot()["Gemini 3 Flash"]["state"] == CLOSED
+    assert router.try_acquire("Gemini 3 Flash")
+
+
+def test_failed_probe_doubles_cooldown(clock):
+    """A failed probe re-opens the circuit with a longer cooldown"""
+    router = ModelRouter(cooldown_sec=60, max_cooldown_sec=100)
+    router.record_failure("Gemini 3 Flash", Exception("429"))
+
+    clock.now += 61
+    assert router.try_acquire("Gemini 3 Flash")
+    router.record_failure("Gemini 3 Flash", Exception("429"))
+
+    clock.now += 61
+    assert not router.try_acquire("Gemini 3 Flash")
+    clock.now += 40
+    assert router.try_acquire("Gemini 3 Flash")
+
+
+def test_snapshot_and_latency_percentile(clock):
+    """Test diagnostics snapshot contents"""
+    router = ModelRouter()
+    for latency in [1.0, 2.0, 3.0, 4.0]:
+        router.record_success("Gemini 2.5 Lite", latency)
+    router.record_failure("Gemini 2.5 Lite", Exception("boom"))
+
+    state = router.snapshot()["Gemini 2.5 Lite"]
+    assert state["successes"] == 4
+    assert state["failures"] == 1
+    assert state["success_rate"] == 0.8
+    assert router.latency_percentile("Gemini 2.5 Lite", 100) == 4.0
+    assert router.latency_percentile("unknown", 95) is None
@@ -0,0 +1,59 @@
+from src.domain.prompt_templates import ResponsePromptBuilder, Segment
+from src.core.tokens import estimate_tokens
+
+
+PERSONA = "あなたは「AIまう」です。{これは置換されない}"
+
+
+def build(builder, context_info=None, timezone="Asia/Tokyo"):
+    return builder.build("テスト", "テスト: こんにちは", context_info, timezone, "2026年01月14日 10時00分")
+
+
+def test_dynamic_slots_are_filled():
+    """User name, time, history and timezone are inserted into the prompt"""
+    prompt = build(ResponsePromptBuilder(PERSONA)).text()
+
+    assert "ファンの「テスト」さん" in prompt
+    assert "2026年01月14日 10時00分" in prompt
+    assert "テスト: こんにちは" in prompt
+    assert "User Timezone: Asia/Tokyo" in prompt
+    assert "Reply in Japanese (Default)." in prompt
+    assert "【参考データ (分析結果)】" not in prompt
+
+
+def test_context_and_global_variant():
+    """Context block and English instructions are selected by variant"""
+    prompt = build(ResponsePromptBuilder(PERSONA), context_info="| title | {x} |", timezone="America/New_York").text()
+
+    assert "【参考データ (分析結果)】" in prompt
+    assert "| title | {x} |" in prompt
+    assert "You MUST reply in ENGLISH." in prompt
+
+
+def test_persona_variant_is_literal():
+    """Persona is prefixed verbatim (braces are not treated as slots)"""
+    rendered = build(ResponsePromptBuilder(PERSONA))
+
+    assert rendered.text(with_persona=True) == f"{PERSONA}\n\n{rendered.text()}"
+
+
+def test_segment_stats():
+    """Per-segment counts add up to the whole prompt and are aggregated"""
+    builder = ResponsePromptBuilder(PERSONA)
+    template = builder.template(is_global=False, has_context=True)
+    values = {"user_name": "テスト", "current_time": "now", "conversation_log": "log", "context_info": "ctx", "timezone": "Asia/Tokyo"}
+
+    stats = template.segment_stats(values)
+
+    assert [s["segment"] for s in stats] == ["header", "context", "instructions", "language", "rules"]
+    assert sum(s["chars"] for s in stats) == len(template.render(values))
+
+    build(builder).text()
+    assert builder.stats()["rules"]["renders"] == 1
+
+
+def test_segment_compiles_slots_once():
+    segment = Segment("greeting", "やっほー{user_name}ちゃん！")
+    assert segment.slots == ["user_name"]
+    assert segment.render({"user_name": "まう"}) == "やっほーまうちゃん！"
+    assert segment.static_tokens == estimate_tokens("やっほーちゃん！")
@@ -0,0 +1,92 @@
+import json
+import os
+import pytest
+from src.domain.reflex import AhoCorasick, ReflexEngine
+
+
+RULES = {
+    "default_suggestions": ["元気？"],
+    "default_max_length": 14,
+    "rules": [
+        {"id": "ohayo", "patterns": ["おはよう", "おはよ"], "responses": ["おはよー！"], "priority": 10},
+        {"id": "suki", "patterns": ["好き"], "responses": ["私も！"], "priority": 5, "suggestions": ["大好き！"]},
+        {"id": "otsukare", "patterns": ["疲れた"], "responses": ["お疲れ様〜"], "priority": 8, "max_length": 30},
+    ],
+}
+
+
+@pytest.fixture
+def rules_file(tmp_path):
+    path = tmp_path / "reflexes.json"
+    path.write_text(json.dumps(RULES, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    matcher = AhoCorasick(["he", "she", "his", "hers"])
+    patterns = ["he", "she", "his", "hers"]
+    assert {patterns[i] for i in matcher.find_all("ushers")} == {"she", "he", "hers"}
+
+
+def test_match_and_suggestions(rules_file):
+    engine = ReflexEngine(str(rules_file))
+
+    text, suggestions, rule_id = engine.respond("好き！")
+    assert rule_id == "suki"
+    assert suggestions == ["大好き！"]
+
+    # Default suggestions are used when a rule has none
+    assert engine.respond("おはよう")[1] == ["元気？"]
+
+
+def test_priority_wins(rules_file):
+    """When several rules match, the highest priority wins"""
+    engine = ReflexEngine(str(rules_file))
+    assert engine.match("おはよう好き").id == "ohayo"
+
+
+def test_per_rule_length_limit(rules_file):
+    """max_length is applied per rule"""
+    engine = ReflexEngine(str(rules_file))
+
+    assert engine.match("おはようございます。今日のライブ情報を教えてください。") is None
+    assert engine.match("今日はバイトが長くてほんとに疲れたよ〜").id == "otsukare"
+
+
+def test_fullwidth_and_case_are_normalized(tmp_path):
+    path = tmp_path / "reflexes.json"
+    path.write_text(json.dumps({"rules": [{"id": "thanks", "patterns": ["Thanks"], "responses": ["yay"]}]}), encoding="utf-8")
+    engine = ReflexEngine(str(path))
+    assert engine.match("ＴＨＡＮＫＳ!").id == "thanks"
+
+
+def test_hot_reload_and_hit_counters(rules_file):
+    """Changed file is picked up; hit counters survive the reload"""
+    engine = ReflexEngine(str(rules_file), reload_interval_sec=0)
+    engine.match("好き")
+
+    updated = dict(RULES, rules=RULES["rules"] + [{"id": "tadaima", "patterns": ["ただいま"], "responses": ["おかえり！"]}])
+    rules_file.write_text(json.dumps(updated, ensure_ascii=False), encoding="utf-8")
+    os.utime(rules_file, (1, 1))
+
+    assert engine.match("ただいま").id == "tadaima"
+    stats = engine.stats()
+    assert stats["rules"]["suki"] == 1
+    assert stats["rules"]["tadaima"] == 1
+    assert stats["hits"] == 2
+
+
+def test_invalid_file_keeps_previous_rules(rules_file):
+    engine = ReflexEngine(str(rules_file), reload_interval_sec=0)
+    rules_file.write_text("{ broken", encoding="utf-8")
+    os.utime(rules_file, (1, 1))
+
+    assert engine.match("おはよう").id == "ohayo"
+
+
+def test_shipped_rules_file_is_valid():
+    """data/reflexes.json loads and answers the basic greetings"""
+    from src.core import config
+    engine = ReflexEngine(config.REFLEX_FILE_PATH)
+    for message in ["おはよう", "おやすみ", "こんにちは", "こんばんは", "好き", "かわいい", "ありがとう", "生きてる？"]:
+        assert engine.match(message) is not None, message
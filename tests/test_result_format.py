@@ -0,0 +1,121 @@
+from src.core.tokens import estimate_tokens
+from src.domain.result_format import format_cell, kv_lines, markdown_lines, shape_result, tsv_lines
+
+
+def test_markdown_table():
+    lines = list(markdown_lines(["title", "place"], [("Live A", "Venue A"), ("Live B", None)]))
+    assert lines == [
+        "| title | place |",
+        "|---|---|",
+        "| Live A | Venue A |",
+        "| Live B |  |",
+    ]
+
+
+def test_cells_stay_on_one_line():
+    assert format_cell("OPEN 18:00\nSTART 18:30") == "OPEN 18:00 START 18:30"
+    assert format_cell("A|B") == "A\\|B"
+    assert format_cell(3000.0) == "3000"
+
+
+def test_rows_are_consumed_lazily():
+    def rows():
+        yield ("first",)
+        raise AssertionError("second row should not be read")
+
+    lines = markdown_lines(["title"], rows())
+    assert [next(lines), next(lines), next(lines)] == ["| title |", "|---|", "| first |"]
+
+
+COLUMNS = ["title", "start_at", "description"]
+
+
+def _events(n, description=""):
+    return [(f"Live {i}", f"2025-10-{i + 1:02d}T19:00:00", description) for i in range(n)]
+
+
+def test_small_result_is_unchanged():
+    shaped = shape_result(COLUMNS, iter(_events(3)))
+    assert shaped.rows == _events(3)
+    assert shaped.summary() is None
+
+
+def test_rows_are_capped_with_summary():
+    shaped = shape_result(COLUMNS, iter(_events(25)), max_rows=10)
+    assert len(shaped.rows) == 10
+    assert shaped.rows[0][0] == "Live 0"
+    assert shaped.omitted == 15
+    assert "ほか15件" in shaped.summary()
+
+
+def test_scan_limit_reports_more_than():
+    shaped = shape_result(COLUMNS, iter(_events(30)), max_rows=5, scan_rows=20)
+    assert shaped.omitted == 15
+    assert "ほか15件以上" in shaped.summary()
+
+
+def test_relevant_rows_are_kept_in_original_order():
+    rows = _events(10)
+    rows[7] = ("ワンマンライブ", "2025-10-08T19:00:00", "")
+    rows[2] = ("ワンマン前夜祭", "2025-10-03T19:00:00", "")
+    shaped = shape_result(COLUMNS, iter(rows), question="ワンマンいつ？", max_rows=2)
+    assert [r[0] for r in shaped.rows] == ["ワンマン前夜祭", "ワンマンライブ"]
+
+
+def test_long_cells_are_truncated():
+    shaped = shape_result(COLUMNS, iter(_events(1, "あ" * 500)), max_cell_chars=50)
+    assert shaped.rows[0][2] == "あ" * 50 + "…"
+
+
+def test_budget_drops_large_columns_before_rows():
+    shaped = shape_result(COLUMNS, iter(_events(10, "詳細メモ" * 20)), budget_tokens=300)
+    assert shaped.dropped_columns == ["description"]
+    assert shaped.columns == ["title", "start_at"]
+    assert len(shaped.rows) == 10
+    assert "description" in shaped.summary()
+
+
+def test_budget_is_respected():
+    shaped = shape_result(COLUMNS, iter(_events(20, "詳細メモ" * 20)), budget_tokens=100)
+    lines = list(markdown_lines(shaped.columns, shaped.rows))
+    assert sum(estimate_tokens(line) + 1 for line in lines) <= 100
+    assert shaped.omitted > 0
+
+
+SCHEDULE_COLUMNS = ["title", "start_at", "place", "price_details"]
+SCHEDULE_ROWS = [
+    (f"Live {i}", f"2025-10-{10 + i}T19:00:00", "SHIBUYA CYCLONE" if i % 2 else "新宿BLAZE", "Adv 3000 / Door 3500 (+1D)")
+    for i in range(10)
+]
+
+
+def test_kv_lines_omit_empty_values():
+    lines = list(kv_lines(["title", "place", "bonus"], [("Live A", "Venue A", None)]))
+    assert lines == ["title=Live A; place=Venue A"]
+
+
+def test_tsv_aliases_repeated_venues_and_prices():
+    lines = list(tsv_lines(SCHEDULE_COLUMNS, SCHEDULE_ROWS))
+    assert lines[0] == "# 略号: P1=新宿BLAZE / P2=SHIBUYA CYCLONE / Y1=Adv 3000 / Door 3500 (+1D)"
+    assert lines[1] == "title\tstart_at\tplace\tprice_details"
+    assert lines[2] == "Live 0\t2025-10-10T19:00:00\tP1\tY1"
+    assert len(lines) == 2 + len(SCHEDULE_ROWS)
+
+
+def test_tsv_keeps_unique_and_short_values():
+    lines = list(tsv_lines(["title", "place"], [("A", "Zepp"), ("B", "Zepp"), ("C", "Unique Hall\tB")]))
+    assert lines == ["title\tplace", "A\tZepp", "B\tZepp", "C\tUnique Hall B"]
+
+
+def test_compact_formats_use_fewer_tokens():
+    def tokens(encoder):
+        return sum(estimate_tokens(line) + 1 for line in encoder(SCHEDULE_COLUMNS, SCHEDULE_ROWS))
+    assert tokens(tsv_lines) < tokens(kv_lines)
+    assert tokens(tsv_lines) < tokens(markdown_lines) * 0.7
+
+
+def test_budget_uses_selected_encoder():
+    rows = SCHEDULE_ROWS * 5
+    markdown = shape_result(SCHEDULE_COLUMNS, rows, max_rows=50, budget_tokens=400)
+    tsv = shape_result(SCHEDULE_COLUMNS, rows, max_rows=50, budget_tokens=400, encoder=tsv_lines)
+    assert len(tsv.columns) > len(markdown.columns) or len(tsv.rows) > len(markdown.rows)
@@ -1,6 +1,15 @@
+import asyncio
 import pytest
 import json
+import time
+from pathlib import Path
 from unittest.mock import MagicMock
+
+import httpx
+from groq import RateLimitError
+
+from src.core import config
+from src.core.admission import AdmissionScheduler
 from src.workers import scheduler
 
 def test_extract_details_with_groq_success(mock_env_vars, mock_groq):
@@ -45,3 +54,181 @@ def test_extract_details_with_groq_exception(mock_env_vars, mock_groq):
     
     result = scheduler.extract_details_with_groq("Title", "Date", "Note")
     assert result == {}
+
+
+# --- 並行抽出 (AsyncGroq) ---
+
+FIXTURES = Path(__file__).parent / "fixtures" / "timetree"
+
+
+def fixture_events() -> list[dict]:
+    events = []
+    for month in ("2025-10", "2025-11", "2025-12"):
+        for page in json.loads((FIXTURES / f"public_events_{month}.json").read_text(encoding="utf-8")):
+            events.extend(page["public_events"])
+    return events
+
+
+def fake_answer(prompt: str) -> MagicMock:
+    """Deterministic extraction: start time from the date in the prompt, venue from the title."""
+    date_str = prompt.split("Date: ", 1)[1].split("\n", 1)[0].strip()
+    title = prompt.split("Title: ", 1)[1].split("\n", 1)[0].strip()
+    data = {"start_at": f"{date_str}T18:30:00+09:00", "end_at": None, "place": f"venue of {title}",
+            "ticket_url": None, "price": "¥3,000", "bonus": None}
+    return MagicMock(choices=[MagicMock(message=MagicMock(content=json.dumps(data)))])
+
+
+def fake_batch_answer(prompt: str, broken: set) -> MagicMock:
+    """Answers every event of a batch prompt like fake_answer; ids in `broken` are dropped or mixed up."""
+    events = json.loads(prompt.split("[Input]", 1)[1].split("\n", 2)[1])
+    answers = []
+    for event in events:
+        single = json.loads(fake_answer(f"Date: {event['date']}\nTitle: {event['title']}\n").choices[0].message.content)
+        if event["source_id"] in broken:
+            if len(answers) % 2:
+                continue
+            single["start_at"] = "1999-01-01T18:30:00+09:00"
+        answers.append({"source_id": event["source_id"], **single})
+    return MagicMock(choices=[MagicMock(message=MagicMock(content=json.dumps({"events": answers})))])
+
+
+class FakeAsyncGroq:
+    def __init__(self, delay=0.05, failures=0, broken=()):
+        self.delay, self.failures, self.broken = delay, failures, set(broken)
+        self.active = self.peak = self.calls = 0
+        self.chat = MagicMock()
+        self.chat.completions.create = self.create
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.failures:
+                self.failures -= 1
+                response = httpx.Response(429, headers={"retry-after": "0.01"},
+                                          request=httpx.Request("POST", "https://api.groq.com"))
+                raise RateLimitError("rate limited", response=response, body=None)
+            prompt = kwargs["messages"][-1]["content"]
+            if '"events"' in prompt:
+                return fake_batch_answer(prompt, self.broken)
+            return fake_answer(prompt)
+        finally:
+            self.active -= 1
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def extraction(mock_env_vars, mock_groq, monkeypatch):
+    mock_groq.chat.completions.create.side_effect = lambda **kwargs: fake_answer(kwargs["messages"][-1]["content"])
+    monkeypatch.setattr(scheduler, "groq_client", mock_groq)
+    monkeypatch.setattr(scheduler, "groq_admission", AdmissionScheduler({}))
+    monkeypatch.setattr(scheduler.time, "sleep", lambda sec: None)
+    items = [scheduler.plan_event(event, {}) for event in fixture_events()]
+    return [item for item in items if item]
+
+
+def test_plan_event_skips_unchanged():
+    event = fixture_events()[0]
+    item = scheduler.plan_event(event, {})
+    assert scheduler.plan_event(event, {item["source_id"]: item["updated_at_dt"].isoformat()}) is None
+    assert scheduler.plan_event(event, {item["source_id"]: "2000-01-01T00:00:00+00:00"}) is not None
+
+
+def test_concurrent_extraction_matches_sequential(extraction):
+    noted = [item for item in extraction if item["note"]]
+    sequential = scheduler.extract_sequential(noted)
+    concurrent, _ = asyncio.run(scheduler.extract_concurrent(noted, 4, client=FakeAsyncGroq(delay=0)))
+
+    assert concurrent == sequential
+    rows = lambda results: [scheduler.build_row(item, results.get(item["source_id"])) for item in extraction]
+    assert rows(concurrent) == rows(sequential)
+
+
+def test_concurrent_extraction_is_bounded_and_faster(extraction):
+    noted = [item for item in extraction if item["note"]][:12]
+    client = FakeAsyncGroq(delay=0.05)
+    start = time.monotonic()
+    results, stats = asyncio.run(scheduler.extract_concurrent(noted, 3, client=client))
+
+    assert client.peak == 3
+    assert len(results) == len(noted)
+    assert time.monotonic() - start < stats["sequential_sec"]
+    assert stats["sequential_sec"] >= 12 * 0.05
+    assert stats["requests"] == 12
+
+
+def test_rate_limited_requests_are_retried(extraction, monkeypatch):
+    monkeypatch.setattr(config, "GROQ_MAX_RETRIES", 3)
+    item = next(item for item in extraction if item["note"])
+    client = FakeAsyncGroq(delay=0, failures=2)
+    result = asyncio.run(scheduler.extract_details_async(
+        client, item["title"], item["dt_obj"].strftime('%Y-%m-%d'), item["note"]))
+    assert client.calls == 3
+    assert result["place"] == f"venue of {item['title']}"
+
+    client = FakeAsyncGroq(delay=0, failures=10)
+    assert asyncio.run(scheduler.extract_details_async(client, "Title", "2025-10-01", "note")) == {}
+    assert client.calls == 4
+
+
+def test_batch_extraction_matches_single_requests(extraction, monkeypatch):
+    monkeypatch.setattr(config, "GROQ_BATCH_MAX_TOKENS", 100000)
+    noted = [item for item in extraction if item["note"]][:20]
+    broken = {noted[3]["source_id"], noted[10]["source_id"], noted[11]["source_id"]}
+    client = FakeAsyncGroq(delay=0, broken=broken)
+    results, stats = asyncio.run(scheduler.extract_concurrent(noted, 2, client=client, batch_size=8))
+
+    singles, _ = asyncio.run(scheduler.extract_concurrent(noted, 2, client=FakeAsyncGroq(delay=0)))
+    assert results == singles
+    assert stats["batches"] == 3 and stats["retried"] == 3
+    assert stats["requests"] == client.calls == 6
+
+
+def test_validate_extraction():
+    item = scheduler.plan_event(fixture_events()[0], {})
+    date_str = item["dt_obj"].strftime('%Y-%m-%d')
+    good = {"source_id": item["source_id"], "start_at": f"{date_str}T25:10:00+09:00", "place": "CLUB"}
+    assert scheduler.validate_extraction(item, good)["place"] == "CLUB"
+    assert scheduler.validate_extraction(item, {**good, "source_id": "other"}) is None
+    assert scheduler.validate_extraction(item, {**good, "start_at": "1999-01-01T18:00:00+09:00"}) is None
+    assert scheduler.validate_extraction(item, {**good, "start_at": "18:00"}) is None
+    assert scheduler.validate_extraction(item, {**good, "price": 3000}) is None
+    assert scheduler.validate_extraction(item, "not an object") is None
+
+
+def test_make_batches_respects_size_and_tokens(extraction):
+    noted = [item for item in extraction if item["note"]]
+    batches = scheduler.make_batches(noted, 4, 100000)
+    assert [item for batch in batches for item in batch] == noted
+    assert all(len(batch) <= 4 for batch in batches)
+    assert all(len(batch) == 1 for batch in scheduler.make_batches(noted, 4, 1))
+
+
+def test_times_only_batch_sends_and_keeps_only_times(extraction, monkeypatch):
+    """The backfill asks only for start_at / end_at; answers without the detail fields are valid"""
+    monkeypatch.setattr(config, "GROQ_BATCH_MAX_TOKENS", 100000)
+    noted = [item for item in extraction if item["note"]][:8]
+    prompts = []
+    client = FakeAsyncGroq(delay=0, broken={noted[2]["source_id"]})
+    create = client.create
+    async def record(**kwargs):
+        prompts.append(kwargs["messages"][-1]["content"])
+        return await create(**kwargs)
+    client.chat.completions.create = record
+
+    results, stats = asyncio.run(scheduler.extract_concurrent(
+        noted, 2, client=client, batch_size=8, fields=scheduler.TIME_FIELDS))
+
+    assert stats["batches"] == 1 and stats["retried"] == 1
+    assert all("ticket_url" not in prompt and "bonus" not in prompt for prompt in prompts)
+    assert all(set(result) == {"start_at", "end_at"} for result in results.values())
+    assert len(results) == len(noted)
+
+    item = noted[0]
+    times_only = {"source_id": item["source_id"], "start_at": f"{item['dt_obj']:%Y-%m-%d}T18:30:00+09:00", "end_at": None}
+    assert scheduler.validate_extraction(item, times_only, scheduler.TIME_FIELDS) == {
+        "start_at": times_only["start_at"], "end_at": None}
@@ -0,0 +1,74 @@
+import pytest
+from src.domain.analytics_service import AnalyticsSnapshot, normalize_start_at
+from src.domain.sql_rewriter import normalize_sql, rewrite_time_predicates
+
+ROWS = [
+    {"title": "JST", "start_at": "2025-12-16T19:00:00+09:00"},
+    {"title": "UTC", "start_at": "2025-12-16T01:00:00+00:00"},
+    {"title": "Naive", "start_at": "2025-12-17T12:00:00"},
+    {"title": "Next Year", "start_at": "2026-01-03T18:00:00+09:00"},
+    {"title": "No Time", "start_at": None},
+]
+
+QUERIES = [
+    "SELECT title FROM schedules WHERE datetime(start_at) >= datetime('2025-12-16T00:00:00') AND datetime(start_at) < datetime('2025-12-17T00:00:00') ORDER BY datetime(start_at)",
+    "SELECT title FROM schedules WHERE datetime('2025-12-17T00:00:00') <= datetime(start_at) ORDER BY datetime(start_at) DESC",
+    "SELECT COUNT(*) FROM schedules WHERE datetime(start_at) BETWEEN datetime('2025-12-01') AND datetime('2025-12-01', '+1 month')",
+    "SELECT title FROM schedules WHERE date(start_at) = '2025-12-16' ORDER BY title",
+    "SELECT date(start_at), COUNT(*) FROM schedules GROUP BY date(start_at) ORDER BY date(start_at)",
+]
+
+
+@pytest.fixture
+def snapshot():
+    snapshot = AnalyticsSnapshot(1, ROWS, "test")
+    yield snapshot
+    snapshot.close()
+
+
+def test_rewrites_datetime_comparisons():
+    sql = rewrite_time_predicates(QUERIES[0])
+    assert "datetime(start_at)" not in sql
+    assert "start_epoch >= CAST(strftime('%s', '2025-12-16T00:00:00') AS INTEGER)" in sql
+    assert sql.endswith("ORDER BY start_epoch")
+
+
+def test_reversed_comparison_is_flipped():
+    sql = rewrite_time_predicates(QUERIES[1])
+    assert "start_epoch >= CAST(strftime('%s', '2025-12-17T00:00:00') AS INTEGER)" in sql
+
+
+def test_select_list_is_untouched():
+    sql = rewrite_time_predicates(QUERIES[4])
+    assert sql.startswith("SELECT date(start_at), COUNT(*)")
+    assert "GROUP BY start_date ORDER BY start_date" in sql
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_rewritten_query_returns_same_rows(snapshot, sql):
+    conn = snapshot.connect()
+    assert conn.execute(rewrite_time_predicates(sql)).fetchall() == conn.execute(sql).fetchall()
+    conn.close()
+
+
+def test_rewritten_query_uses_index(snapshot):
+    conn = snapshot.connect()
+    plan = conn.execute("EXPLAIN QUERY PLAN " + rewrite_time_predicates(QUERIES[0])).fetchall()
+    assert any("idx_schedules_start_epoch" in row[-1] for row in plan)
+    conn.close()
+
+
+def test_start_at_is_normalized_to_local_time(snapshot):
+    conn = snapshot.connect()
+    rows = dict(conn.execute("SELECT title, start_at FROM schedules").fetchall())
+    assert rows["UTC"] == "2025-12-16T10:00:00"
+    assert rows["JST"] == "2025-12-16T19:00:00"
+    assert rows["Naive"] == "2025-12-17T12:00:00"
+    conn.close()
+    assert normalize_start_at("TBA") == "TBA"
+
+
+def test_normalize_sql_keeps_literals():
+    assert normalize_sql("SELECT  title\n FROM Schedules WHERE place = 'Zepp  Shinjuku';") == \
+        "select title from schedules where place = 'Zepp  Shinjuku'"
+    assert normalize_sql("SELECT 1 WHERE x = 'It''s'") == "select 1 where x = 'It''s'"
@@ -76,3 +76,16 @@ class TestSyncScheduleEndpoint:
             assert response.status_code == 200
             assert response.json()["status"] == "started"  # Ensure it wasn't skipped
             mock_submit.assert_called_once()
+
+    def test_sync_refreshes_analytics_snapshot(self):
+        """A finished sync schedules an analytics refresh; a failed one does not"""
+        import src.app.server as server_module
+
+        with patch("src.workers.scheduler.fetch_and_sync") as fetch_and_sync, \
+                patch.object(server_module.bot.analytics, "request_refresh") as request_refresh:
+            server_module._run_sync_with_safeguards()
+            request_refresh.assert_called_once_with(full=True)
+
+            fetch_and_sync.side_effect = RuntimeError("TimeTree down")
+            server_module._run_sync_with_safeguards()
+            request_refresh.assert_called_once()
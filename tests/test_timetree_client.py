@@ -0,0 +1,211 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import date, datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from src.core import config
+from src.workers import timetree_client
+from src.workers.timetree_client import (
+    JST, HostRateLimiter, TimeTreeClient, TimeTreeFetchError, capture_month, fetch_events, is_month_response,
+    month_range_ms, month_starts,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures" / "timetree"
+CALENDAR_URL = "https://timetreeapp.com/public_calendars/lollipop_1116"
+
+
+def fixture_pages(month: str) -> list[dict]:
+    return json.loads((FIXTURES / f"public_events_{month}.json").read_text(encoding="utf-8"))
+
+
+def fixture_handler(request: httpx.Request) -> httpx.Response:
+    """Serves the recorded public_events pages by the month of `from` (and `cursor`)."""
+    start = datetime.fromtimestamp(int(request.url.params["from"]) / 1000, JST)
+    path = FIXTURES / f"public_events_{start:%Y-%m}.json"
+    if not path.exists():
+        return httpx.Response(200, json={"public_events": [], "paging": {}})
+    pages = json.loads(path.read_text(encoding="utf-8"))
+    index = 1 if request.url.params.get("cursor") else 0
+    return httpx.Response(200, json=pages[index])
+
+
+def make_client(handler=fixture_handler, requests=None, **kwargs) -> TimeTreeClient:
+    def record(request):
+        if requests is not None:
+            requests.append(request)
+        return handler(request)
+    kwargs.setdefault("limiter", HostRateLimiter(0))
+    return TimeTreeClient(CALENDAR_URL, client=httpx.Client(transport=httpx.MockTransport(record)), **kwargs)
+
+
+def test_month_helpers():
+    assert month_starts(date(2025, 11, 17), 3) == [date(2025, 11, 1), date(2025, 12, 1), date(2026, 1, 1)]
+    start, end = month_range_ms(date(2025, 10, 1))
+    assert datetime.fromtimestamp(start / 1000, JST) == datetime(2025, 10, 1, tzinfo=JST)
+    assert datetime.fromtimestamp(end / 1000, JST) == datetime(2025, 11, 1, tzinfo=JST)
+
+
+def test_fetch_month_follows_pagination():
+    requests = []
+    client = make_client(requests=requests)
+    events = client.fetch_month(date(2025, 11, 1))
+
+    expected = [e for page in fixture_pages("2025-11") for e in page["public_events"]]
+    assert [e["id"] for e in events] == [e["id"] for e in expected]
+    assert len(requests) == 2
+    assert requests[0].url.path == "/api/v2/public_calendars/lollipop_1116/public_events"
+    assert requests[0].url.params["utc_offset"] == "32400"
+    assert requests[1].url.params["cursor"] == "202511-p2"
+
+
+def test_fetch_months_deduplicates_by_id():
+    events = make_client().fetch_months(month_starts(date(2025, 10, 1), 3))
+    total = sum(len(p["public_events"]) for m in ("2025-10", "2025-11", "2025-12") for p in fixture_pages(m))
+    assert len(events) == total
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(403, text="Forbidden"),
+    httpx.Response(200, text="<html>calendar</html>"),
+    httpx.Response(200, json={"error": "unknown"}),
+])
+def test_unusable_response_raises(response):
+    client = make_client(handler=lambda request: response)
+    with pytest.raises(TimeTreeFetchError):
+        client.fetch_month(date(2025, 10, 1))
+
+
+def test_fetch_events_uses_direct_api_without_browser(monkeypatch):
+    monkeypatch.setattr(config, "TIMETREE_DIRECT_FETCH", True)
+    monkeypatch.setattr(timetree_client, "TimeTreeClient", lambda url: make_client())
+    with patch.object(timetree_client, "fetch_with_browser") as browser:
+        events = fetch_events(month_starts(date(2025, 10, 1), 1))
+    browser.assert_not_called()
+    assert len(events) == len(fixture_pages("2025-10")[0]["public_events"])
+
+
+def test_fetch_events_falls_back_to_browser(monkeypatch):
+    monkeypatch.setattr(config, "TIMETREE_DIRECT_FETCH", True)
+    monkeypatch.setattr(timetree_client, "TimeTreeClient",
+                        lambda url: make_client(handler=lambda request: httpx.Response(404)))
+    with patch.object(timetree_client, "fetch_with_browser", return_value={"ev1": {"id": "ev1"}}) as browser:
+        events = fetch_events(month_starts(date(2025, 10, 1), 2))
+    browser.assert_called_once()
+    assert events == {"ev1": {"id": "ev1"}}
+
+
+def test_host_rate_limiter_spaces_requests():
+    limiter = HostRateLimiter(0.5)
+    assert limiter.reserve("a") == 0
+    assert limiter.reserve("a") == pytest.approx(0.5, abs=0.05)
+    assert limiter.reserve("a") == pytest.approx(1.0, abs=0.05)
+    assert limiter.reserve("b") == 0
+
+
+def test_months_are_fetched_concurrently():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow_handler(request):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+        return fixture_handler(request)
+
+    months = month_starts(date(2025, 7, 1), 6)
+    start = time.monotonic()
+    events = make_client(handler=slow_handler, concurrency=3).fetch_months(months)
+    elapsed = time.monotonic() - start
+
+    assert peak[0] == 3
+    assert elapsed < 0.8  # 7 requests + 3 empty-month retries x 0.1s sequentially
+    assert len(events) == len(make_client().fetch_months(months))
+
+
+def test_concurrent_requests_respect_host_interval():
+    starts = []
+    def handler(request):
+        starts.append(time.monotonic())
+        return fixture_handler(request)
+    make_client(handler=handler, concurrency=4, limiter=HostRateLimiter(0.05)).fetch_months(
+        month_starts(date(2025, 10, 1), 3))
+    starts.sort()
+    assert all(b - a >= 0.045 for a, b in zip(starts, starts[1:]))
+
+
+def test_only_empty_months_are_retried():
+    calls = {}
+    def flaky_handler(request):
+        start = datetime.fromtimestamp(int(request.url.params["from"]) / 1000, JST)
+        key = f"{start:%Y-%m}"
+        calls[key] = calls.get(key, 0) + 1
+        if key == "2025-10" and calls[key] == 1:
+            return httpx.Response(200, json={"public_events": [], "paging": {}})
+        return fixture_handler(request)
+
+    events = make_client(handler=flaky_handler).fetch_months(month_starts(date(2025, 10, 1), 2))
+    assert calls == {"2025-10": 2, "2025-11": 2}  # 11月は2ページ、再取得なし
+    assert len(events) == 14 + 26
+
+
+def test_is_month_response():
+    start, end = month_range_ms(date(2025, 10, 1))
+    api = "https://timetreeapp.com/api/v2/public_calendars/x/public_events"
+    assert is_month_response(f"{api}?from={start - 5 * 86400000}&to={end + 6 * 86400000}", date(2025, 10, 1))
+    assert not is_month_response(f"{api}?from={start}&to={end}", date(2025, 11, 1))
+    assert not is_month_response("https://timetreeapp.com/api/v2/public_calendars/x", date(2025, 10, 1))
+
+
+class FakeResponse:
+    def __init__(self, url, data, status=200):
+        self.url, self.status, self._data = url, status, data
+
+    async def json(self):
+        return self._data
+
+
+class FakePage:
+    """Emits the recorded public_events pages (and an unrelated month) shortly after goto()."""
+    def __init__(self, pages, delay=0.05):
+        self.pages, self.delay, self.listeners = pages, delay, []
+
+    def on(self, event, callback):
+        self.listeners.append(callback)
+
+    async def goto(self, url, **kwargs):
+        loop = asyncio.get_running_loop()
+        api = "https://timetreeapp.com/api/v2/public_calendars/lollipop_1116/public_events"
+        other_start, other_end = month_range_ms(date(2025, 12, 1))
+        responses = [FakeResponse(f"{api}?from={other_start}&to={other_end}", {"public_events": [{"id": "other"}]})]
+        start, end = month_range_ms(date(2025, 11, 1))
+        responses += [FakeResponse(f"{api}?from={start}&to={end}", page) for page in self.pages]
+        for i, response in enumerate(responses):
+            for callback in self.listeners:
+                loop.call_later(self.delay * (i + 1), callback, response)
+
+
+@pytest.mark.asyncio
+async def test_capture_month_completes_on_response():
+    api_urls = set()
+    start = time.monotonic()
+    events = await capture_month(FakePage(fixture_pages("2025-11")), CALENDAR_URL, date(2025, 11, 1), 5, api_urls)
+    assert time.monotonic() - start < 0.5
+    assert len(events) == 26 and "other" not in {e["id"] for e in events}
+    assert api_urls == {"https://timetreeapp.com/api/v2/public_calendars/lollipop_1116/public_events"}
+
+
+@pytest.mark.asyncio
+async def test_capture_month_gives_up_at_timeout():
+    start = time.monotonic()
+    events = await capture_month(FakePage([]), CALENDAR_URL, date(2025, 11, 1), 0.2, set())
+    assert events == []
+    assert time.monotonic() - start < 0.5